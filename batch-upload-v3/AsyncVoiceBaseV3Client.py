@@ -0,0 +1,216 @@
+import asyncio
+import json
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from VoiceBaseV3Client import VoiceBaseV3Client, DEFAULT_DOWNLOAD_CHUNK_SIZE
+from RateLimiter import HttpResponse, RETRY_STATUSES, NOT_PROCESSED_STATUSES
+from Instrumentation import STAGE_HTTP_REQUEST, STAGE_RESPONSE_PARSE
+
+def create_session(**kwargs):
+    """Create a pooled aiohttp session (call from a running event loop)
+
+    pool_maxsize, keep_alive and timeout (a (connect, read) tuple) match
+    the attributes of the same name on VoiceBaseV3Client.
+    """
+    if aiohttp is None:
+        raise ImportError('asyncio mode requires aiohttp (pip install aiohttp)')
+
+    pool_maxsize = int(kwargs.get('pool_maxsize') or 100)
+    connect_timeout, read_timeout = kwargs.get('timeout') or (None, None)
+
+    connector = aiohttp.TCPConnector(
+        limit = pool_maxsize,
+        limit_per_host = pool_maxsize,
+        force_close = not kwargs.get('keep_alive', True)
+    )
+    timeout = aiohttp.ClientTimeout(
+        sock_connect = connect_timeout,
+        sock_read = read_timeout
+    )
+    return aiohttp.ClientSession(connector = connector, timeout = timeout)
+
+class AsyncVoiceBaseV3Client(VoiceBaseV3Client):
+    """asyncio client for the VoiceBase V3 API, built on aiohttp
+
+    Mirrors VoiceBaseV3Client, but get, post and delete (and the media
+    helpers) are coroutines. The aiohttp session belongs to the event loop
+    that first uses it; close() it before that loop ends.
+    """
+
+    def __init__(self, token, **kwargs):
+        if aiohttp is None:
+            raise ImportError(
+                'AsyncVoiceBaseV3Client requires aiohttp (pip install aiohttp)'
+            )
+        super().__init__(token, **kwargs)
+        self._session = None
+        self.media = AsyncVoiceBaseV3Client.VoiceBaseMedia(self)
+
+    async def get(self, relative_url, **kwargs):
+        return await self._request('GET', relative_url, **kwargs)
+
+    async def post(self, relative_url, **kwargs):
+        return await self._request('POST', relative_url, **kwargs)
+
+    async def delete(self, relative_url, **kwargs):
+        return await self._request('DELETE', relative_url, **kwargs)
+
+    async def download(self, relative_url, destination, **kwargs):
+        """GET into a binary file in chunks, returns the HTTP status code
+
+        Chunks are written from a worker thread, off the event loop.
+        """
+        chunk_size = kwargs.pop('chunk_size', DEFAULT_DOWNLOAD_CHUNK_SIZE)
+        url = self._url(relative_url)
+        request_kwargs = self._prepare_kwargs(kwargs)
+        request_kwargs.pop('timeout', None)
+
+        async def send():
+            with self.metrics.stage(STAGE_HTTP_REQUEST):
+                async with self.session.request('GET', url, **request_kwargs) as response:
+                    if response.status not in RETRY_STATUSES:
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            await asyncio.to_thread(destination.write, chunk)
+                            self.metrics.add_bytes_received(len(chunk))
+            self.metrics.record_response(response.status)
+            return HttpResponse(response.status, response.headers, None)
+
+        response = await self.throttle.call_async(
+            send,
+            retry_exceptions = (aiohttp.ClientError, asyncio.TimeoutError),
+            rewind = self._truncater(destination)
+        )
+
+        return response.status_code
+
+    @property
+    def session(self):
+        """The pooled aiohttp session (created on first use)"""
+        if self._session is None or self._session.closed:
+            self._session = create_session(
+                pool_maxsize = self.pool_maxsize,
+                keep_alive = self.keep_alive,
+                timeout = self.timeout
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    class VoiceBaseMedia:
+        """Media class for the asyncio VoiceBase V3 API Client"""
+        def __init__(self, client):
+            self.client = client
+
+        async def get(self):
+            """Get all media list"""
+            return await self.client.get('/media')
+
+        def __getitem__(self, media_id):
+            """Get a media item"""
+
+            return AsyncVoiceBaseV3Client.VoiceBaseMediaItem(self.client, media_id)
+
+        async def post(self, **kwargs):
+            attachments = self.client._new_media_attachments(kwargs)
+
+            return await self.client.post('/media', files = attachments)
+
+    class VoiceBaseMediaItem:
+        """Media item class for the asyncio VoiceBase V3 API Client"""
+        def __init__(self, client, media_id):
+            self.client = client
+            self.media_id = media_id
+
+        async def get(self):
+            """Get a media item"""
+
+            return await self.client.get('/media/' + self.media_id)
+
+        async def download(self, destination, **kwargs):
+            """Stream a media item's JSON into a binary file"""
+
+            return await self.client.download(
+                '/media/' + self.media_id, destination, **kwargs
+            )
+
+        async def delete(self):
+            """Delete a media item"""
+
+            return await self.client.delete('/media/' + self.media_id)
+
+        async def post(self, **kwargs):
+            attachments = self.client._media_update_attachments(kwargs)
+
+            return await self.client.post(
+                '/media/' + self.media_id, files = attachments
+            )
+
+    async def _request(self, method, relative_url, **kwargs):
+        url = self._url(relative_url)
+        request_kwargs = self._prepare_kwargs(kwargs)
+
+        files = request_kwargs.pop('files', None)
+
+        # aiohttp timeouts are set once on the session
+        request_kwargs.pop('timeout', None)
+
+        async def send():
+            attempt_kwargs = { **request_kwargs }
+            if files is not None:
+                # FormData can only be sent once, so build it per attempt
+                payload = self._form_data(files)()
+                attempt_kwargs['data'] = payload
+                if payload.size is not None:
+                    self.metrics.add_bytes_sent(payload.size)
+
+            with self.metrics.stage(STAGE_HTTP_REQUEST):
+                async with self.session.request(method, url, **attempt_kwargs) as response:
+                    body = await response.read()
+            self.metrics.record_response(response.status)
+            self.metrics.add_bytes_received(len(body))
+            return HttpResponse(
+                response.status,
+                response.headers,
+                body.decode(response.get_encoding())
+            )
+
+        response = await self.throttle.call_async(
+            send, rewind = self._rewinder(files), **self._retry_kwargs(method)
+        )
+
+        with self.metrics.stage(STAGE_RESPONSE_PARSE):
+            return json.loads(response.text)
+
+    def _retry_kwargs(self, method):
+        if method == 'POST':
+            return {
+                'retry_exceptions': (aiohttp.ClientConnectorError,),
+                'retry_statuses': NOT_PROCESSED_STATUSES
+            }
+        return {
+            'retry_exceptions': (aiohttp.ClientError, asyncio.TimeoutError)
+        }
+
+    def _form_data(self, attachments):
+        form = aiohttp.FormData()
+        for name, (filename, value, content_type) in attachments.items():
+            form.add_field(
+                name,
+                value,
+                filename = filename,
+                content_type = content_type
+            )
+        return form
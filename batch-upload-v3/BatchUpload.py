@@ -8,13 +8,35 @@
 
 
 import argparse
+import asyncio
+import contextlib
 import csv
+import functools
+import itertools
 import json
 import os
+import sys
 from collections import namedtuple
 
 from VoiceBaseV3Client import VoiceBaseV3Client
+from AsyncVoiceBaseV3Client import AsyncVoiceBaseV3Client
 from BatchUploadInput import *
+from ParallelPipeline import parallel_map, async_map, ORDERS, ORDER_INPUT
+from ParallelPipeline import ORDER_COMPLETION
+from ParallelPipeline import DEFAULT_ASYNCIO_CONCURRENCY
+from UploadJournal import UploadJournal
+from StreamingMultipart import progress_printer
+from Instrumentation import MetricsReporter, STAGE_RESULT_WRITE
+from ManifestPlanner import ManifestPlanner
+from DedupeIndex import DedupeIndex, DEDUPE_MODES, DEDUPE_SKIP
+from MetadataCache import MetadataCache, document_digest
+from UploadScheduler import SCHEDULES, SCHEDULE_INPUT, SCHEDULE_LARGEST_FIRST
+from UploadScheduler import largest_first
+from Sharding import Shard
+from ReorderBuffer import ReorderBuffer, DEFAULT_REORDER_WINDOW
+from BufferedCsvWriter import BufferedCsvWriter, DEFAULT_FLUSH_EVERY
+
+Upload = namedtuple('Upload', 'id response row_number')
 
 # ********* def main ***********
 def main():
@@ -75,8 +97,9 @@ def main():
     )
     parser.add_argument(
         '--results',
-        help = 'path to output csv file of files, media ids, and status',
-        required = True
+        help = 'path to output csv file of files, media ids, and status ' +
+            '(required unless validating)',
+        required = False
     )
     parser.add_argument(
         '--inputCustomVocabColumn',
@@ -85,12 +108,129 @@ def main():
         required = False,
         default = [ ]
     )
+    parser.add_argument(
+        '--configurationCacheSize',
+        help = 'how many distinct custom vocabularies to keep serialized ' +
+            'configurations for (default: ' +
+            str(DEFAULT_CONFIGURATION_CACHE_SIZE) + ')',
+        type = int,
+        required = False
+    )
+    parser.add_argument(
+        '--fastCsvReader',
+        help = 'read --inputCsv into compact records, building each ' +
+            'row\'s metadata JSON only when it is uploaded (for large CSVs)',
+        action = 'store_true',
+        required = False
+    )
     parser.add_argument(
         '--token',
         help = 'Bearer token for /v3 API (defaults to $TOKEN)',
         default = os.environ.get('TOKEN'),
         required = False
     )
+    parser.add_argument(
+        '--parallelism',
+        help = 'Number of concurrent uploads (default 1)',
+        default = 1,
+        type = int,
+        required = False
+    )
+    parser.add_argument(
+        '--asyncio',
+        help = 'Upload from an asyncio event loop (requires aiohttp)',
+        action = 'store_true',
+        required = False
+    )
+    parser.add_argument(
+        '--concurrency',
+        help = 'Uploads in flight with --asyncio (default ' +
+            str(DEFAULT_ASYNCIO_CONCURRENCY) + ')',
+        type = int,
+        required = False
+    )
+    parser.add_argument(
+        '--resultsOrder',
+        help = 'Order of rows in --results with --parallelism: ' +
+            'input (default) or completion',
+        choices = ORDERS,
+        default = ORDER_INPUT,
+        required = False
+    )
+    parser.add_argument(
+        '--schedule',
+        help = 'Order to start uploads in: input (default), or lpt to stat ' +
+            'every file first and start the largest first (results are ' +
+            'still written in --resultsOrder)',
+        choices = SCHEDULES,
+        default = SCHEDULE_INPUT,
+        required = False
+    )
+    parser.add_argument(
+        '--reorderWindow',
+        help = 'With --resultsOrder input, rows held in memory behind a ' +
+            'slow upload before the rest are spilled to a temporary file ' +
+            '(default ' + str(DEFAULT_REORDER_WINDOW) + ')',
+        type = int,
+        required = False
+    )
+    parser.add_argument(
+        '--flushEvery',
+        help = 'Flush --results to disk every this many rows (default ' +
+            str(DEFAULT_FLUSH_EVERY) + ')',
+        type = int,
+        required = False
+    )
+    parser.add_argument(
+        '--journal',
+        help = 'path to the progress journal (default: <results>.journal)',
+        required = False
+    )
+    parser.add_argument(
+        '--resume',
+        help = 'skip rows the journal records as already uploaded',
+        action = 'store_true',
+        required = False
+    )
+    parser.add_argument(
+        '--dedupeIndex',
+        help = 'path to an index of content already uploaded (kept across ' +
+            'runs); rows with the same file content or URL reuse its mediaId',
+        required = False
+    )
+    parser.add_argument(
+        '--dedupeMode',
+        help = 'with --dedupeIndex, what to do for content already ' +
+            'uploaded: skip (default) or metadata (update its metadata)',
+        choices = DEDUPE_MODES,
+        default = DEDUPE_SKIP,
+        required = False
+    )
+    parser.add_argument(
+        '--metadataCache',
+        help = 'with --updateExistingMedia, path to a cache of what was ' +
+            'sent for each mediaId (kept across runs); updates send only ' +
+            'the metadata and configuration that changed, or nothing',
+        required = False
+    )
+    parser.add_argument(
+        '--metadataOnly',
+        help = 'with --updateExistingMedia, send only metadata, never ' +
+            'the configuration',
+        action = 'store_true',
+        required = False
+    )
+    parser.add_argument(
+        '--showProgress',
+        help = 'print upload progress (MB/s) of each file every few seconds ' +
+            '(not with --asyncio)',
+        action = 'store_true',
+        required = False
+    )
+    VoiceBaseV3Client._add_command_line_args(parser)
+    MetricsReporter._add_command_line_args(parser)
+    ManifestPlanner._add_command_line_args(parser)
+    Shard._add_command_line_args(parser)
 
 
     args = parser.parse_args()
@@ -107,20 +247,94 @@ def main():
         input_media_id_column = args.inputMediaIdColumn,
         input_media_url_column = args.inputMediaUrlColumn,
         default_configuration = args.configuration,
-        custom_vocab_columns = args.inputCustomVocabColumn
+        custom_vocab_columns = args.inputCustomVocabColumn,
+        configuration_cache_size = args.configurationCacheSize,
+        fast_csv_reader = args.fastCsvReader,
+        shard = args.shard,
+        parallelism = args.parallelism,
+        use_asyncio = args.asyncio,
+        concurrency = args.concurrency,
+        results_order = args.resultsOrder,
+        schedule = args.schedule,
+        reorder_window = args.reorderWindow,
+        flush_every = args.flushEvery,
+        metadata_only = args.metadataOnly,
+        show_progress = args.showProgress,
+        client_kwargs = VoiceBaseV3Client._client_kwargs(args),
+        metrics_kwargs = MetricsReporter._reporter_kwargs(args)
     )
-    
+
+    if args.validate or args.plan:
+        plan = batch_upload.plan(
+            input_media_filename_list = args.inputMediaFilenameList,
+            input_csv = args.inputCsv,
+            update_existing_media = args.updateExistingMedia,
+            plan_path = args.plan,
+            planner_kwargs = ManifestPlanner._planner_kwargs(args)
+        )
+        print(ManifestPlanner.summary(plan))
+        sys.exit(1 if plan['problems'] else 0)
+
+    if args.results is None:
+        parser.error('--results is required')
+
     batch_upload.process(
         input_media_filename_list = args.inputMediaFilenameList,
         input_csv = args.inputCsv,
         results_path = args.results,
-        update_existing_media = args.updateExistingMedia
+        update_existing_media = args.updateExistingMedia,
+        journal_path = args.journal or args.results + '.journal',
+        resume = args.resume,
+        dedupe_index_path = args.dedupeIndex,
+        dedupe_mode = args.dedupeMode,
+        metadata_cache_path = args.metadataCache
     )
     # batch_upload.upload(args.inputMediaFilenameList, args.mediadir, args.results)
 
 class BatchUpload:
     def __init__(self, **kwargs):
-        self.voicebase = VoiceBaseV3Client(token = kwargs['token'])
+        self.parallelism = int(kwargs.get('parallelism') or 1)
+        self.results_order = kwargs.get('results_order') or ORDER_INPUT
+        self.schedule = kwargs.get('schedule') or SCHEDULE_INPUT
+        self.reorder_window = kwargs.get('reorder_window')
+        self.flush_every = kwargs.get('flush_every')
+        self.metrics_reporter = MetricsReporter(
+            **kwargs.get('metrics_kwargs', {})
+        )
+        self.metrics = self.metrics_reporter.metrics
+
+        client_kwargs = kwargs.get('client_kwargs', {})
+        self.voicebase = VoiceBaseV3Client(
+            token = kwargs['token'],
+            metrics = self.metrics,
+            **VoiceBaseV3Client._sized_client_kwargs(
+                client_kwargs, self.parallelism
+            )
+        )
+
+        self.use_asyncio = kwargs.get('use_asyncio', False)
+        self.concurrency = int(
+            kwargs.get('concurrency') or DEFAULT_ASYNCIO_CONCURRENCY
+        )
+        if self.use_asyncio:
+            self.async_voicebase = AsyncVoiceBaseV3Client(
+                kwargs['token'],
+                throttle = self.voicebase.throttle,
+                metrics = self.metrics,
+                **VoiceBaseV3Client._sized_client_kwargs(
+                    client_kwargs, self.concurrency
+                )
+            )
+
+        self.journal = None
+        self.dedupe = None
+        self.dedupe_mode = DEDUPE_SKIP
+        self.metadata_cache = None
+        # Media updates leave the configuration out
+        self.metadata_only = kwargs.get('metadata_only', False)
+        self.progress = None
+        if kwargs.get('show_progress', False):
+            self.progress = progress_printer()
 
         media_directory = kwargs.get('media_directory')
         input_media_id_column = kwargs.get('input_media_id_column')
@@ -133,7 +347,11 @@ class BatchUpload:
             media_id_column = input_media_id_column,
             media_url_column = input_media_url_column,
             default_configuration = default_configuration,
-            custom_vocab_columns = custom_vocab_columns
+            custom_vocab_columns = custom_vocab_columns,
+            configuration_cache_size = kwargs.get('configuration_cache_size'),
+            fast = kwargs.get('fast_csv_reader', False),
+            shard = kwargs.get('shard'),
+            metrics = self.metrics
         )
 
     # Data classes woule be great here, when Python 3.7 is common
@@ -161,27 +379,101 @@ class BatchUpload:
                 filename = raw_filename.rstrip()
                 yield filename
 
-    def Uploads(self, input_iterable):
-        Upload = namedtuple('Upload', 'id response')
+    def Uploads(self, input_iterable, start_row = 0):
+        # Uploads complete in any order; for --resultsOrder input they are
+        # put back in row order afterwards, so a slow upload does not stop
+        # the others from starting
+        if self.use_asyncio:
+            uploads = async_map(
+                self._upload_async,
+                input_iterable,
+                concurrency = self.concurrency,
+                order = ORDER_COMPLETION,
+                cleanup = self.async_voicebase.close
+            )
+        elif self.parallelism > 1:
+            uploads = parallel_map(
+                self._upload,
+                input_iterable,
+                parallelism = self.parallelism,
+                order = ORDER_COMPLETION
+            )
+        else:
+            uploads = (self._upload(input) for input in input_iterable)
+            if self.schedule == SCHEDULE_INPUT:
+                return uploads
+
+        if self.results_order != ORDER_INPUT:
+            return uploads
 
-        for input in input_iterable:
-            response = self.upload_one(input)
+        return ReorderBuffer(
+            window = self.reorder_window,
+            sequence = lambda upload: upload.row_number,
+            start = start_row
+        ).reorder(uploads)
+
+    def _upload(self, input):
+        completed = self._completed_upload(input)
+        if completed is not None:
+            return completed
+
+        response = self.upload_one(input)
+
+        return Upload(
+            id = input.id, response = response, row_number = input.row_number
+        )
+
+    async def _upload_async(self, input):
+        completed = self._completed_upload(input)
+        if completed is not None:
+            return completed
+
+        response = await self.upload_one_async(input)
+
+        return Upload(
+            id = input.id, response = response, row_number = input.row_number
+        )
 
-            yield Upload(id = input.id, response = response)
+    def _completed_upload(self, input):
+        """The journaled upload of input (when resuming), or None"""
+        if self.journal is None:
+            return None
+
+        entry = self.journal.completed_entry(input.row_number, input.id)
+        if entry is None:
+            return None
+
+        return self._journaled_upload(entry)
+
+    def _journaled_upload(self, entry):
+        return Upload(
+            id = entry.id,
+            response = { 'mediaId': entry.media_id, 'status': entry.status },
+            row_number = entry.row_number
+        )
+
+    def _numbered(self, inputs, start_row):
+        for row_number, input in enumerate(inputs, start_row):
+            input.row_number = row_number
+            yield input
 
     def Results(self, uploads, results_path):
         Result = namedtuple('Result', 'id response row')
-        with open(results_path, 'w') as results_file:
-            results_writer = csv.writer(
-              results_file, delimiter = ',', quotechar = '"'
-            )
-
+        with BufferedCsvWriter(
+            results_path, flush_every = self.flush_every
+        ) as results_writer:
             for upload in uploads:
                 media_id = upload.response.get('mediaId')
                 status = upload.response.get('status')
 
                 row = [ upload.id, media_id, status ]
-                results_writer.writerow(row)
+                with self.metrics.stage(STAGE_RESULT_WRITE):
+                    results_writer.writerow(row)
+
+                    if self.journal is not None:
+                        self.journal.record(
+                            upload.row_number, upload.id, media_id, status
+                        )
 
                 yield Result(
                     id = upload.id,
@@ -195,32 +487,105 @@ class BatchUpload:
         is_media_update = kwargs.get('update_existing_media')
         input_media_id_column = kwargs.get('input_media_id_column')
         results_path = kwargs.get('results_path')
+        journal_path = kwargs.get('journal_path')
+        resume = kwargs.get('resume', False)
+
+        if kwargs.get('dedupe_index_path') is not None:
+            self.dedupe = DedupeIndex(kwargs.get('dedupe_index_path'))
+            self.dedupe_mode = kwargs.get('dedupe_mode') or DEDUPE_SKIP
+        if kwargs.get('metadata_cache_path') is not None:
+            self.metadata_cache = MetadataCache(
+                kwargs.get('metadata_cache_path')
+            )
 
+        start_row = 0
+        if journal_path is not None:
+            self.journal = UploadJournal(journal_path, resume = resume)
+            # Rows up to the first incomplete one are not even parsed
+            start_row = self.journal.resume_row()
 
+        input_generator = self._inputs(
+            input_media_filename_list, input_csv, is_media_update, start_row
+        )
 
+        inputs = self._numbered(input_generator, start_row)
+        if self.schedule == SCHEDULE_LARGEST_FIRST:
+            inputs = largest_first(inputs, parallelism = self.parallelism)
+
+        uploads_generator = self.Uploads(inputs, start_row)
+        if start_row > 0:
+            # Completed rows still go to --results, straight from the journal
+            uploads_generator = itertools.chain(
+                map(
+                    self._journaled_upload,
+                    self.journal.completed_entries(start_row)
+                ),
+                uploads_generator
+            )
+        results_generator = self.Results(uploads_generator, results_path)
+
+        try:
+            with self.metrics_reporter:
+                for result in results_generator:
+                    print(result)
+                cache_info = self.reader.configuration_cache_info()
+                self.metrics.count('configuration_cache_hits', cache_info.hits)
+                self.metrics.count(
+                    'configuration_cache_misses', cache_info.misses
+                )
+        finally:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            if self.dedupe is not None:
+                self.dedupe.close()
+                self.dedupe = None
+            if self.metadata_cache is not None:
+                self.metadata_cache.close()
+                self.metadata_cache = None
+
+
+    def plan(self, **kwargs):
+        """Check the input without uploading, returns ManifestPlanner's plan"""
+        planner = ManifestPlanner(
+            media_directory = self.reader.media_directory,
+            upload_parallelism = self.concurrency if self.use_asyncio \
+                else self.parallelism,
+            **kwargs.get('planner_kwargs', {})
+        )
+        plan = planner.plan(self._inputs(
+            kwargs.get('input_media_filename_list'),
+            kwargs.get('input_csv'),
+            kwargs.get('update_existing_media'),
+            0
+        ))
+
+        plan_path = kwargs.get('plan_path')
+        if plan_path is not None:
+            ManifestPlanner.write_plan(plan, plan_path)
+        return plan
+
+    def _inputs(self, input_media_filename_list, input_csv, is_media_update,
+            start_row):
         if input_media_filename_list is not None:
-            input_generator = self.reader.MediaFilenames(
-                list_filepath = input_media_filename_list
+            return self.reader.MediaFilenames(
+                list_filepath = input_media_filename_list,
+                start_row = start_row
             )
         elif input_csv is not None:
             if not is_media_update:
-                input_generator = self.reader.CsvNewUploads(
-                    csv_filepath = input_csv
+                return self.reader.CsvNewUploads(
+                    csv_filepath = input_csv,
+                    start_row = start_row
                 )
             else:
-                input_generator = self.reader.CsvMediaUpdates(
-                    csv_filepath = input_csv
+                return self.reader.CsvMediaUpdates(
+                    csv_filepath = input_csv,
+                    start_row = start_row
                 )
         else:
             raise Exception('other input types not supported')
 
-        uploads_generator = self.Uploads(input_generator)
-        results_generator = self.Results(uploads_generator, results_path)
-
-        for result in results_generator:
-            print(result)
-
-
     # ********* def generate config json ***********
     def generate_configuration(self):
       # Note: we are intentionally going against Python's recommending
@@ -229,33 +594,179 @@ class BatchUpload:
 
     # ********* def upload one ***********
     def upload_one(self, input): #filepath, filename, configuration):
+        key, existing = self._dedupe_claim(input)
+        if existing is not None:
+            request = self._duplicate_request(self.voicebase, input, existing)
+            return request()
+
+        response = None
+        try:
+            with self._open_media(input) as media_file:
+                request = self._upload_request(self.voicebase, input, media_file)
+                response = request()
+        finally:
+            self._dedupe_release(key, response)
+        return response
+
+    async def upload_one_async(self, input):
+        # Only the hashing runs on a thread: waiting for a duplicate upload
+        # in flight there would hold the executor threads that upload needs
+        key = await asyncio.to_thread(self._dedupe_key, input)
+        existing = None
+        if key is not None:
+            existing = await self.dedupe.claim_async(key)
+            self._dedupe_claimed(existing)
+        if existing is not None:
+            request = self._duplicate_request(
+                self.async_voicebase, input, existing
+            )
+            return await request()
+
+        response = None
+        try:
+            with self._open_media(input) as media_file:
+                request = self._upload_request(self.async_voicebase, input, media_file)
+                response = await request()
+        finally:
+            self._dedupe_release(key, response)
+        return response
+
+    def _dedupe_claim(self, input):
+        """(dedupe key, (mediaId, status) already uploaded or None)"""
+        key = self._dedupe_key(input)
+        if key is None:
+            return None, None
+
+        existing = self.dedupe.claim(key)
+        self._dedupe_claimed(existing)
+        return key, existing
+
+    def _dedupe_key(self, input):
+        """The dedupe key of input's content, or None when not deduplicated"""
+        if self.dedupe is None or input.is_media_update:
+            return None
+        if input.is_file:
+            return self.dedupe.file_key(input.media_filepath)
+        return self.dedupe.url_key(input.media_url)
+
+    def _dedupe_claimed(self, existing):
+        if existing is not None:
+            self.metrics.count('dedupe_hits')
+
+    def _dedupe_release(self, key, response):
+        if key is None:
+            return
+        if response is not None:
+            self.dedupe.release(
+                key, response.get('mediaId'), response.get('status')
+            )
+        else:
+            self.dedupe.release(key)
+
+    def _duplicate_request(self, voicebase, input, existing):
+        """The request for content already uploaded (sync or async)"""
+        media_id, status = existing
+        if self.dedupe_mode == DEDUPE_SKIP:
+            return self._skipped_request(
+                voicebase, { 'mediaId': media_id, 'status': status }
+            )
+
+        return functools.partial(
+            voicebase.media[media_id].post,
+            metadata = input.metadata
+        )
+
+    def _skipped_request(self, voicebase, response):
+        """A request (sync or async) answering response without sending"""
+        if voicebase is self.voicebase:
+            return lambda: response
+
+        async def skipped():
+            return response
+        return skipped
+
+    def _media_update_request(self, voicebase, input):
+        """The media update post for input (sync or async)
+
+        With a metadata cache, the metadata and the configuration are only
+        sent if they differ from what was last sent for the media, and an
+        update with nothing new is not sent at all.
+        """
+        configuration = None if self.metadata_only else input.configuration
+        metadata = input.metadata
+        if self.metadata_cache is None:
+            return functools.partial(
+                voicebase.media[input.media_id].post,
+                configuration = configuration,
+                metadata = metadata
+            )
+
+        metadata_digest = document_digest(metadata)
+        configuration_digest = document_digest(configuration)
+        sent = self.metadata_cache.get(input.media_id)
+        if sent is not None:
+            if metadata_digest == sent.metadata:
+                metadata = metadata_digest = None
+            if configuration is not None and \
+                    configuration_digest == sent.configuration:
+                configuration = configuration_digest = None
+                self.metrics.count('configurations_omitted')
+            if metadata is None and configuration is None:
+                self.metrics.count('media_updates_skipped')
+                return self._skipped_request(voicebase, {
+                    'mediaId': input.media_id, 'status': sent.status
+                })
+
+        post = functools.partial(
+            voicebase.media[input.media_id].post,
+            configuration = configuration,
+            metadata = metadata
+        )
+
+        def record(response):
+            if response.get('mediaId'):
+                self.metadata_cache.record(
+                    input.media_id, metadata_digest, configuration_digest,
+                    response.get('status')
+                )
+            return response
+
+        if voicebase is self.voicebase:
+            return lambda: record(post())
+
+        async def update():
+            return record(await post())
+        return update
+
+    def _open_media(self, input):
+        if input.is_file:
+            return open(input.media_filepath, 'rb')
+        return contextlib.nullcontext()
+
+    def _upload_request(self, voicebase, input, media_file):
+        """The media post for input, as a call on voicebase (sync or async)"""
         if input.is_url:
-            response = self.voicebase.media.post(
+            return functools.partial(
+                voicebase.media.post,
                 media_url = input.media_url,
                 configuration = input.configuration,
                 metadata = input.metadata
             )
         elif input.is_file:
-            with open(input.media_filepath, 'rb') as media_file:
-
-                response = self.voicebase.media.post(
-                    media = media_file,
-                    filename = input.media_filename,
-                    mime_type = input.mime_type,
-                    configuration = input.configuration,
-                    metadata = input.metadata
-                )
-
-        elif input.is_media_update:
-            response = self.voicebase.media[input.media_id].post(
+            return functools.partial(
+                voicebase.media.post,
+                media = media_file,
+                filename = input.media_filename,
+                mime_type = input.mime_type,
                 configuration = input.configuration,
-                metadata = input.metadata
+                metadata = input.metadata,
+                progress = self.progress
             )
+        elif input.is_media_update:
+            return self._media_update_request(voicebase, input)
         else:
             raise Exception('no known type - none of: file, url, media update')
 
-        return response
-
 
 if __name__ == "__main__":
   main()
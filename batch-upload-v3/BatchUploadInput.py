@@ -1,12 +1,24 @@
 import os
 import json
 import csv
+import functools
+import itertools
+
+from Instrumentation import NULL_METRICS, STAGE_CSV_READ, STAGE_CONFIG_BUILD
+
+DEFAULT_CONFIGURATION_CACHE_SIZE = 4096
+CUSTOM_VOCAB_WEIGHT = 2
+
+# ASCII unit separator, for packing a row's values into one string
+FIELD_SEPARATOR = '\x1f'
 
 class BatchUploadInput:
     def __init__(self, **kwargs):
         self.is_url = kwargs.get('is_url', False)
         self.is_file = kwargs.get('is_file', False)
         self.is_media_update = kwargs.get('is_media_update', False)
+        # Position in the input, set by BatchUpload when journaling
+        self.row_number = kwargs.get('row_number')
 
         if self.is_media_update:
             self.media_id = kwargs.get('media_id')
@@ -123,6 +135,132 @@ class BatchUploadNewMediaInput(BatchUploadInput):
 
         super().__init__(**super_kwargs)
 
+class BatchUploadCsvRecord:
+    """A CSV row as an upload input, for the fast reader
+
+    Holds only the row's values, packed into one string, and its file's
+    shared _CsvLayout, so millions can be queued cheaply. The metadata and
+    configuration JSON are built when the upload reads them.
+    """
+    __slots__ = ('layout', 'packed', 'id', 'row_number')
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.id = values[layout.id_index] if layout.id_index < len(values) \
+            else None
+        if not self.id:
+            raise Exception(
+                'no valid ' + layout.header[layout.id_index] + ': ' + str(values)
+            )
+        self.row_number = None
+
+        packed = FIELD_SEPARATOR.join(values)
+        if packed.count(FIELD_SEPARATOR) != len(values) - 1:
+            # A value contains the separator itself
+            packed = tuple(values)
+        self.packed = packed
+
+    @property
+    def values(self):
+        if type(self.packed) is str:
+            return self.packed.split(FIELD_SEPARATOR)
+        return self.packed
+
+    @property
+    def is_url(self):
+        return self.layout.is_url
+
+    @property
+    def is_file(self):
+        return self.layout.is_file
+
+    @property
+    def is_media_update(self):
+        return self.layout.is_media_update
+
+    @property
+    def media_url(self):
+        return self.id if self.layout.is_url else None
+
+    @property
+    def media_id(self):
+        return self.id if self.layout.is_media_update else None
+
+    @property
+    def media_filename(self):
+        return self.id if self.layout.is_file else None
+
+    @property
+    def media_filepath(self):
+        if not self.layout.is_file:
+            return None
+        return os.path.join(self.layout.reader.media_directory, self.id)
+
+    @property
+    def mime_type(self):
+        return None
+
+    @property
+    def configuration(self):
+        return self.layout.configuration(self.values)
+
+    @property
+    def metadata(self):
+        return self.layout.metadata(self.values)
+
+class _CsvLayout:
+    """Column positions of one CSV, resolved once from its header"""
+    def __init__(self, reader, header, id_column, **kwargs):
+        self.reader = reader
+        self.header = header
+        self.is_media_update = kwargs.get('is_media_update', False)
+        self.is_url = kwargs.get('is_url', False)
+        self.is_file = not (self.is_media_update or self.is_url)
+
+        self.id_index = header.index(id_column)
+        self.extended_columns = [
+            (index, column)
+            for index, column in enumerate(header)
+            if index != self.id_index
+        ]
+        # New media always get extended metadata, as with the dict reader
+        self.extends = len(self.extended_columns) > 0 or \
+            not self.is_media_update
+        self.vocab_indices = [
+            header.index(column)
+            for column in reader.custom_vocab_columns or []
+            if column in header
+        ]
+
+    def configuration(self, values):
+        reader = self.reader
+        if self.is_media_update or not reader.custom_vocab_columns:
+            configuration = reader.default_configuration
+            if configuration is not None and type(configuration) is not str:
+                configuration = json.dumps(configuration)
+            return configuration
+
+        terms = tuple(
+            values[index]
+            for index in self.vocab_indices
+            if index < len(values) and len(values[index]) > 0
+        )
+        return reader._serialized_configuration(terms)
+
+    def metadata(self, values):
+        metadata = { **self.reader.default_metadata }
+        if self.extends:
+            metadata['extended'] = {
+                **metadata.get('extended', {}),
+                **{
+                    column: values[index] if index < len(values) else None
+                    for index, column in self.extended_columns
+                }
+            }
+            if not self.is_media_update:
+                metadata['extended'].pop(self.header[self.id_index], None)
+        return json.dumps(metadata)
+
 class BatchUploadListReader:
     def __init__(self, **kwargs):
         self.media_directory = kwargs.get('media_directory', './')
@@ -138,10 +276,28 @@ class BatchUploadListReader:
         self.default_metadata = kwargs.get('default_metadata', {})
         self.default_configuration = kwargs.get('default_configuration', {})
         self.custom_vocab_columns = kwargs.get('custom_vocab_columns', [])
+        self.metrics = kwargs.get('metrics') or NULL_METRICS
+        # Read CSVs as BatchUploadCsvRecords rather than dicts and inputs
+        self.fast = kwargs.get('fast', False)
+        # Only read the rows in this Sharding.Shard (row numbers count
+        # only those rows)
+        self.shard = kwargs.get('shard')
+
+        # Rows usually repeat the same custom vocabulary, so the serialized
+        # configuration is memoized on the tuple of terms
+        self._base_configuration = None
+        self._serialized_configuration = functools.lru_cache(
+            maxsize = int(
+                kwargs.get('configuration_cache_size') or
+                DEFAULT_CONFIGURATION_CACHE_SIZE
+            )
+        )(self._serialize_configuration)
 
-    def MediaFilenames(self, list_filepath):
+    def MediaFilenames(self, list_filepath, start_row = 0):
         with open(list_filepath, 'r') as list_file:
-            for raw_filename in list_file:
+            lines = self._sharded(list_file, lambda line: line.rstrip())
+            lines = itertools.islice(lines, start_row, None)
+            for raw_filename in self.metrics.timed(STAGE_CSV_READ, lines):
                 media_filename = raw_filename.rstrip()
                 media_filepath = os.path.join(
                     self.media_directory,
@@ -152,56 +308,133 @@ class BatchUploadListReader:
                     media_filename = media_filename
                 )
 
-    def CsvNewUploads(self, csv_filepath):
-        for row in self._CsvReader(csv_filepath):
+    def CsvNewUploads(self, csv_filepath, start_row = 0):
+        if self.fast:
+            return self._CsvRecords(csv_filepath, start_row, False)
+        return self._CsvNewUploads(csv_filepath, start_row)
+
+    def _CsvNewUploads(self, csv_filepath, start_row):
+        for row in self._CsvReader(
+            csv_filepath, start_row,
+            [ self.media_filename_column, self.media_url_column ]
+        ):
+            with self.metrics.stage(STAGE_CONFIG_BUILD):
+                upload_input = self._new_upload_input(row)
+            yield upload_input
+
+    def _new_upload_input(self, row):
+        metadata = self._extend_metadata(row)
+        configuration = self._extend_configuration(row)
+
+        input_kwargs = {
+            'configuration': configuration,
+            'metadata': metadata
+        }
 
-            metadata = self._extend_metadata(row)
-            configuration = self._extend_configuration(row)
+        if self.media_filename_column in row:
+            media_filename = row[self.media_filename_column]
+            del metadata['extended'][self.media_filename_column]
 
-            input_kwargs = {
-                'configuration': configuration,
-                'metadata': metadata
-            }
+            input_kwargs['media_filename'] = media_filename
 
-            if self.media_filename_column in row:
-                media_filename = row[self.media_filename_column]
-                del metadata['extended'][self.media_filename_column]
+            media_filepath = os.path.join(
+                self.media_directory,
+                media_filename
+            )
 
-                input_kwargs['media_filename'] = media_filename
+            input_kwargs['media_filepath'] = media_filepath
 
-                media_filepath = os.path.join(
-                    self.media_directory,
-                    media_filename
-                )
+        elif self.media_url_column in row:
+            media_url = row[self.media_url_column]
+            del metadata['extended'][self.media_url_column]
 
-                input_kwargs['media_filepath'] = media_filepath
+            input_kwargs['media_url'] = media_url
 
-            elif self.media_url_column in row:
-                media_url = row[self.media_url_column]
-                del metadata['extended'][self.media_url_column]
+        return BatchUploadNewMediaInput(**input_kwargs)
 
-                input_kwargs['media_url'] = media_url
+    def CsvMediaUpdates(self, csv_filepath, start_row = 0):
+        if self.fast:
+            return self._CsvRecords(csv_filepath, start_row, True)
+        return self._CsvMediaUpdates(csv_filepath, start_row)
 
-            yield BatchUploadNewMediaInput(**input_kwargs)
+    def _CsvMediaUpdates(self, csv_filepath, start_row):
+        for row in self._CsvReader(
+            csv_filepath, start_row, [ self.media_id_column ]
+        ):
+            with self.metrics.stage(STAGE_CONFIG_BUILD):
+                update_input = self._media_update_input(row)
+            yield update_input
 
-    def CsvMediaUpdates(self, csv_filepath):
-        for row in self._CsvReader(csv_filepath):
-            media_id = row[self.media_id_column]
-            del row[self.media_id_column]
+    def _media_update_input(self, row):
+        media_id = row[self.media_id_column]
+        del row[self.media_id_column]
 
-            metadata = self._extend_metadata(row)
-            yield BatchUploadMediaUpdateInput(
-                media_id = media_id,
-                configuration = self.default_configuration,
-                metadata = metadata
-            )
+        metadata = self._extend_metadata(row)
+        return BatchUploadMediaUpdateInput(
+            media_id = media_id,
+            configuration = self.default_configuration,
+            metadata = metadata
+        )
+
+    def _CsvReader(self, csv_filepath, start_row = 0, id_columns = []):
+        """Rows of the CSV from start_row on (skipped rows are only split)
 
-    def _CsvReader(self, csv_filepath):
+        With a shard, rows are sharded on the first of id_columns the CSV has.
+        """
         with open(csv_filepath, 'r') as csv_file:
             reader = csv.DictReader(csv_file)
-            for row in reader:
+            id_column = next(
+                (
+                    column for column in id_columns
+                    if column in (reader.fieldnames or [])
+                ),
+                None
+            )
+            rows = self._sharded(reader, lambda row: row.get(id_column))
+            rows = itertools.islice(rows, start_row, None)
+            for row in self.metrics.timed(STAGE_CSV_READ, rows):
                 yield row
 
+    def _CsvRecords(self, csv_filepath, start_row, is_media_update):
+        with open(csv_filepath, 'r', newline = '') as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader, None)
+            if header is None:
+                return
+            layout = self._csv_layout(header, is_media_update)
+
+            # Blank lines are skipped, as by DictReader
+            id_index = layout.id_index
+            rows = self._sharded(
+                filter(None, reader),
+                lambda values: values[id_index] if id_index < len(values) \
+                    else None
+            )
+            rows = itertools.islice(rows, start_row, None)
+            for values in self.metrics.timed(STAGE_CSV_READ, rows):
+                yield BatchUploadCsvRecord(layout, values)
+
+    def _sharded(self, rows, id):
+        if self.shard is None:
+            return rows
+        return self.shard.filter(rows, id)
+
+    def _csv_layout(self, header, is_media_update):
+        if is_media_update:
+            return _CsvLayout(
+                self, header, self.media_id_column, is_media_update = True
+            )
+        if self.media_filename_column in header:
+            return _CsvLayout(self, header, self.media_filename_column)
+        if self.media_url_column in header:
+            return _CsvLayout(
+                self, header, self.media_url_column, is_url = True
+            )
+        raise Exception(
+            'no ' + self.media_filename_column + ' or ' +
+            self.media_url_column + ' column'
+        )
+
     def _extend_metadata(self, row):
         metadata = { **self.default_metadata }
         if len(row) > 0:
@@ -214,37 +447,56 @@ class BatchUploadListReader:
         return metadata
 
     def _extend_configuration(self, row):
+        """Configuration JSON (str) for a row, with its custom vocabulary"""
         custom_vocab_columns = self.custom_vocab_columns
         if custom_vocab_columns is None or len(custom_vocab_columns) == 0:
             return self.default_configuration
 
-        if type(self.default_configuration) is str:
-            configuration = json.loads(self.default_configuration)
-        else:
-            configuration = { ** self.default_configuration }
-
-        if not ('vocabularies' in configuration):
-            configuration['vocabularies'] = []
-
-        vocabularies = configuration['vocabularies']
-
         flat_terms = [
             row.get(column)
             for column
-            in self.custom_vocab_columns
+            in custom_vocab_columns
         ]
 
-        terms = [
-            { 'term': term, 'weight': 2 }
+        terms = tuple(
+            term
             for term
             in flat_terms
             if (term is not None) and (len(term) > 0)
-        ]
+        )
+
+        return self._serialized_configuration(terms)
 
-        additional_vocabulary = { 'terms': terms }
-        vocabularies.append(additional_vocabulary)
+    def _serialize_configuration(self, terms):
+        configuration = self._parsed_default_configuration()
+
+        additional_vocabulary = {
+            'terms': [
+                { 'term': term, 'weight': CUSTOM_VOCAB_WEIGHT }
+                for term
+                in terms
+            ]
+        }
 
-        return configuration
+        return json.dumps({
+            **configuration,
+            'vocabularies': configuration.get('vocabularies', []) + [
+                additional_vocabulary
+            ]
+        })
+
+    def _parsed_default_configuration(self):
+        """default_configuration as a dict, parsed once"""
+        if self._base_configuration is None:
+            if type(self.default_configuration) is str:
+                self._base_configuration = json.loads(self.default_configuration)
+            else:
+                self._base_configuration = { **self.default_configuration }
+        return self._base_configuration
+
+    def configuration_cache_info(self):
+        """hits, misses, maxsize and currsize of the configuration cache"""
+        return self._serialized_configuration.cache_info()
 
 if __name__ == '__main__':
     reader = BatchUploadListReader(media_directory = './')
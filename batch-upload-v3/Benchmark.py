@@ -0,0 +1,860 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from BatchUpload import BatchUpload
+from BatchUploadInput import BatchUploadListReader
+import Extract
+from ManifestPlanner import ManifestPlanner
+from MockVoiceBaseServer import MockVoiceBaseServer
+from ParallelCallbackTester import ParallelCallbackTester
+from ParallelDownloader import ParallelDownloader
+from VoiceBaseV3Client import VoiceBaseV3Client
+
+# Benchmarks against a local mock of the VoiceBase V3 API
+#
+# command line example
+#  python Benchmark.py pooling --requests 2000 --threads 8
+#  python Benchmark.py download --rows 150 --parallelism 100 --latency 0.05
+#  python Benchmark.py uploadMemory --sizeMb 256 --files 4
+#  python Benchmark.py pipelines --rows 100 --parallelism 8 --throttleRate 0.02
+#  python Benchmark.py configuration --rows 1000000 --distinctTerms 100
+#  python Benchmark.py csvIngest --rows 1000000 --columns 10
+#  python Benchmark.py plan --files 1000000
+#  python Benchmark.py schedule --smallFiles 60 --largeFiles 3 --parallelism 4
+#  python Benchmark.py extract --documents 200 --words 20000
+
+def timed_requests(client, media_id, total_requests, threads):
+    """Run total_requests media GETs across threads, returns requests/sec"""
+    counter = iter(range(total_requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            client.media[media_id].get()
+
+    workers = [
+        threading.Thread(target = worker) for _ in range(threads)
+    ]
+
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+
+    return total_requests / elapsed
+
+def benchmark_pooling(args):
+    with MockVoiceBaseServer() as server:
+        media_id = server.create_media()['mediaId']
+
+        for keep_alive in [ False, True ]:
+            client = VoiceBaseV3Client(
+                'benchmark',
+                api_url = server.url,
+                pool_maxsize = args.threads,
+                keep_alive = keep_alive
+            )
+
+            rate = timed_requests(client, media_id, args.requests, args.threads)
+            client.close()
+
+            print(
+                'pooling' if keep_alive else 'no pooling',
+                '-', args.requests, 'requests,', args.threads, 'threads:',
+                '%.1f requests/sec' % rate
+            )
+
+class LegacyParallelDownloader(ParallelDownloader):
+    """The previous multiprocessing ParallelDownloader, for comparison
+
+    It enqueues the whole input before reading any response, so it
+    deadlocks once the input outgrows its two 100-item queues; keep
+    --rows below about 200 when comparing.
+    """
+    def __init__(self, **kwargs):
+        super(LegacyParallelDownloader, self).__init__(**kwargs)
+        self.max_queue_size = 100
+        self.request_queue = mp.Queue(maxsize = self.max_queue_size)
+        self.response_queue = mp.Queue(maxsize = self.max_queue_size)
+
+    def download(self, results):
+        def parallel_processor(parallel_downloader):
+            while True:
+                result = parallel_downloader.request_queue.get()
+                if result is None:
+                    break
+
+                download = parallel_downloader.download_one(result)
+                self.response_queue.put(download)
+
+        pool = mp.Pool(
+            self.parallelism,
+            initializer = parallel_processor,
+            initargs = [self]
+        )
+
+        total_results = 0
+        for result in results:
+            self.request_queue.put(result)
+            total_results = total_results + 1
+
+        for _ in range(self.parallelism):
+            self.request_queue.put(None)
+
+        for i in range(total_results):
+            yield self.response_queue.get()
+
+        pool.close()
+        pool.join()
+
+def timed_download(downloader_class, server_url, directory, **kwargs):
+    """Run a downloader over the results CSV in directory, returns rows/sec"""
+    downloader = downloader_class(
+        input_csv = os.path.join(directory, 'results.csv'),
+        download_directory = directory,
+        output_csv = os.path.join(directory, 'downloads.csv'),
+        token = 'benchmark',
+        client_kwargs = { 'api_url': server_url },
+        **kwargs
+    )
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = sum(1 for _ in downloader.output(downloader.download(downloader.input())))
+    elapsed = time.perf_counter() - start
+
+    return rows / elapsed
+
+def benchmark_download(args):
+    with MockVoiceBaseServer(latency = args.latency) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'results.csv'), 'w') as results_file:
+            results_writer = csv.writer(results_file)
+            for i in range(args.rows):
+                media_id = server.create_media()['mediaId']
+                results_writer.writerow([ str(i), media_id, 'accepted' ])
+
+        runs = [ ('thread pipeline', ParallelDownloader) ]
+        if args.rows <= 150:
+            runs.insert(0, ('multiprocessing (previous)', LegacyParallelDownloader))
+        else:
+            print('skipping the previous implementation: it deadlocks above ~200 rows')
+
+        for name, downloader_class in runs:
+            rate = timed_download(
+                downloader_class,
+                server.url,
+                directory,
+                parallelism = args.parallelism
+            )
+            print(
+                name, '-', args.rows, 'rows, parallelism', args.parallelism,
+                'latency', args.latency, ':', '%.1f rows/sec' % rate
+            )
+
+class LegacyUploadClient(VoiceBaseV3Client):
+    """Uploads through requests' files=, which builds the whole body first"""
+    def _multipart_kwargs(self, request_kwargs, files, progress):
+        return { **request_kwargs, 'files': files }
+
+def peak_upload_memory(client, filepaths):
+    """Upload filepaths concurrently, returns the peak Python heap in bytes"""
+    errors = []
+
+    def upload(filepath):
+        try:
+            with open(filepath, 'rb') as media_file:
+                client.media.post(
+                    media = media_file,
+                    filename = os.path.basename(filepath),
+                    mime_type = 'audio/wav'
+                )
+        except Exception as error:
+            errors.append(error)
+
+    tracemalloc.start()
+    try:
+        workers = [
+            threading.Thread(target = upload, args = [ filepath ])
+            for filepath in filepaths
+        ]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        if errors:
+            raise Exception(
+                str(len(errors)) + ' of ' + str(len(filepaths)) +
+                ' uploads failed, e.g. ' + repr(errors[0])
+            )
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_upload_memory(args):
+    with MockVoiceBaseServer() as server, \
+            tempfile.TemporaryDirectory() as directory:
+        filepaths = []
+        for i in range(args.files):
+            filepath = os.path.join(directory, 'synthetic' + str(i) + '.wav')
+            with open(filepath, 'wb') as media_file:
+                # Sparse, so it costs no disk
+                media_file.truncate(args.sizeMb * 1024 * 1024)
+            filepaths.append(filepath)
+
+        for name, client_class in [
+            ('streaming multipart', VoiceBaseV3Client),
+            ('requests files= (previous)', LegacyUploadClient)
+        ]:
+            client = client_class(
+                'benchmark', api_url = server.url, pool_maxsize = args.files
+            )
+
+            start = time.perf_counter()
+            peak = peak_upload_memory(client, filepaths)
+            elapsed = time.perf_counter() - start
+            client.close()
+
+            print(
+                name, '-', args.files, 'x', args.sizeMb, 'MB:',
+                'peak heap %.1f MB,' % (peak / 1e6),
+                '%.1f MB/s' % (args.files * args.sizeMb / elapsed)
+            )
+
+def percentiles(latencies):
+    """p50, p90, p99 and max of a list of latencies"""
+    ordered = sorted(latencies)
+    if len(ordered) == 0:
+        return [ 0.0 ] * 4
+
+    def percentile(share):
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+    return [ percentile(0.5), percentile(0.9), percentile(0.99), ordered[-1] ]
+
+def report(stage, rows, elapsed, latencies):
+    print(
+        '%-10s %6d rows %8.1f rows/sec   ' % (stage, rows, rows / elapsed) +
+        'latency p50 %.3fs p90 %.3fs p99 %.3fs max %.3fs' % tuple(
+            percentiles(latencies)
+        )
+    )
+
+class TimedBatchUpload(BatchUpload):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+
+    def upload_one(self, input):
+        start = time.perf_counter()
+        response = super().upload_one(input)
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+class TimedParallelDownloader(ParallelDownloader):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+
+    def download_one(self, result):
+        start = time.perf_counter()
+        download = super().download_one(result)
+        self.latencies.append(time.perf_counter() - start)
+        return download
+
+class TimedParallelCallbackTester(ParallelCallbackTester):
+    def test_one(self, download):
+        # Carry the latency back on the row
+        start = time.perf_counter()
+        test = super().test_one(download)
+        test.latency = time.perf_counter() - start
+        return test
+
+def timed_stage(run):
+    """Run a pipeline stage quietly, returns (rows, elapsed seconds)"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = run()
+    return rows, time.perf_counter() - start
+
+def benchmark_pipelines(args):
+    server = MockVoiceBaseServer(
+        latency = args.latency,
+        error_rate = args.errorRate,
+        throttle_rate = args.throttleRate,
+        retry_after = 0.1,
+        # Media are finished by the time they are downloaded
+        processing_time = 0,
+        transcript_words = args.transcriptWords,
+        seed = 0
+    )
+    with server, tempfile.TemporaryDirectory() as directory:
+        client_kwargs = {
+            'api_url': server.url,
+            'max_retries': 10
+        }
+
+        filenames = []
+        for i in range(args.rows):
+            filename = 'media' + str(i) + '.wav'
+            with open(os.path.join(directory, filename), 'wb') as media_file:
+                media_file.write(os.urandom(args.sizeKb * 1024))
+            filenames.append(filename)
+        list_path = os.path.join(directory, 'media.txt')
+        with open(list_path, 'w') as list_file:
+            list_file.write('\n'.join(filenames) + '\n')
+
+        results_path = os.path.join(directory, 'results.csv')
+        downloads_path = os.path.join(directory, 'downloads.csv')
+
+        batch_upload = TimedBatchUpload(
+            token = 'benchmark',
+            media_directory = directory,
+            parallelism = args.parallelism,
+            client_kwargs = client_kwargs
+        )
+
+        def upload():
+            batch_upload.process(
+                input_media_filename_list = list_path,
+                results_path = results_path
+            )
+            return args.rows
+
+        rows, elapsed = timed_stage(upload)
+        report('upload', rows, elapsed, batch_upload.latencies)
+
+        downloader = TimedParallelDownloader(
+            input_csv = results_path,
+            download_directory = directory,
+            output_csv = downloads_path,
+            token = 'benchmark',
+            parallelism = args.parallelism,
+            client_kwargs = client_kwargs
+        )
+
+        def download():
+            downloads = downloader.download(downloader.input())
+            return sum(1 for _ in downloader.output(downloads))
+
+        rows, elapsed = timed_stage(download)
+        report('download', rows, elapsed, downloader.latencies)
+
+        callback_tester = TimedParallelCallbackTester(
+            input_csv = downloads_path,
+            download_directory = directory,
+            output_csv = os.path.join(directory, 'callbacks.csv'),
+            destination_url = server.callback_url,
+            parallelism = args.parallelism
+        )
+        latencies = []
+
+        def callback():
+            tests = callback_tester.test(callback_tester.input())
+            for test in callback_tester.output(tests):
+                latencies.append(test.latency)
+            return len(latencies)
+
+        rows, elapsed = timed_stage(callback)
+        report('callback', rows, elapsed, latencies)
+
+        print(
+            'server responses:', dict(sorted(server.stats.items())),
+            'callbacks:', server.callbacks
+        )
+
+class LegacyConfigurationReader(BatchUploadListReader):
+    """Parses and re-serializes the configuration for every row"""
+    def _extend_configuration(self, row):
+        configuration = json.loads(self.default_configuration)
+        configuration.setdefault('vocabularies', []).append({
+            'terms': [
+                { 'term': row.get(column), 'weight': 2 }
+                for column in self.custom_vocab_columns
+                if row.get(column)
+            ]
+        })
+        return configuration
+
+def benchmark_configuration(args):
+    default_configuration = json.dumps({
+        'speakerSentiments': True,
+        'vocabularies': [
+            { 'terms': [ { 'term': 'base' + str(i) } for i in range(20) ] }
+        ]
+    })
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filepath = os.path.join(directory, 'rows.csv')
+        with open(csv_filepath, 'w', newline = '') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([ 'mediaUrl', 'term1', 'term2' ])
+            for i in range(args.rows):
+                writer.writerow([
+                    'https://example.com/' + str(i) + '.wav',
+                    'product' + str(i % args.distinctTerms),
+                    'team' + str(i % 7)
+                ])
+
+        for name, reader_class in [
+            ('cached configuration', BatchUploadListReader),
+            ('per-row json (previous)', LegacyConfigurationReader)
+        ]:
+            reader = reader_class(
+                media_url_column = 'mediaUrl',
+                default_configuration = default_configuration,
+                custom_vocab_columns = [ 'term1', 'term2' ]
+            )
+
+            start = time.perf_counter()
+            for upload_input in reader.CsvNewUploads(csv_filepath):
+                pass
+            elapsed = time.perf_counter() - start
+
+            cache = ''
+            if reader_class is BatchUploadListReader:
+                cache_info = reader.configuration_cache_info()
+                cache = ', cache hit rate %.1f%%' % (
+                    100.0 * cache_info.hits /
+                    max(1, cache_info.hits + cache_info.misses)
+                )
+            print(
+                name, '-', args.rows, 'rows:',
+                '%.0f rows/sec' % (args.rows / elapsed) + cache
+            )
+
+def ingest_csv(csv_filepath, fast, results):
+    """Read every row (held, as a deep queue would) then serialize each
+
+    Runs in its own process so that peak RSS is for this reader alone.
+    """
+    reader = BatchUploadListReader(
+        media_url_column = 'mediaUrl',
+        default_configuration = json.dumps({}),
+        custom_vocab_columns = [ 'term' ],
+        fast = fast
+    )
+
+    start = time.perf_counter()
+    inputs = list(reader.CsvNewUploads(csv_filepath))
+    read_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for upload_input in inputs:
+        upload_input.metadata
+        upload_input.configuration
+    serialize_elapsed = time.perf_counter() - start
+
+    results.put((
+        len(inputs),
+        read_elapsed,
+        serialize_elapsed,
+        # kilobytes on Linux
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    ))
+
+def benchmark_csv_ingest(args):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filepath = os.path.join(directory, 'rows.csv')
+        columns = [ 'column' + str(i) for i in range(args.columns) ]
+        with open(csv_filepath, 'w', newline = '') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([ 'mediaUrl', 'term' ] + columns)
+            for i in range(args.rows):
+                writer.writerow(
+                    [ 'https://example.com/' + str(i) + '.wav', 'term' + str(i % 10) ] +
+                    [ 'value' + str(i % 1000) for _ in columns ]
+                )
+
+        context = mp.get_context('spawn')
+        for name, fast in [
+            ('fast reader', True),
+            ('dict reader (previous)', False)
+        ]:
+            results = context.Queue()
+            process = context.Process(
+                target = ingest_csv, args = [ csv_filepath, fast, results ]
+            )
+            process.start()
+            rows, read_elapsed, serialize_elapsed, peak_rss = results.get()
+            process.join()
+
+            print(
+                name, '-', rows, 'rows:',
+                '%.0f rows/sec read,' % (rows / read_elapsed),
+                '%.0f rows/sec read and serialized,' % (
+                    rows / (read_elapsed + serialize_elapsed)
+                ),
+                'peak RSS %.0f MB' % (peak_rss / 1e6)
+            )
+
+def benchmark_plan(args):
+    with tempfile.TemporaryDirectory() as directory:
+        list_filepath = os.path.join(directory, 'media.txt')
+        media_directory = os.path.join(directory, 'media')
+        os.mkdir(media_directory)
+
+        header = b'RIFF\x24\x00\x00\x00WAVEfmt '
+        with open(list_filepath, 'w') as list_file:
+            for i in range(args.files):
+                filename = str(i) + '.wav'
+                with open(os.path.join(media_directory, filename), 'wb') as f:
+                    f.write(header)
+                list_file.write(filename + '\n')
+
+        reader = BatchUploadListReader(media_directory = media_directory)
+        for sniff in [ False, True ]:
+            planner = ManifestPlanner(
+                media_directory = media_directory,
+                parallelism = args.parallelism,
+                sniff = sniff
+            )
+
+            start = time.perf_counter()
+            plan = planner.plan(reader.MediaFilenames(list_filepath))
+            elapsed = time.perf_counter() - start
+
+            print(
+                'plan', '(with sniffing)' if sniff else '(sizes only)', '-',
+                plan['rows'], 'files:', '%.0f files/sec,' % (
+                    plan['rows'] / elapsed
+                ),
+                len(plan['problems']), 'problems'
+            )
+
+def benchmark_schedule(args):
+    bandwidth = args.bandwidthMb * 1e6
+    with MockVoiceBaseServer(upload_bandwidth = bandwidth) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        # The large files come last, as they do in the worst manifests
+        sizes = [ args.smallMb ] * args.smallFiles + \
+            [ args.largeMb ] * args.largeFiles
+        list_filepath = os.path.join(directory, 'media.txt')
+        with open(list_filepath, 'w') as list_file:
+            for i, size in enumerate(sizes):
+                filename = str(i) + '.wav'
+                with open(os.path.join(directory, filename), 'wb') as f:
+                    f.truncate(int(size * 1e6))
+                list_file.write(filename + '\n')
+
+        total_seconds = sum(sizes) * 1e6 / bandwidth
+        lower_bound = max(total_seconds / args.parallelism, max(sizes) * 1e6 / bandwidth)
+        print(
+            len(sizes), 'files, parallelism', args.parallelism,
+            '- makespan lower bound %.1fs' % lower_bound
+        )
+
+        for schedule in [ 'input', 'lpt' ]:
+            batch_upload = BatchUpload(
+                token = 'benchmark',
+                media_directory = directory,
+                parallelism = args.parallelism,
+                schedule = schedule,
+                client_kwargs = { 'api_url': server.url }
+            )
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                batch_upload.process(
+                    input_media_filename_list = list_filepath,
+                    results_path = os.path.join(directory, 'results.csv')
+                )
+            elapsed = time.perf_counter() - start
+
+            with open(os.path.join(directory, 'results.csv')) as results_file:
+                ids = [ row.split(',')[0] for row in results_file ]
+            print(
+                'schedule', schedule, '- makespan %.1fs,' % elapsed,
+                'results in input order:',
+                ids == [ str(i) + '.wav' for i in range(len(sizes)) ]
+            )
+
+def benchmark_extract(args):
+    words = [
+        { 'p': i, 's': i * 400, 'e': i * 400 + 350, 'c': 0.9,
+            'w': 'word' + str(i % 1000) }
+        for i in range(args.words)
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.documents):
+            media_id = 'media-' + str(i)
+            with open(os.path.join(directory, media_id + '.json'), 'w') as f:
+                json.dump({
+                    'mediaId': media_id,
+                    'status': 'finished',
+                    'transcript': { 'words': words },
+                    'knowledge': { 'keywords': [ { 'keyword': 'word1' } ] }
+                }, f)
+
+        parsers = [ ('json', json.loads) ]
+        if Extract.orjson is not None:
+            parsers.append(('orjson', Extract.orjson.loads))
+        cores = os.cpu_count() or 1
+        for parser_name, loads in parsers:
+            for parallelism in sorted(set([ 1, cores ])):
+                Extract._loads = loads
+                extract = Extract.Extract(
+                    download_directory = directory,
+                    output = os.path.join(directory, 'extract.csv'),
+                    parallelism = parallelism
+                )
+                with contextlib.redirect_stdout(io.StringIO()):
+                    extract.process()
+                print(
+                    'extract', parser_name, '-', parallelism, 'processes,',
+                    extract.documents, 'documents,',
+                    '%.0f MB:' % (extract.bytes / 1e6),
+                    '%.1f MB/s' % (extract.bytes / 1e6 / extract.elapsed)
+                )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = "Benchmarks for the VoiceBase V3 batch tools"
+    )
+    benchmarks = parser.add_subparsers(dest = 'benchmark')
+    benchmarks.required = True
+
+    pooling = benchmarks.add_parser(
+        'pooling',
+        help = 'requests/sec with and without connection pooling'
+    )
+    pooling.add_argument(
+        '--requests',
+        help = 'Number of requests per run (default 2000)',
+        type = int,
+        default = 2000
+    )
+    pooling.add_argument(
+        '--threads',
+        help = 'Number of concurrent threads (default 8)',
+        type = int,
+        default = 8
+    )
+    pooling.set_defaults(run = benchmark_pooling)
+
+    download = benchmarks.add_parser(
+        'download',
+        help = 'ParallelDownloader throughput, thread pipeline vs multiprocessing'
+    )
+    download.add_argument(
+        '--rows',
+        help = 'Number of media to download (default 150)',
+        type = int,
+        default = 150
+    )
+    download.add_argument(
+        '--parallelism',
+        help = 'Concurrent downloads (default 16)',
+        type = int,
+        default = 16
+    )
+    download.add_argument(
+        '--latency',
+        help = 'Mock server latency per request in seconds (default 0.05)',
+        type = float,
+        default = 0.05
+    )
+    download.set_defaults(run = benchmark_download)
+
+    upload_memory = benchmarks.add_parser(
+        'uploadMemory',
+        help = 'Peak memory of concurrent large uploads, streaming vs buffered'
+    )
+    upload_memory.add_argument(
+        '--sizeMb',
+        help = 'Size of each synthetic media file in MB (default 256)',
+        type = int,
+        default = 256
+    )
+    upload_memory.add_argument(
+        '--files',
+        help = 'Number of files uploaded concurrently (default 2)',
+        type = int,
+        default = 2
+    )
+    upload_memory.set_defaults(run = benchmark_upload_memory)
+
+    pipelines = benchmarks.add_parser(
+        'pipelines',
+        help = 'Throughput and latency of BatchUpload, ParallelDownloader ' +
+            'and ParallelCallbackTester against the mock server'
+    )
+    pipelines.add_argument(
+        '--rows',
+        help = 'Number of media through each pipeline (default 100)',
+        type = int,
+        default = 100
+    )
+    pipelines.add_argument(
+        '--parallelism',
+        help = 'Parallelism of each pipeline (default 8)',
+        type = int,
+        default = 8
+    )
+    pipelines.add_argument(
+        '--sizeKb',
+        help = 'Size of each media file in KB (default 64)',
+        type = int,
+        default = 64
+    )
+    pipelines.add_argument(
+        '--transcriptWords',
+        help = 'Words in each downloaded transcript (default 1000)',
+        type = int,
+        default = 1000
+    )
+    pipelines.add_argument(
+        '--latency',
+        help = 'Mock server latency per request in seconds (default 0.02)',
+        type = float,
+        default = 0.02
+    )
+    pipelines.add_argument(
+        '--errorRate',
+        help = 'Share of API requests failing with a 500 (default 0)',
+        type = float,
+        default = 0
+    )
+    pipelines.add_argument(
+        '--throttleRate',
+        help = 'Share of API requests throttled with a 429 (default 0)',
+        type = float,
+        default = 0
+    )
+    pipelines.set_defaults(run = benchmark_pipelines)
+
+    configuration = benchmarks.add_parser(
+        'configuration',
+        help = 'CSV rows/sec building per-row configurations, cached vs not'
+    )
+    configuration.add_argument(
+        '--rows',
+        help = 'Number of CSV rows (default 1000000)',
+        type = int,
+        default = 1000000
+    )
+    configuration.add_argument(
+        '--distinctTerms',
+        help = 'Number of distinct custom vocabulary terms (default 100)',
+        type = int,
+        default = 100
+    )
+    configuration.set_defaults(run = benchmark_configuration)
+
+    csv_ingest = benchmarks.add_parser(
+        'csvIngest',
+        help = 'CSV rows/sec and peak RSS, fast reader vs dict reader'
+    )
+    csv_ingest.add_argument(
+        '--rows',
+        help = 'Number of CSV rows (default 1000000)',
+        type = int,
+        default = 1000000
+    )
+    csv_ingest.add_argument(
+        '--columns',
+        help = 'Number of extra metadata columns (default 10)',
+        type = int,
+        default = 10
+    )
+    csv_ingest.set_defaults(run = benchmark_csv_ingest)
+
+    plan = benchmarks.add_parser(
+        'plan',
+        help = 'files/sec of the pre-flight check of a media directory'
+    )
+    plan.add_argument(
+        '--files',
+        help = 'Number of media files in the directory (default 100000)',
+        type = int,
+        default = 100000
+    )
+    plan.add_argument(
+        '--parallelism',
+        help = 'Threads checking files (default 16)',
+        type = int,
+        default = 16
+    )
+    plan.set_defaults(run = benchmark_plan)
+
+    schedule = benchmarks.add_parser(
+        'schedule',
+        help = 'BatchUpload makespan, input order vs largest first, with ' +
+            'a few large files at the end of the input'
+    )
+    schedule.add_argument(
+        '--smallFiles',
+        help = 'Number of small files (default 60)',
+        type = int,
+        default = 60
+    )
+    schedule.add_argument(
+        '--smallMb',
+        help = 'Size of each small file in MB (default 1)',
+        type = float,
+        default = 1
+    )
+    schedule.add_argument(
+        '--largeFiles',
+        help = 'Number of large files, at the end of the input (default 3)',
+        type = int,
+        default = 3
+    )
+    schedule.add_argument(
+        '--largeMb',
+        help = 'Size of each large file in MB (default 40)',
+        type = float,
+        default = 40
+    )
+    schedule.add_argument(
+        '--parallelism',
+        help = 'Concurrent uploads (default 4)',
+        type = int,
+        default = 4
+    )
+    schedule.add_argument(
+        '--bandwidthMb',
+        help = 'Simulated upload bandwidth of each upload in MB/s (default 20)',
+        type = float,
+        default = 20
+    )
+    schedule.set_defaults(run = benchmark_schedule)
+
+    extract = benchmarks.add_parser(
+        'extract',
+        help = 'MB/s of Extract over large transcripts, by parser and processes'
+    )
+    extract.add_argument(
+        '--documents',
+        help = 'Number of downloaded media (default 200)',
+        type = int,
+        default = 200
+    )
+    extract.add_argument(
+        '--words',
+        help = 'Words in each transcript (default 20000)',
+        type = int,
+        default = 20000
+    )
+    extract.set_defaults(run = benchmark_extract)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import csv
+import os
+import time
+
+DEFAULT_FLUSH_EVERY = 100
+DEFAULT_FLUSH_INTERVAL = 5.0
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+class BufferedCsvWriter:
+    """CSV rows written through a large buffer, flushed to disk periodically
+
+    Rows are flushed and fsynced every flush_every rows, and when a row is
+    written flush_interval seconds or more after the last flush, so a crash
+    loses at most flush_every rows while a run with fast rows does not pay
+    for a disk write per row.
+    """
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.flush_every = int(kwargs.get('flush_every') or DEFAULT_FLUSH_EVERY)
+        self.flush_interval = float(
+            kwargs.get('flush_interval') or DEFAULT_FLUSH_INTERVAL
+        )
+        self.file = open(
+            path, kwargs.get('mode', 'w'),
+            newline = '',
+            buffering = WRITE_BUFFER_SIZE
+        )
+        self.writer = csv.writer(self.file, delimiter = ',', quotechar = '"')
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.unflushed = self.unflushed + 1
+        if self.unflushed >= self.flush_every or \
+                time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+
+from CallbackTester import CallbackTester, JSON_HEADERS
+from AsyncVoiceBaseV3Client import create_session, aiohttp
+from DownloadsRow import DownloadsRow
+from DownloadStore import DownloadStore
+from Sharding import Shard
+
+# Load test of a callback receiver: replays the downloaded media JSON at it,
+# at a target rate (open loop) or with a fixed number in flight (closed loop)
+#
+# command line example
+#  python CallbackReplay.py --inputCsv downloads.csv --downloadDirectory dl \
+#    --destinationUrl http://127.0.0.1:8080/callback --rate 500 --requests 20000
+#  python CallbackReplay.py ... --concurrency 64 --report replay.json
+
+DEFAULT_CONCURRENCY = 64
+DEFAULT_MAX_IN_FLIGHT = 1000
+DEFAULT_READ_AHEAD = 64
+PERCENTILES = [ 0.5, 0.9, 0.99, 0.999 ]
+
+class CallbackReplay(CallbackTester):
+    """Replays finished downloads at destination_url, recording every response
+
+    With rate, request i is due at start + i / rate whether or not earlier
+    requests have finished (open loop), and its latency is measured from
+    when it was due, so a stalled receiver shows up as latency rather than
+    as fewer requests sent (no coordinated omission); at most max_in_flight
+    are outstanding. Without rate, concurrency requests are kept in flight
+    (closed loop). Bodies are sent as downloaded, over pooled keep-alive
+    connections, read ahead of when they are due; responses are not
+    retried. The corpus is cycled through until requests have been sent.
+    """
+    def __init__(self, **kwargs):
+        super(CallbackReplay, self).__init__(**kwargs)
+        if aiohttp is None:
+            raise ImportError('replay requires aiohttp (pip install aiohttp)')
+
+        rate = kwargs.get('rate')
+        self.rate = float(rate) if rate else None
+        self.concurrency = int(
+            kwargs.get('concurrency') or DEFAULT_CONCURRENCY
+        )
+        self.max_in_flight = int(
+            kwargs.get('max_in_flight') or DEFAULT_MAX_IN_FLIGHT
+        )
+        self.requests = kwargs.get('requests')
+        self.read_ahead = int(kwargs.get('read_ahead') or DEFAULT_READ_AHEAD)
+        self.report_path = kwargs.get('report')
+
+        self.latencies = []
+        self.service_times = []
+        self.outcomes = collections.Counter()
+        self.elapsed = 0
+
+    def process(self):
+        replays = self.replay(self.input())
+        with self.store:
+            for replay in self.output(replays):
+                pass
+        report = self.report()
+        print(json.dumps(report, indent = 2))
+        if self.report_path is not None:
+            with open(self.report_path, 'w') as report_file:
+                json.dump(report, report_file, indent = 2)
+
+    def replay(self, downloads):
+        """DownloadsRow of each request sent, status its HTTP status or error"""
+        media_ids = [
+            download.media_id for download in downloads
+            if download.status == 'finished'
+        ]
+        if not media_ids:
+            return []
+
+        count = int(self.requests or len(media_ids))
+        media_ids = itertools.islice(itertools.cycle(media_ids), count)
+        return asyncio.run(self._replay(media_ids))
+
+    async def _replay(self, media_ids):
+        loop = asyncio.get_running_loop()
+        session = create_session(pool_maxsize = self.max_in_flight)
+        slots = asyncio.Semaphore(
+            self.max_in_flight if self.rate else self.concurrency
+        )
+        bodies = collections.deque()
+        media_ids = iter(media_ids)
+        replays = []
+        tasks = set()
+
+        def read_next():
+            for media_id in itertools.islice(media_ids, 1):
+                bodies.append((media_id, loop.run_in_executor(
+                    None, self._read_callback_body, media_id
+                )))
+
+        for _ in range(self.read_ahead):
+            read_next()
+
+        start = loop.time()
+        try:
+            index = 0
+            while bodies:
+                media_id, body = bodies.popleft()
+                read_next()
+                body = await body
+
+                if self.rate:
+                    due = start + index / self.rate
+                    if due > loop.time():
+                        await asyncio.sleep(due - loop.time())
+                    await slots.acquire()
+                else:
+                    await slots.acquire()
+                    due = loop.time()
+
+                task = asyncio.ensure_future(
+                    self._send(session, media_id, body, due, slots)
+                )
+                task.add_done_callback(
+                    lambda task: replays.append(task.result())
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index = index + 1
+
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            self.elapsed = loop.time() - start
+            await session.close()
+        return replays
+
+    async def _send(self, session, media_id, body, due, slots):
+        loop = asyncio.get_running_loop()
+        sent = loop.time()
+        try:
+            async with session.post(
+                self.destination_url, data = body, headers = JSON_HEADERS
+            ) as response:
+                await response.read()
+                outcome = str(response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+            outcome = type(error).__name__
+        finally:
+            slots.release()
+
+        finished = loop.time()
+        self.latencies.append(finished - due)
+        self.service_times.append(finished - sent)
+        self.outcomes[outcome] = self.outcomes[outcome] + 1
+        return DownloadsRow(
+            media_id = media_id,
+            status = outcome,
+            filename = self.store.filename(media_id)
+        )
+
+    def report(self):
+        """Requests, achieved rate, latency percentiles and outcome counts
+
+        latency is from when each request was due (what a sender at the
+        target rate would see); service is from when it was actually sent.
+        """
+        requests = len(self.latencies)
+        return {
+            'requests': requests,
+            'seconds': round(self.elapsed, 3),
+            'target_rate': self.rate,
+            'achieved_rate': round(requests / self.elapsed, 1)
+                if self.elapsed else 0.0,
+            'latency': percentiles(self.latencies),
+            'service': percentiles(self.service_times),
+            'outcomes': dict(sorted(self.outcomes.items()))
+        }
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--inputCsv',
+            help = 'Input CSV ("downloads": mediaId, status, filename); ' +
+                'the finished media are replayed',
+            required = True
+        )
+        parser.add_argument(
+            '--downloadDirectory',
+            help = 'Directory of downloaded media',
+            required = True
+        )
+        parser.add_argument(
+            '--outputCsv',
+            help = 'Output CSV (mediaId, HTTP status or error, filename) of ' +
+                'every request, in completion order',
+            required = True
+        )
+        parser.add_argument(
+            '--destinationUrl',
+            help = 'URL of the callback receiver under test',
+            required = True
+        )
+        parser.add_argument(
+            '--rate',
+            help = 'Target requests per second, sent on schedule however ' +
+                'the receiver keeps up (open loop)',
+            type = float,
+            required = False
+        )
+        parser.add_argument(
+            '--concurrency',
+            help = 'Without --rate, requests kept in flight (closed loop, ' +
+                'default ' + str(DEFAULT_CONCURRENCY) + ')',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--maxInFlight',
+            help = 'With --rate, cap on outstanding requests (default ' +
+                str(DEFAULT_MAX_IN_FLIGHT) + '); time waiting for one ' +
+                'counts as latency',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--requests',
+            help = 'Requests to send, cycling through the finished media ' +
+                '(default: each once)',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--report',
+            help = 'Also write the JSON report to this file',
+            required = False
+        )
+        DownloadStore._add_command_line_args(parser)
+        Shard._add_command_line_args(parser)
+
+    @classmethod
+    def _initialize_tester(cls, args):
+        return CallbackReplay(
+            input_csv = args.inputCsv,
+            download_directory = args.downloadDirectory,
+            output_csv = args.outputCsv,
+            destination_url = args.destinationUrl,
+            rate = args.rate,
+            concurrency = args.concurrency,
+            max_in_flight = args.maxInFlight,
+            requests = args.requests,
+            report = args.report,
+            shard = args.shard,
+            store_format = args.storeFormat
+        )
+
+    @classmethod
+    def main(cls):
+        parser = argparse.ArgumentParser(
+            description = "Callback receiver load test for VoiceBase V3"
+        )
+        cls._add_command_line_args(parser)
+        args = parser.parse_args()
+
+        replay = cls._initialize_tester(args)
+        replay.process()
+
+def percentiles(latencies):
+    """Exact latency percentiles (PERCENTILES) and max, in milliseconds"""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+
+    def percentile(share):
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+    summary = {
+        'p' + ('%g' % (share * 100)): round(percentile(share) * 1000, 3)
+        for share in PERCENTILES
+    }
+    summary['max'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+if __name__ == '__main__':
+    CallbackReplay.main()
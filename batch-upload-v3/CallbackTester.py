@@ -1,14 +1,22 @@
 import argparse
+import asyncio
 import csv
-import json
 import os
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 
 from ResultsRow import ResultsRow
 from DownloadsRow import DownloadsRow
 from VoiceBaseV3Client import VoiceBaseV3Client
+from AsyncVoiceBaseV3Client import create_session, aiohttp
+from RateLimiter import RequestThrottle, HttpResponse
+from ParallelPipeline import async_map, DEFAULT_ASYNCIO_CONCURRENCY
+from Sharding import Shard
+from DownloadStore import DownloadStore, open_store, STORE_JSON
 
 NULL_FILENAME = '/dev/null'
+JSON_HEADERS = { 'Content-Type': 'application/json' }
 
 class CallbackTester:
     def __init__(self, **kwargs):
@@ -16,26 +24,54 @@ class CallbackTester:
         self.download_directory = kwargs['download_directory']
         self.output_csv = kwargs['output_csv']
         self.destination_url = kwargs['destination_url']
+        self.use_asyncio = kwargs.get('use_asyncio', False)
+        self.concurrency = int(
+            kwargs.get('concurrency') or DEFAULT_ASYNCIO_CONCURRENCY
+        )
+        self.shard = kwargs.get('shard')
+        self.store = kwargs.get('store') or open_store(
+            self.download_directory,
+            kwargs.get('store_format') or STORE_JSON
+        )
+        self.async_session = None
+        self.throttle = RequestThrottle(**kwargs.get('throttle_kwargs', {}))
+        self.pool_maxsize = int(kwargs.get('pool_maxsize') or 10)
+        self._local = threading.local()
 
     def process(self):
         results = self.input()
         tests = self.test(results)
         printable_tests = self.output(tests)
-        for test in printable_tests:
-            print(
-                'ROW media_id:', test.media_id,
-                ' status: ', test.status,
-                ' filename: ', test.filename
-            )
+        with self.store:
+            for test in printable_tests:
+                print(
+                    'ROW media_id:', test.media_id,
+                    ' status: ', test.status,
+                    ' filename: ', test.filename
+                )
 
     def input(self):
-        return DownloadsRow.read_from_csv_filepath(self.input_csv)
+        return DownloadsRow.read_from_csv_filepath(
+            self.input_csv, shard = self.shard
+        )
 
     def test(self, results):
+        if self.use_asyncio:
+            yield from self.test_async(results)
+            return
+
         for result in results:
             test = self.test_one(result)
             yield test
 
+    def test_async(self, results):
+        return async_map(
+            self.test_one_async,
+            results,
+            concurrency = self.concurrency,
+            cleanup = self._close_async_session
+        )
+
     def output(self, downloads):
         return DownloadsRow.write_to_csv_filepath(downloads, self.output_csv)
 
@@ -43,14 +79,45 @@ class CallbackTester:
         media_id = download.media_id
         status = download.status
 
-        filename = media_id + '.json'
-        filepath = self.download_directory + '/' + filename
+        filename = self.store.filename(media_id)
 
-        with open(filepath, 'r') as test_file:
-            test_data = json.load(test_file)
+        if status == 'finished':
+            body = self._read_callback_body(media_id)
+            session = self._session()
+            self.throttle.call(
+                lambda: session.post(
+                    self.destination_url, data = body, headers = JSON_HEADERS
+                ),
+                retry_exceptions = (
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout
+                )
+            )
+        else:
+            status = 'skipped'
+
+        return DownloadsRow(
+            media_id = media_id,
+            status = status,
+            filename = filename
+        )
+
+    async def test_one_async(self, download):
+        media_id = download.media_id
+        status = download.status
+
+        filename = self.store.filename(media_id)
 
         if status == 'finished':
-            requests.post(self.destination_url, json = test_data)
+            body = await asyncio.to_thread(self._read_callback_body, media_id)
+            if self.async_session is None:
+                self.async_session = create_session(
+                    pool_maxsize = self.concurrency
+                )
+            await self.throttle.call_async(
+                lambda: self._post_async(body),
+                retry_exceptions = (aiohttp.ClientError, asyncio.TimeoutError)
+            )
         else:
             status = 'skipped'
 
@@ -60,6 +127,36 @@ class CallbackTester:
             filename = filename
         )
 
+    async def _post_async(self, body):
+        async with self.async_session.post(
+            self.destination_url, data = body, headers = JSON_HEADERS
+        ) as response:
+            return HttpResponse(
+                response.status,
+                response.headers,
+                await response.text()
+            )
+
+    async def _close_async_session(self):
+        if self.async_session is not None:
+            await self.async_session.close()
+        self.async_session = None
+
+    def _read_callback_body(self, media_id):
+        """The downloaded media JSON, as is: sent without re-serializing"""
+        return self.store.get(media_id)
+
+    def _session(self):
+        """This thread's keep-alive requests.Session"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize = self.pool_maxsize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._local.session = session
+        return session
+
     @classmethod
     def _add_command_line_args(cls, parser):
         parser.add_argument(
@@ -82,6 +179,21 @@ class CallbackTester:
             help = 'Destination URL of the callback',
             required = True
         )
+        parser.add_argument(
+            '--asyncio',
+            help = 'Send callbacks from an asyncio event loop (requires aiohttp)',
+            action = 'store_true',
+            required = False
+        )
+        parser.add_argument(
+            '--concurrency',
+            help = 'Callbacks in flight with --asyncio (default ' +
+                str(DEFAULT_ASYNCIO_CONCURRENCY) + ')',
+            required = False
+        )
+        RequestThrottle._add_command_line_args(parser)
+        Shard._add_command_line_args(parser)
+        DownloadStore._add_command_line_args(parser)
 
     @classmethod
     def _initialize_tester(cls, args):
@@ -94,7 +206,12 @@ class CallbackTester:
             input_csv = args.inputCsv,
             download_directory = args.downloadDirectory,
             output_csv = args.outputCsv,
-            destination_url = args.destinationUrl
+            destination_url = args.destinationUrl,
+            use_asyncio = args.asyncio,
+            concurrency = args.concurrency,
+            shard = args.shard,
+            store_format = args.storeFormat,
+            throttle_kwargs = RequestThrottle._throttle_kwargs(args)
         )
 
     @classmethod
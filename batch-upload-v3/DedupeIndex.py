@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import threading
+import urllib.parse
+
+from SqliteStore import SqliteStore
+
+DEDUPE_SKIP = 'skip'
+DEDUPE_METADATA = 'metadata'
+DEDUPE_MODES = [ DEDUPE_SKIP, DEDUPE_METADATA ]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def content_hash(filepath, chunk_size = HASH_CHUNK_SIZE):
+    """SHA-256 of a file, read a chunk at a time into one buffer
+
+    hashlib releases the GIL while hashing large chunks, so files hashed on
+    several threads are hashed in parallel.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering = 0) as media_file:
+        while True:
+            count = media_file.readinto(buffer)
+            if not count:
+                return digest.hexdigest()
+            digest.update(view[:count])
+
+def normalize_url(url):
+    """url with the parts that do not change what it points to normalized
+
+    The scheme and host are lowercased, a default port and the fragment are
+    dropped; the path and query are kept as they are.
+    """
+    parsed = urllib.parse.urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    netloc = (parsed.hostname or '').lower()
+    if ':' in netloc:
+        netloc = '[' + netloc + ']'
+    if parsed.port is not None and \
+            (scheme, parsed.port) not in (('http', 80), ('https', 443)):
+        netloc = netloc + ':' + str(parsed.port)
+    if parsed.username is not None:
+        userinfo = parsed.username
+        if parsed.password is not None:
+            userinfo = userinfo + ':' + parsed.password
+        netloc = userinfo + '@' + netloc
+    return urllib.parse.urlunsplit(
+        (scheme, netloc, parsed.path or '/', parsed.query, '')
+    )
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+class DedupeIndex(SqliteStore):
+    """Durable (SQLite) map of media content to the mediaId it was uploaded as
+
+    Files are keyed by the SHA-256 of their content, URLs by their normalized
+    form. File hashes are kept against each path's size and modification
+    time, so unchanged files are not read again on the next run.
+
+    Thread-safe. claim() also covers duplicates within a run: while one
+    thread uploads some content, other threads claiming the same key wait
+    for its mediaId rather than uploading it again. Asyncio tasks use
+    claim_async(), which waits on the event loop instead of a thread.
+    """
+    def __init__(self, path, **kwargs):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS media (' +
+            'key TEXT PRIMARY KEY, media_id TEXT NOT NULL, status TEXT)',
+            'CREATE TABLE IF NOT EXISTS file_hashes (' +
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, ' +
+            'sha256 TEXT NOT NULL)'
+        ], **kwargs)
+        self.claimed = {}
+        # (loop, future) of the asyncio tasks waiting for each claimed key
+        self.waiters = {}
+
+    def file_key(self, filepath):
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.connection.execute(
+                'SELECT sha256 FROM file_hashes ' +
+                'WHERE path = ? AND size = ? AND mtime_ns = ?',
+                (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if cached is not None:
+            return 'sha256:' + cached[0]
+
+        sha256 = content_hash(path)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime_ns, sha256)
+            )
+            self._written()
+        return 'sha256:' + sha256
+
+    def url_key(self, url):
+        return 'url:' + normalize_url(url)
+
+    def get(self, key):
+        """(media_id, status) recorded for key, or None"""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT media_id, status FROM media WHERE key = ?', (key,)
+            ).fetchone()
+
+    def claim(self, key):
+        """(media_id, status) of key's media, or None to upload it
+
+        On None the caller must call release(key, ...) once done, with the
+        mediaId if the upload succeeded.
+        """
+        while True:
+            existing = self.get(key)
+            if existing is not None:
+                return existing
+
+            with self.lock:
+                uploading = self.claimed.get(key)
+                if uploading is None:
+                    self.claimed[key] = threading.Event()
+                    return None
+            uploading.wait()
+
+    async def claim_async(self, key):
+        """claim(), awaiting an upload in flight on the running event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            existing = self.get(key)
+            if existing is not None:
+                return existing
+
+            with self.lock:
+                if key not in self.claimed:
+                    self.claimed[key] = threading.Event()
+                    return None
+                released = loop.create_future()
+                self.waiters.setdefault(key, []).append((loop, released))
+            await released
+
+    def release(self, key, media_id = None, status = None):
+        with self.lock:
+            if media_id:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO media VALUES (?, ?, ?)',
+                    (key, media_id, None if status is None else str(status))
+                )
+                self._written()
+            uploading = self.claimed.pop(key, None)
+            waiters = self.waiters.pop(key, [])
+        if uploading is not None:
+            uploading.set()
+        for loop, released in waiters:
+            loop.call_soon_threadsafe(_resolve, released)
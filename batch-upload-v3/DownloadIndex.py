@@ -0,0 +1,64 @@
+import time
+from collections import namedtuple
+
+from ResultsRow import STATUS_FINISHED, STATUS_FAILED
+from SqliteStore import SqliteStore
+
+# Media in these states do not change any more
+TERMINAL_STATUSES = { STATUS_FINISHED, STATUS_FAILED }
+
+DownloadIndexEntry = namedtuple(
+    'DownloadIndexEntry',
+    'media_id status downloaded_at size etag last_modified'
+)
+
+class DownloadIndex(SqliteStore):
+    """Durable (SQLite) record of what is already downloaded
+
+    For each mediaId: its status, when it was downloaded (or last found
+    unchanged), its size in bytes, and the ETag and Last-Modified headers
+    it came with, for conditional requests. Thread-safe.
+    """
+    def __init__(self, path, **kwargs):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS downloads (' +
+            'media_id TEXT PRIMARY KEY, status TEXT, downloaded_at REAL, ' +
+            'size INTEGER, etag TEXT, last_modified TEXT)'
+        ], **kwargs)
+
+    def get(self, media_id):
+        """DownloadIndexEntry of media_id, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT * FROM downloads WHERE media_id = ?', (media_id,)
+            ).fetchone()
+        return None if row is None else DownloadIndexEntry(*row)
+
+    def record(self, media_id, status, size, etag = None, last_modified = None):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?)',
+                (media_id, status, time.time(), size, etag, last_modified)
+            )
+            self._written()
+
+    def touch(self, media_id):
+        """Note that media_id was found unchanged just now"""
+        with self.lock:
+            self.connection.execute(
+                'UPDATE downloads SET downloaded_at = ? WHERE media_id = ?',
+                (time.time(), media_id)
+            )
+            self._written()
+
+def is_fresh(entry, max_age = None, now = None):
+    """Whether entry's download can be kept without asking the API again
+
+    Only terminal media are fresh, and with max_age (seconds) only those
+    downloaded or checked within the last max_age seconds.
+    """
+    if entry is None or entry.status not in TERMINAL_STATUSES:
+        return False
+    if max_age is None:
+        return True
+    return (now or time.time()) - entry.downloaded_at < max_age
@@ -0,0 +1,419 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import urllib.parse
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STORE_JSON = 'json'
+STORE_GZIP = 'gzip'
+STORE_ZSTD = 'zstd'
+STORE_SEGMENT = 'segment'
+STORE_FORMATS = [ STORE_JSON, STORE_GZIP, STORE_ZSTD, STORE_SEGMENT ]
+
+SHARD_DIRECTORIES = 256
+SEGMENT_MAX_BYTES = 1024 * 1024 * 1024
+SEGMENT_INDEX_FILENAME = 'index.sqlite'
+DEFAULT_SYNC_EVERY = 100
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def open_store(directory, format = STORE_JSON):
+    """The download store of format in directory"""
+    if format == STORE_JSON:
+        return DirectoryStore(directory)
+    if format in (STORE_GZIP, STORE_ZSTD):
+        return ShardedStore(directory, compression = format)
+    if format == STORE_SEGMENT:
+        return SegmentStore(directory)
+    raise Exception('unknown store format: ' + str(format))
+
+class DownloadStore:
+    """Downloaded media JSON documents, by key (usually the mediaId)
+
+    put()/put_file() add or replace a document, get() reads one back, scan()
+    reads them all in the order fastest for the store, and rename() moves a
+    document to a new key. Stores are safe to use from several threads.
+    """
+    def put(self, key, data):
+        raise NotImplementedError()
+
+    def put_file(self, key, filepath):
+        """Add the document in filepath (which is consumed) under key"""
+        raise NotImplementedError()
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def scan(self):
+        """(key, data) of every document"""
+        raise NotImplementedError()
+
+    def keys(self):
+        """Every key, in scan() order"""
+        raise NotImplementedError()
+
+    def rename(self, key, new_key):
+        raise NotImplementedError()
+
+    def filename(self, key):
+        """Where key is, relative to the store (for the downloads CSV)"""
+        raise NotImplementedError()
+
+    def part_filepath(self, key):
+        """A scratch file in the store to stream a download into"""
+        return os.path.join(self.directory, _quote(key) + '.json.part')
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--storeFormat',
+            help = 'How downloads are kept in --downloadDirectory: json ' +
+                '(default, one <mediaId>.json each), gzip or zstd (compressed, ' +
+                'in ' + str(SHARD_DIRECTORIES) + ' subdirectories), or segment ' +
+                '(appended to large files, with an index)',
+            choices = STORE_FORMATS,
+            default = STORE_JSON,
+            required = False
+        )
+
+class DirectoryStore(DownloadStore):
+    """One <key>.json file per document, in a flat directory"""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def filepath(self, key):
+        return os.path.join(self.directory, self.filename(key))
+
+    def filename(self, key):
+        return key + '.json'
+
+    def put(self, key, data):
+        with open(self.filepath(key), 'wb') as document_file:
+            document_file.write(data)
+
+    def put_file(self, key, filepath):
+        os.replace(filepath, self.filepath(key))
+
+    def get(self, key):
+        with open(self.filepath(key), 'rb') as document_file:
+            return document_file.read()
+
+    def scan(self):
+        for key in self.keys():
+            yield key, self.get(key)
+
+    def keys(self):
+        with os.scandir(self.directory) as entries:
+            names = sorted(
+                entry.name for entry in entries
+                if entry.name.endswith('.json') and entry.is_file()
+            )
+        return [ name[:-len('.json')] for name in names ]
+
+    def rename(self, key, new_key):
+        os.rename(self.filepath(key), self.filepath(new_key))
+
+class ShardedStore(DownloadStore):
+    """Compressed documents spread over subdirectories by a hash of the key
+
+    With 256 subdirectories, a million documents is about 4000 per
+    directory. gzip needs nothing extra; zstd (faster, smaller) needs the
+    zstandard package.
+    """
+    def __init__(self, directory, **kwargs):
+        self.directory = directory
+        self.compression = kwargs.get('compression') or STORE_GZIP
+        if self.compression == STORE_ZSTD and zstandard is None:
+            raise ImportError(
+                'the zstd store requires zstandard (pip install zstandard)'
+            )
+        self.suffix = '.json.gz' if self.compression == STORE_GZIP \
+            else '.json.zst'
+
+    def filename(self, key):
+        shard = '%02x' % (
+            hashlib.blake2b(key.encode('utf-8'), digest_size = 1).digest()[0]
+            % SHARD_DIRECTORIES
+        )
+        return os.path.join(shard, _quote(key) + self.suffix)
+
+    def filepath(self, key):
+        return os.path.join(self.directory, self.filename(key))
+
+    def put(self, key, data):
+        self._write(key, lambda compressed_file: compressed_file.write(data))
+
+    def put_file(self, key, filepath):
+        with open(filepath, 'rb') as document_file:
+            self._write(
+                key,
+                lambda compressed_file: shutil.copyfileobj(
+                    document_file, compressed_file, COPY_BUFFER_SIZE
+                )
+            )
+        os.remove(filepath)
+
+    def _write(self, key, write):
+        filepath = self.filepath(key)
+        os.makedirs(os.path.dirname(filepath), exist_ok = True)
+        with open(filepath + '.tmp', 'wb') as raw_file:
+            with self._compressor(raw_file) as compressed_file:
+                write(compressed_file)
+        os.replace(filepath + '.tmp', filepath)
+
+    def _compressor(self, raw_file):
+        if self.compression == STORE_GZIP:
+            return gzip.GzipFile(fileobj = raw_file, mode = 'wb', mtime = 0)
+        return zstandard.ZstdCompressor().stream_writer(
+            raw_file, closefd = False
+        )
+
+    def get(self, key):
+        with open(self.filepath(key), 'rb') as raw_file:
+            return self._decompress(raw_file.read())
+
+    def _decompress(self, data):
+        if self.compression == STORE_GZIP:
+            return gzip.decompress(data)
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    def scan(self):
+        for shard_directory, names in self._shards():
+            for name in names:
+                with open(os.path.join(shard_directory, name), 'rb') as raw_file:
+                    data = self._decompress(raw_file.read())
+                yield _unquote(name[:-len(self.suffix)]), data
+
+    def keys(self):
+        return [
+            _unquote(name[:-len(self.suffix)])
+            for _, names in self._shards()
+            for name in names
+        ]
+
+    def _shards(self):
+        """(directory, sorted document filenames) of each shard"""
+        for shard in range(SHARD_DIRECTORIES):
+            shard_directory = os.path.join(self.directory, '%02x' % shard)
+            try:
+                with os.scandir(shard_directory) as entries:
+                    names = sorted(
+                        entry.name for entry in entries
+                        if entry.name.endswith(self.suffix)
+                    )
+            except FileNotFoundError:
+                continue
+            yield shard_directory, names
+
+    def rename(self, key, new_key):
+        new_filepath = self.filepath(new_key)
+        os.makedirs(os.path.dirname(new_filepath), exist_ok = True)
+        os.rename(self.filepath(key), new_filepath)
+
+class SegmentStore(DownloadStore):
+    """Documents appended to large segment files, with an SQLite offset index
+
+    Each record is a small header, the key and the zlib-compressed document.
+    The index maps each key to its segment, offset and length, for random
+    access; scan() reads the segments front to back. A replaced document's
+    old record stays in its segment (the index points at the new one).
+    The index is committed, after the segment is flushed to disk, every
+    sync_every documents and on close.
+    """
+    RECORD_HEADER = struct.Struct('>HI')
+
+    def __init__(self, directory, **kwargs):
+        self.directory = directory
+        self.sync_every = int(kwargs.get('sync_every') or DEFAULT_SYNC_EVERY)
+        self.compression_level = int(kwargs.get('compression_level') or 6)
+        self.max_segment_bytes = int(
+            kwargs.get('max_segment_bytes') or SEGMENT_MAX_BYTES
+        )
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        os.makedirs(directory, exist_ok = True)
+
+        self._connect()
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS documents (' +
+            'key TEXT PRIMARY KEY, segment INTEGER NOT NULL, ' +
+            'offset INTEGER NOT NULL, length INTEGER NOT NULL)'
+        )
+        self.connection.commit()
+
+        last_segment = self.connection.execute(
+            'SELECT MAX(segment) FROM documents'
+        ).fetchone()[0]
+        self.segment = last_segment or 0
+        self.segment_file = None
+
+    def _connect(self):
+        # A forked worker process gets its own connection to the index
+        self.pid = os.getpid()
+        self.connection = sqlite3.connect(
+            os.path.join(self.directory, SEGMENT_INDEX_FILENAME),
+            check_same_thread = False
+        )
+
+    def segment_filepath(self, segment):
+        return os.path.join(self.directory, 'segment-%06d.dat' % segment)
+
+    def filename(self, key):
+        return os.path.basename(self.segment_filepath(self._locate(key)[0]))
+
+    def put(self, key, data):
+        compressed = zlib.compress(data, self.compression_level)
+        encoded_key = key.encode('utf-8')
+        header = self.RECORD_HEADER.pack(len(encoded_key), len(compressed))
+
+        with self.lock:
+            segment_file = self._segment_file(
+                len(header) + len(encoded_key) + len(compressed)
+            )
+            offset = segment_file.tell() + len(header) + len(encoded_key)
+            segment_file.write(header + encoded_key + compressed)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                (key, self.segment, offset, len(compressed))
+            )
+            self.unsynced = self.unsynced + 1
+            if self.unsynced >= self.sync_every:
+                self._sync()
+
+    def put_file(self, key, filepath):
+        with open(filepath, 'rb') as document_file:
+            self.put(key, document_file.read())
+        os.remove(filepath)
+
+    def _segment_file(self, record_length):
+        if self.segment_file is None:
+            self.segment_file = open(
+                self.segment_filepath(self.segment), 'ab'
+            )
+        if self.segment_file.tell() > 0 and \
+                self.segment_file.tell() + record_length > self.max_segment_bytes:
+            self._sync()
+            self.segment_file.close()
+            self.segment = self.segment + 1
+            self.segment_file = open(
+                self.segment_filepath(self.segment), 'ab'
+            )
+        return self.segment_file
+
+    def _locate(self, key):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._connect()
+            location = self.connection.execute(
+                'SELECT segment, offset, length FROM documents WHERE key = ?',
+                (key,)
+            ).fetchone()
+        if location is None:
+            raise KeyError(key)
+        return location
+
+    def get(self, key):
+        segment, offset, length = self._locate(key)
+        return zlib.decompress(self._read(segment, offset, length))
+
+    def _read(self, segment, offset, length):
+        with self.lock:
+            if self.segment_file is not None and segment == self.segment:
+                self.segment_file.flush()
+        with open(self.segment_filepath(segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            return segment_file.read(length)
+
+    def scan(self):
+        """Every document in segment order: one sequential pass per segment"""
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.flush()
+            locations = self.connection.execute(
+                'SELECT key, segment, offset, length FROM documents ' +
+                'ORDER BY segment, offset'
+            ).fetchall()
+
+        segment_file = None
+        current_segment = None
+        try:
+            for key, segment, offset, length in locations:
+                if segment != current_segment:
+                    if segment_file is not None:
+                        segment_file.close()
+                    segment_file = open(
+                        self.segment_filepath(segment), 'rb',
+                        buffering = COPY_BUFFER_SIZE
+                    )
+                    current_segment = segment
+                segment_file.seek(offset)
+                yield key, zlib.decompress(segment_file.read(length))
+        finally:
+            if segment_file is not None:
+                segment_file.close()
+
+    def keys(self):
+        with self.lock:
+            return [
+                key for (key,) in self.connection.execute(
+                    'SELECT key FROM documents ORDER BY segment, offset'
+                )
+            ]
+
+    def rename(self, key, new_key):
+        with self.lock:
+            # Checked first: a failed rename must not drop new_key's document
+            found = self.connection.execute(
+                'SELECT 1 FROM documents WHERE key = ?', (key,)
+            ).fetchone()
+            if found is None:
+                raise KeyError(key)
+            if new_key == key:
+                return
+
+            self.connection.execute(
+                'DELETE FROM documents WHERE key = ?', (new_key,)
+            )
+            self.connection.execute(
+                'UPDATE documents SET key = ? WHERE key = ?', (new_key, key)
+            )
+            self.unsynced = self.unsynced + 1
+
+    def _sync(self):
+        if self.segment_file is not None:
+            self.segment_file.flush()
+            os.fsync(self.segment_file.fileno())
+        self.connection.commit()
+        self.unsynced = 0
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+            self.connection.close()
+
+def _quote(key):
+    return urllib.parse.quote(key, safe = '')
+
+def _unquote(name):
+    return urllib.parse.unquote(name)
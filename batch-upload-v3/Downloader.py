@@ -1,11 +1,23 @@
 import argparse
+import asyncio
 import csv
 import json
 import os
 
 from ResultsRow import ResultsRow
 from DownloadsRow import DownloadsRow
-from VoiceBaseV3Client import VoiceBaseV3Client
+from VoiceBaseV3Client import VoiceBaseV3Client, conditional_headers
+from VoiceBaseV3Client import STATUS_NOT_MODIFIED
+from AsyncVoiceBaseV3Client import AsyncVoiceBaseV3Client
+from ParallelPipeline import async_map, DEFAULT_ASYNCIO_CONCURRENCY
+from StatusPoller import StatusPoller, PENDING_STATUSES
+from StreamingJson import ScanningWriter
+from Instrumentation import MetricsReporter
+from Instrumentation import STAGE_CSV_READ, STAGE_RESULT_WRITE
+from BufferedCsvWriter import DEFAULT_FLUSH_EVERY
+from Sharding import Shard
+from DownloadStore import DownloadStore, open_store, STORE_JSON
+from DownloadIndex import DownloadIndex, is_fresh
 
 NULL_FILENAME = '/dev/null'
 
@@ -14,46 +26,305 @@ class Downloader:
         self.input_csv = kwargs['input_csv']
         self.download_directory = kwargs['download_directory']
         self.output_csv = kwargs['output_csv']
-        self.voicebase = VoiceBaseV3Client(kwargs['token'])
+        self.parallelism = int(kwargs.get('parallelism') or 1)
+        self.flush_every = kwargs.get('flush_every')
+        self.shard = kwargs.get('shard')
+        self.store = kwargs.get('store') or open_store(
+            self.download_directory,
+            kwargs.get('store_format') or STORE_JSON
+        )
+        self.index = None
+        self.indexed_downloads = set()
+        if kwargs.get('download_index_path') is not None:
+            self.index = DownloadIndex(kwargs['download_index_path'])
+            # Index entries only count for downloads still in the store
+            self.indexed_downloads = set(self.store.keys())
+        self.refresh_after = kwargs.get('refresh_after')
+        self.metrics_reporter = MetricsReporter(
+            **kwargs.get('metrics_kwargs', {})
+        )
+        self.metrics = self.metrics_reporter.metrics
+        client_kwargs = kwargs.get('client_kwargs', {})
+        self.voicebase = VoiceBaseV3Client(
+            kwargs['token'],
+            metrics = self.metrics,
+            **VoiceBaseV3Client._sized_client_kwargs(
+                client_kwargs, self.parallelism
+            )
+        )
+
+        self.raw = kwargs.get('raw', False)
+        self.poll = kwargs.get('poll', False)
+        self.poll_interval = kwargs.get('poll_interval')
+        self.poll_timeout = kwargs.get('poll_timeout')
 
+        self.use_asyncio = kwargs.get('use_asyncio', False)
+        self.concurrency = int(
+            kwargs.get('concurrency') or DEFAULT_ASYNCIO_CONCURRENCY
+        )
+        if self.use_asyncio:
+            self.async_voicebase = AsyncVoiceBaseV3Client(
+                kwargs['token'],
+                throttle = self.voicebase.throttle,
+                metrics = self.metrics,
+                **VoiceBaseV3Client._sized_client_kwargs(
+                    client_kwargs, self.concurrency
+                )
+            )
+            if self.poll:
+                raise Exception('--poll is not supported with --asyncio')
 
     def process(self):
         results = self.input()
         downloads = self.download(results)
         printable_downloads = self.output(downloads)
-        for download in printable_downloads:
-            print(
-                'ROW media_id:', download.media_id,
-                ' status: ', download.status,
-                ' filename: ', download.filename
-            )
+        try:
+            with self.metrics_reporter, self.store:
+                for download in printable_downloads:
+                    print(
+                        'ROW media_id:', download.media_id,
+                        ' status: ', download.status,
+                        ' filename: ', download.filename
+                    )
+        finally:
+            if self.index is not None:
+                self.index.close()
 
     def input(self):
-        return ResultsRow.read_from_csv_filepath(self.input_csv)
+        return self.metrics.timed(
+            STAGE_CSV_READ,
+            ResultsRow.read_from_csv_filepath(self.input_csv, shard = self.shard)
+        )
 
     def download(self, results):
+        if self.poll:
+            yield from self.download_polled(results)
+            return
+
+        if self.use_asyncio:
+            yield from self.download_async(results)
+            return
+
         for result in results:
             download = self.download_one(result)
             yield download
 
+    def download_async(self, results):
+        return async_map(
+            self.download_one_async,
+            results,
+            concurrency = self.concurrency,
+            cleanup = self.async_voicebase.close
+        )
+
+    def download_polled(self, results):
+        """Download each media once it is no longer pending"""
+        poller = StatusPoller(
+            self.poll_one,
+            parallelism = self.parallelism,
+            interval = self.poll_interval,
+            timeout = self.poll_timeout
+        )
+        return poller.poll(results)
+
     def output(self, downloads):
-        return DownloadsRow.write_to_csv_filepath(downloads, self.output_csv)
+        return DownloadsRow.write_to_csv_filepath(
+            downloads, self.output_csv, flush_every = self.flush_every
+        )
 
     def download_one(self, result):
         media_id = result.media_id
-        filename = media_id + '.json'
-        filepath = self.download_directory + '/' + filename
+        entry = self._indexed(media_id)
+        if is_fresh(entry, self.refresh_after):
+            return self._skipped_download(entry)
+
+        if self.raw:
+            status, download = self._download_raw(media_id, entry = entry)
+            return download
+
+        if self.index is None:
+            media_entity = self.voicebase.media[media_id].get()
+            return self._write_download(media_id, media_entity)
+
+        # Asked to send the entity only if it changed since the last download
+        status_code, headers, media_entity = \
+            self.voicebase.media[media_id].get_conditional(
+                **self._validators(entry)
+            )
+        if status_code == STATUS_NOT_MODIFIED:
+            return self._unchanged_download(entry)
+
+        return self._write_download(media_id, media_entity, headers)
+
+    def poll_one(self, result, last_check):
+        media_id = result.media_id
+        entry = self._indexed(media_id)
+        if is_fresh(entry, self.refresh_after):
+            return entry.status, self._skipped_download(entry)
+
+        if self.raw:
+            return self._download_raw(media_id, keep_pending = last_check)
+
         media_entity = self.voicebase.media[media_id].get()
 
+        status = media_entity.get('status')
+        if status in PENDING_STATUSES and not last_check:
+            return status, None
+
+        return status, self._write_download(media_id, media_entity)
+
+    async def download_one_async(self, result):
+        media_id = result.media_id
+        entry = self._indexed(media_id)
+        if is_fresh(entry, self.refresh_after):
+            return self._skipped_download(entry)
+
+        if self.raw:
+            return await self._download_raw_async(media_id)
+
+        media_entity = await self.async_voicebase.media[media_id].get()
+
+        # Keep large transcript writes off the event loop thread
+        return await asyncio.to_thread(
+            self._write_download, media_id, media_entity
+        )
+
+    def _write_download(self, media_id, media_entity, headers = None):
         status = media_entity['status']
 
-        with open(filepath, 'w') as download_file:
-            download_file.write(json.dumps(media_entity))
+        with self.metrics.stage(STAGE_RESULT_WRITE):
+            data = json.dumps(media_entity).encode('utf-8')
+            self.store.put(media_id, data)
+        self._index_download(media_id, status, len(data), headers)
 
         return DownloadsRow(
             media_id = media_id,
             status = status,
-            filename = filename
+            filename = self.store.filename(media_id)
+        )
+
+    def _download_raw(self, media_id, keep_pending = True, entry = None):
+        """Stream a media item to its file, returns (status, DownloadsRow)
+
+        The body is copied as is and its status scanned on the way through,
+        so the document is never held in memory. It is written to a .part
+        file first; a pending one is dropped unless keep_pending. With an
+        index entry, the download is conditional on the media having changed.
+        """
+        part_filepath = self.store.part_filepath(media_id)
+        headers = {}
+        with open(part_filepath, 'wb') as download_file:
+            writer = ScanningWriter(download_file)
+            status_code = self.voicebase.media[media_id].download(
+                writer,
+                headers = conditional_headers(**self._validators(entry)),
+                response_headers = headers
+            )
+
+        if status_code == STATUS_NOT_MODIFIED:
+            os.remove(part_filepath)
+            return entry.status, self._unchanged_download(entry)
+        if not 200 <= status_code < 300:
+            return self._failed_raw_download(media_id, status_code)
+
+        return self._finish_raw_download(
+            media_id, writer.value, keep_pending, headers
+        )
+
+    async def _download_raw_async(self, media_id):
+        download_file = await asyncio.to_thread(
+            open, self.store.part_filepath(media_id), 'wb'
+        )
+        try:
+            writer = ScanningWriter(download_file)
+            status_code = await self.async_voicebase.media[media_id].download(
+                writer
+            )
+        finally:
+            await asyncio.to_thread(download_file.close)
+
+        if not 200 <= status_code < 300:
+            status, download = await asyncio.to_thread(
+                self._failed_raw_download, media_id, status_code
+            )
+            return download
+
+        status, download = await asyncio.to_thread(
+            self._finish_raw_download, media_id, writer.value
+        )
+        return download
+
+    def _finish_raw_download(self, media_id, status, keep_pending = True,
+            headers = None):
+        part_filepath = self.store.part_filepath(media_id)
+
+        with self.metrics.stage(STAGE_RESULT_WRITE):
+            if status in PENDING_STATUSES and not keep_pending:
+                os.remove(part_filepath)
+                return status, None
+
+            size = os.path.getsize(part_filepath)
+            self.store.put_file(media_id, part_filepath)
+        self._index_download(media_id, status, size, headers)
+        return status, DownloadsRow(
+            media_id = media_id,
+            status = status,
+            filename = self.store.filename(media_id)
+        )
+
+    def _failed_raw_download(self, media_id, status_code):
+        """(status, DownloadsRow) of a download the API refused
+
+        Nothing usable was written, so the .part file is dropped and the
+        row's status is the HTTP status code, as for a failed upload.
+        """
+        os.remove(self.store.part_filepath(media_id))
+        self.metrics.count('downloads_failed')
+        return status_code, DownloadsRow(
+            media_id = media_id, status = status_code
+        )
+
+    def _indexed(self, media_id):
+        """media_id's DownloadIndexEntry, if it is still downloaded"""
+        if self.index is None or media_id not in self.indexed_downloads:
+            return None
+        return self.index.get(media_id)
+
+    def _validators(self, entry):
+        """etag and last_modified of entry, for a conditional request"""
+        if entry is None:
+            return {}
+        return { 'etag': entry.etag, 'last_modified': entry.last_modified }
+
+    def _index_download(self, media_id, status, size, headers):
+        if self.index is None:
+            return
+        headers = {
+            name.lower(): value for name, value in (headers or {}).items()
+        }
+        self.index.record(
+            media_id, status, size,
+            etag = headers.get('etag'),
+            last_modified = headers.get('last-modified')
+        )
+
+    def _skipped_download(self, entry):
+        """Row of a download kept without asking the API (terminal status)"""
+        self.metrics.count('downloads_skipped')
+        return DownloadsRow(
+            media_id = entry.media_id,
+            status = entry.status,
+            filename = self.store.filename(entry.media_id)
+        )
+
+    def _unchanged_download(self, entry):
+        """Row of a download the API says has not changed (304)"""
+        self.metrics.count('downloads_not_modified')
+        self.index.touch(entry.media_id)
+        return DownloadsRow(
+            media_id = entry.media_id,
+            status = entry.status,
+            filename = self.store.filename(entry.media_id)
         )
 
     @classmethod
@@ -79,6 +350,71 @@ class Downloader:
             default = os.environ.get('TOKEN'),
             required = False
         )
+        parser.add_argument(
+            '--asyncio',
+            help = 'Download on an asyncio event loop (requires aiohttp)',
+            action = 'store_true',
+            required = False
+        )
+        parser.add_argument(
+            '--concurrency',
+            help = 'Downloads in flight with --asyncio (default ' +
+                str(DEFAULT_ASYNCIO_CONCURRENCY) + ')',
+            required = False
+        )
+        parser.add_argument(
+            '--raw',
+            help = 'Stream each media JSON to its file as is, instead of ' +
+                'parsing and re-serializing it',
+            action = 'store_true',
+            required = False
+        )
+        parser.add_argument(
+            '--poll',
+            help = 'Wait for each media to finish (or fail) before downloading ' +
+                'it; cap the polling rate with --maxRequestsPerSecond',
+            action = 'store_true',
+            required = False
+        )
+        parser.add_argument(
+            '--pollInterval',
+            help = 'Seconds between checks of running media, growing with ' +
+                'each check (default 10, x3 for queued media)',
+            type = float,
+            required = False
+        )
+        parser.add_argument(
+            '--pollTimeout',
+            help = 'Seconds to wait for each media before downloading it ' +
+                'as is (default: wait indefinitely)',
+            type = float,
+            required = False
+        )
+        parser.add_argument(
+            '--flushEvery',
+            help = 'Flush --outputCsv to disk every this many rows (default ' +
+                str(DEFAULT_FLUSH_EVERY) + ')',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--downloadIndex',
+            help = 'path to an index of what is already downloaded (kept ' +
+                'across runs); finished and failed media are not downloaded ' +
+                'again, others only if they changed',
+            required = False
+        )
+        parser.add_argument(
+            '--refreshAfter',
+            help = 'With --downloadIndex, seconds after which finished and ' +
+                'failed media are checked again (default: never)',
+            type = float,
+            required = False
+        )
+        VoiceBaseV3Client._add_command_line_args(parser)
+        MetricsReporter._add_command_line_args(parser)
+        Shard._add_command_line_args(parser)
+        DownloadStore._add_command_line_args(parser)
 
     @classmethod
     def _initialize_downloader(cls, args):
@@ -86,7 +422,20 @@ class Downloader:
             input_csv = args.inputCsv,
             download_directory = args.downloadDirectory,
             output_csv = args.outputCsv,
-            token = args.token
+            token = args.token,
+            use_asyncio = args.asyncio,
+            concurrency = args.concurrency,
+            raw = args.raw,
+            poll = args.poll,
+            poll_interval = args.pollInterval,
+            poll_timeout = args.pollTimeout,
+            flush_every = args.flushEvery,
+            shard = args.shard,
+            store_format = args.storeFormat,
+            download_index_path = args.downloadIndex,
+            refresh_after = args.refreshAfter,
+            client_kwargs = VoiceBaseV3Client._client_kwargs(args),
+            metrics_kwargs = MetricsReporter._reporter_kwargs(args)
         )
 
     @classmethod
@@ -2,6 +2,8 @@ import os
 import json
 import csv
 
+from BufferedCsvWriter import BufferedCsvWriter
+
 MEDIA_ID_COLUMN_NAME = 'mediaId'
 STATUS_COLUMN_NAME = 'status'
 FILENAME_COLUMN_NAME = 'filename'
@@ -15,12 +17,11 @@ class DownloadsRow:
         self.filename = kwargs.get('filename')
 
     @classmethod
-    def write_to_csv_filepath(cls, downloads, csv_filepath, header = True):
-        with open(csv_filepath, 'w') as csv_file:
-            downloads_writer = csv.writer(
-                csv_file, delimiter =  ',', quotechar = '"'
-            )
-
+    def write_to_csv_filepath(cls, downloads, csv_filepath, header = True,
+            flush_every = None):
+        with BufferedCsvWriter(
+            csv_filepath, flush_every = flush_every
+        ) as downloads_writer:
             if header:
                 downloads_writer.writerow(HEADER_ROW)
 
@@ -30,9 +31,14 @@ class DownloadsRow:
                 yield download
 
     @classmethod
-    def read_from_csv_filepath(cls, csv_filepath, headers = False):
+    def read_from_csv_filepath(cls, csv_filepath, headers = False, shard = None):
+        """Downloads rows, only those in shard (by mediaId) if given"""
         with open(csv_filepath, 'r') as csv_file:
             reader = csv.DictReader(csv_file, delimiter = ',')
+            if shard is not None:
+                reader = shard.filter(
+                    reader, lambda row: row.get(MEDIA_ID_COLUMN_NAME)
+                )
             for row in reader:
                 (media_id, status, filename) = row
                 yield DownloadsRow(
@@ -0,0 +1,324 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from DownloadsRow import DownloadsRow
+from DownloadStore import DownloadStore, open_store, STORE_JSON
+from BufferedCsvWriter import BufferedCsvWriter
+from Sharding import Shard
+
+# Pull flat fields (transcript text, keywords, duration, ...) out of the media
+# JSON downloaded by Downloader, on every core
+#
+# command line example
+#  python Extract.py --downloadDirectory downloads --outputCsv transcripts.csv
+#  python Extract.py --downloadDirectory downloads --inputCsv downloads.csv \
+#    --fields mediaId,durationMs,keywords,metadata.externalId --format jsonl \
+#    --output extract.jsonl
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMATS = [ FORMAT_CSV, FORMAT_JSONL ]
+
+DEFAULT_FIELDS = [
+    'mediaId', 'status', 'durationMs', 'wordCount', 'keywords', 'topics',
+    'transcript'
+]
+LIST_SEPARATOR = ';'
+DEFAULT_CHUNK_SIZE = 16
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+def _words(document):
+    return (document.get('transcript') or {}).get('words') or []
+
+def transcript_text(document):
+    """The transcript as text: words, with punctuation attached, no turns"""
+    parts = []
+    for word in _words(document):
+        kind = word.get('m')
+        if kind == 'punc':
+            if parts:
+                parts[-1] = parts[-1] + word.get('w', '')
+        elif kind is None:
+            parts.append(word.get('w', ''))
+    return ' '.join(parts)
+
+def duration_ms(document):
+    """length.milliseconds, or the end of the last word"""
+    milliseconds = (document.get('length') or {}).get('milliseconds')
+    if milliseconds is None:
+        words = _words(document)
+        milliseconds = words[-1].get('e') if words else None
+    return milliseconds
+
+def word_count(document):
+    return sum(1 for word in _words(document) if word.get('m') is None)
+
+def keywords(document):
+    return [
+        keyword.get('keyword')
+        for keyword in (document.get('knowledge') or {}).get('keywords') or []
+    ]
+
+def topics(document):
+    return [
+        topic.get('topicName')
+        for topic in (document.get('knowledge') or {}).get('topics') or []
+    ]
+
+FIELDS = {
+    'durationMs': duration_ms,
+    'wordCount': word_count,
+    'keywords': keywords,
+    'topics': topics,
+    'transcript': transcript_text
+}
+
+def field_value(document, field):
+    """A named field (FIELDS), or else the value at a dotted path"""
+    if field in FIELDS:
+        return FIELDS[field](document)
+
+    value = document
+    for key in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def extract_fields(data, fields):
+    document = _loads(data)
+    return [ field_value(document, field) for field in fields ]
+
+# Each worker process opens the store once, then parses the documents it is
+# sent by key, so only keys and extracted fields cross process boundaries
+_worker = {}
+
+def _initialize_worker(directory, store_format, fields):
+    _worker['store'] = open_store(directory, store_format)
+    _worker['fields'] = fields
+
+def _extract_one(key):
+    """(key, bytes parsed, values or None, error or None)"""
+    try:
+        data = _worker['store'].get(key)
+        return key, len(data), extract_fields(data, _worker['fields']), None
+    except Exception as error:
+        return key, 0, None, repr(error)
+
+class Extract:
+    """Extracts fields from every downloaded media, on a pool of processes
+
+    Parsing is CPU bound, so it runs in parallelism worker processes (one per
+    core by default), each reading and parsing whole documents with orjson
+    when it is installed. Rows are written in input order.
+    """
+    def __init__(self, **kwargs):
+        self.download_directory = kwargs['download_directory']
+        self.output = kwargs['output']
+        self.input_csv = kwargs.get('input_csv')
+        self.store_format = kwargs.get('store_format') or STORE_JSON
+        self.fields = kwargs.get('fields') or DEFAULT_FIELDS
+        self.format = kwargs.get('format') or FORMAT_CSV
+        self.parallelism = int(kwargs.get('parallelism') or os.cpu_count() or 1)
+        self.chunk_size = int(kwargs.get('chunk_size') or DEFAULT_CHUNK_SIZE)
+        self.flush_every = kwargs.get('flush_every')
+        self.shard = kwargs.get('shard')
+
+        self.documents = 0
+        self.bytes = 0
+        self.errors = 0
+        self.elapsed = 0
+
+    def process(self):
+        start = time.perf_counter()
+        with self._writer() as write:
+            for key, size, values, error in self.extract(self.input()):
+                if error is not None:
+                    self.errors = self.errors + 1
+                    print('SKIPPED', key, error)
+                    continue
+                self.documents = self.documents + 1
+                self.bytes = self.bytes + size
+                write(values)
+        self.elapsed = time.perf_counter() - start
+
+        print(
+            'extracted', self.documents, 'documents,',
+            '%.1f MB,' % (self.bytes / 1e6),
+            '%.1f MB/s,' % (self.bytes / 1e6 / max(self.elapsed, 1e-9)),
+            self.errors, 'skipped'
+        )
+
+    def input(self):
+        """Keys to extract: the downloads CSV's mediaIds, or the whole store"""
+        if self.input_csv is not None:
+            return (
+                download.media_id
+                for download in DownloadsRow.read_from_csv_filepath(
+                    self.input_csv, shard = self.shard
+                )
+            )
+        with open_store(self.download_directory, self.store_format) as store:
+            keys = store.keys()
+        if self.shard is not None:
+            keys = list(self.shard.filter(keys, lambda key: key))
+        return keys
+
+    def extract(self, keys):
+        """(key, bytes parsed, values, error) of each key, in order"""
+        initargs = (self.download_directory, self.store_format, self.fields)
+        if self.parallelism == 1:
+            _initialize_worker(*initargs)
+            try:
+                yield from map(_extract_one, keys)
+            finally:
+                _worker.pop('store').close()
+            return
+
+        with mp.Pool(
+            self.parallelism,
+            initializer = _initialize_worker,
+            initargs = initargs
+        ) as pool:
+            yield from pool.imap(_extract_one, keys, chunksize = self.chunk_size)
+
+    def _writer(self):
+        if self.format == FORMAT_JSONL:
+            return _JsonLinesWriter(self.output, self.fields)
+        return _CsvWriter(self.output, self.fields, self.flush_every)
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--downloadDirectory',
+            help = 'Directory of downloaded media (see Downloader)',
+            required = True
+        )
+        parser.add_argument(
+            '--output', '--outputCsv',
+            dest = 'output',
+            help = 'Output file: CSV, or JSON lines with --format jsonl',
+            required = True
+        )
+        parser.add_argument(
+            '--inputCsv',
+            help = 'Downloads CSV ("downloads": mediaId, status, filename) ' +
+                'of the media to extract (default: every downloaded media)',
+            required = False
+        )
+        parser.add_argument(
+            '--fields',
+            help = 'Comma-separated fields to extract: ' +
+                ', '.join(sorted(FIELDS)) + ', or a dotted path into the ' +
+                'media JSON such as mediaId or metadata.externalId (default ' +
+                ','.join(DEFAULT_FIELDS) + ')',
+            type = lambda text: [ field.strip() for field in text.split(',') ],
+            required = False
+        )
+        parser.add_argument(
+            '--format',
+            help = 'Output format: csv (default; lists joined with "' +
+                LIST_SEPARATOR + '") or jsonl',
+            choices = FORMATS,
+            default = FORMAT_CSV,
+            required = False
+        )
+        parser.add_argument(
+            '--parallelism',
+            help = 'Worker processes (default: one per core)',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--chunkSize',
+            help = 'Documents sent to a worker at a time (default ' +
+                str(DEFAULT_CHUNK_SIZE) + ')',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--flushEvery',
+            help = 'Flush the output CSV to disk every this many rows',
+            type = int,
+            required = False
+        )
+        DownloadStore._add_command_line_args(parser)
+        Shard._add_command_line_args(parser)
+
+    @classmethod
+    def _initialize_extract(cls, args):
+        return Extract(
+            download_directory = args.downloadDirectory,
+            output = args.output,
+            input_csv = args.inputCsv,
+            store_format = args.storeFormat,
+            fields = args.fields,
+            format = args.format,
+            parallelism = args.parallelism,
+            chunk_size = args.chunkSize,
+            flush_every = args.flushEvery,
+            shard = args.shard
+        )
+
+    @classmethod
+    def main(cls):
+        parser = argparse.ArgumentParser(
+            description = "Extract fields from downloaded VoiceBase V3 media"
+        )
+        cls._add_command_line_args(parser)
+        args = parser.parse_args()
+
+        extract = cls._initialize_extract(args)
+        extract.process()
+
+class _CsvWriter:
+    """Rows with a header of the field names; lists joined, objects as JSON"""
+    def __init__(self, path, fields, flush_every):
+        self.writer = BufferedCsvWriter(path, flush_every = flush_every)
+        self.writer.writerow(fields)
+
+    def __call__(self, values):
+        self.writer.writerow([ self._cell(value) for value in values ])
+
+    def _cell(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, list) and \
+                all(isinstance(item, str) for item in value):
+            return LIST_SEPARATOR.join(value)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.writer.close()
+
+class _JsonLinesWriter:
+    """One JSON object of the fields per line"""
+    def __init__(self, path, fields):
+        self.fields = fields
+        self.file = open(path, 'w', encoding = 'utf-8')
+
+    def __call__(self, values):
+        self.file.write(json.dumps(dict(zip(self.fields, values))) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+if __name__ == '__main__':
+    Extract.main()
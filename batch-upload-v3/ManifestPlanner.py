@@ -0,0 +1,294 @@
+import json
+import os
+import threading
+import urllib.parse
+from collections import Counter
+
+from ParallelPipeline import parallel_map
+
+DEFAULT_PLAN_PARALLELISM = 16
+DEFAULT_UPLOAD_MBPS = 100.0
+# Rough API time per upload request, besides sending the media itself
+DEFAULT_REQUEST_SECONDS = 0.5
+# Rows checked per task on the thread pool
+CHECK_BATCH_SIZE = 256
+SNIFF_BYTES = 16
+
+PROBLEM_DUPLICATE_ID = 'duplicate id'
+PROBLEM_MISSING_FILE = 'missing file'
+PROBLEM_EMPTY_FILE = 'empty file'
+PROBLEM_UNREADABLE_FILE = 'unreadable file'
+PROBLEM_UNKNOWN_MEDIA_TYPE = 'unrecognized media type'
+PROBLEM_MALFORMED_URL = 'malformed url'
+PROBLEM_INVALID_ROW = 'invalid row'
+
+def sniff_mime_type(header):
+    """MIME type of media from its first bytes, or None if not recognized"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'audio/wav'
+    if header[:3] == b'ID3' or \
+            (len(header) > 1 and header[0] == 0xff and header[1] & 0xe0 == 0xe0):
+        return 'audio/mpeg'
+    if header[:4] == b'fLaC':
+        return 'audio/flac'
+    if header[:4] == b'OggS':
+        return 'audio/ogg'
+    if header[4:8] == b'ftyp':
+        return 'video/mp4'
+    if header[:4] == b'\x1a\x45\xdf\xa3':
+        return 'video/webm'
+    if header[:5] == b'#!AMR':
+        return 'audio/amr'
+    if header[:4] == b'\x30\x26\xb2\x75':
+        return 'audio/x-ms-wma'
+    if header[:4] == b'FORM' and header[8:11] == b'AIF':
+        return 'audio/aiff'
+    return None
+
+def is_valid_url(url):
+    try:
+        parsed = urllib.parse.urlsplit(url)
+    except ValueError:
+        return False
+    return parsed.scheme in ('http', 'https') and bool(parsed.hostname)
+
+class MediaDirectoryIndex:
+    """Names of the regular files in a directory tree, indexed on demand
+
+    Each directory is listed once with os.scandir, which gets file types from
+    the directory entries themselves, so checking that a million files exist
+    costs a few listings rather than a million stat calls.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def exists(self, filepath):
+        directory, name = os.path.split(os.path.normpath(filepath))
+        return name in self._files_in(directory)
+
+    def _files_in(self, directory):
+        with self.lock:
+            files = self.files.get(directory)
+            if files is None:
+                files = self._scan(directory)
+                self.files[directory] = files
+            return files
+
+    def _scan(self, directory):
+        files = set()
+        try:
+            with os.scandir(directory or '.') as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            files.add(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return frozenset(files)
+
+class ManifestPlanner:
+    """Pre-flight checks of a batch's inputs, and a plan of the upload
+
+    Finds duplicate ids, missing, empty or unreadable files, files that do not
+    look like media, and malformed URLs before anything is uploaded. plan()
+    returns the totals, the estimated upload time and every problem found.
+    """
+    def __init__(self, **kwargs):
+        self.media_directory = kwargs.get('media_directory') or './'
+        self.parallelism = int(
+            kwargs.get('parallelism') or DEFAULT_PLAN_PARALLELISM
+        )
+        self.upload_parallelism = int(kwargs.get('upload_parallelism') or 1)
+        self.upload_mbps = float(
+            kwargs.get('upload_mbps') or DEFAULT_UPLOAD_MBPS
+        )
+        self.request_seconds = float(
+            kwargs.get('request_seconds') or DEFAULT_REQUEST_SECONDS
+        )
+        self.sniff = kwargs.get('sniff', True)
+        self.index = MediaDirectoryIndex(self.media_directory)
+
+    def plan(self, inputs):
+        """The plan for inputs (BatchUploadInputs), as a dict"""
+        first_rows = {}
+        problems = []
+        kinds = Counter()
+        mime_types = Counter()
+        total_bytes = 0
+        rows = 0
+
+        checked = parallel_map(
+            self._check_batch,
+            self._batches(inputs, first_rows, problems),
+            parallelism = self.parallelism
+        )
+        for batch in checked:
+            for kind, size, mime_type, problem in batch:
+                rows = rows + 1
+                kinds[kind] += 1
+                total_bytes = total_bytes + size
+                if mime_type is not None:
+                    mime_types[mime_type] += 1
+                if problem is not None:
+                    problems.append(problem)
+
+        problems.sort(key = lambda problem: problem['row'])
+        return {
+            'rows': rows,
+            'files': kinds['file'],
+            'urls': kinds['url'],
+            'media_updates': kinds['media_update'],
+            'total_bytes': total_bytes,
+            'estimated_upload_seconds': self.estimated_upload_seconds(
+                rows, total_bytes
+            ),
+            'mime_types': dict(sorted(mime_types.items())),
+            'problem_counts': dict(sorted(Counter(
+                problem['problem'] for problem in problems
+            ).items())),
+            'problems': problems
+        }
+
+    def estimated_upload_seconds(self, rows, total_bytes):
+        """Bandwidth-bound or request-bound, whichever is slower"""
+        transfer_seconds = total_bytes * 8 / (self.upload_mbps * 1e6)
+        request_seconds = rows * self.request_seconds / self.upload_parallelism
+        return max(transfer_seconds, request_seconds)
+
+    def _batches(self, inputs, first_rows, problems):
+        """Batches of (row number, input), noting duplicate ids on the way"""
+        batch = []
+        rows_read = 0
+        try:
+            for input in inputs:
+                row_number = rows_read
+                rows_read = rows_read + 1
+
+                first_row = first_rows.setdefault(input.id, row_number)
+                if first_row != row_number:
+                    problems.append(self._problem(
+                        row_number, input, PROBLEM_DUPLICATE_ID,
+                        'first at row ' + str(first_row)
+                    ))
+
+                batch.append((row_number, input))
+                if len(batch) >= CHECK_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        except Exception as exception:
+            # The reader cannot go on past a row it failed on
+            problems.append({
+                'row': rows_read,
+                'id': None,
+                'problem': PROBLEM_INVALID_ROW,
+                'detail': str(exception)
+            })
+        if batch:
+            yield batch
+
+    def _check_batch(self, batch):
+        return [ self._check(row_number, input) for row_number, input in batch ]
+
+    def _check(self, row_number, input):
+        """(kind, size, mime type, problem or None) of one input"""
+        if input.is_media_update:
+            return ('media_update', 0, None, None)
+
+        if input.is_url:
+            problem = None
+            if not is_valid_url(input.media_url):
+                problem = self._problem(row_number, input, PROBLEM_MALFORMED_URL)
+            return ('url', 0, None, problem)
+
+        filepath = input.media_filepath
+        if not self.index.exists(filepath):
+            return ('file', 0, None, self._problem(
+                row_number, input, PROBLEM_MISSING_FILE, filepath
+            ))
+
+        try:
+            size = os.stat(filepath).st_size
+            header = b''
+            if self.sniff and size > 0:
+                with open(filepath, 'rb') as media_file:
+                    header = media_file.read(SNIFF_BYTES)
+        except OSError as error:
+            return ('file', 0, None, self._problem(
+                row_number, input, PROBLEM_UNREADABLE_FILE, str(error)
+            ))
+
+        if size == 0:
+            return ('file', 0, None, self._problem(
+                row_number, input, PROBLEM_EMPTY_FILE, filepath
+            ))
+        if not self.sniff:
+            return ('file', size, None, None)
+
+        mime_type = sniff_mime_type(header)
+        if mime_type is None:
+            return ('file', size, None, self._problem(
+                row_number, input, PROBLEM_UNKNOWN_MEDIA_TYPE, filepath
+            ))
+        return ('file', size, mime_type, None)
+
+    def _problem(self, row_number, input, problem, detail = None):
+        return {
+            'row': row_number,
+            'id': input.id,
+            'problem': problem,
+            'detail': detail
+        }
+
+    @classmethod
+    def write_plan(cls, plan, path):
+        with open(path + '.tmp', 'w') as plan_file:
+            json.dump(plan, plan_file, indent = 2)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def summary(cls, plan):
+        """One line per total, for the console"""
+        lines = [
+            'rows: ' + str(plan['rows']) +
+                ' (files ' + str(plan['files']) +
+                ', urls ' + str(plan['urls']) +
+                ', media updates ' + str(plan['media_updates']) + ')',
+            'total: %.1f MB' % (plan['total_bytes'] / 1e6),
+            'estimated upload time: %.0f s' % plan['estimated_upload_seconds']
+        ]
+        for problem, count in plan['problem_counts'].items():
+            lines.append(problem + ': ' + str(count))
+        return '\n'.join(lines)
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--validate',
+            help = 'check the input (files, URLs, duplicate ids) and exit ' +
+                'without uploading; exits 1 if there are problems',
+            action = 'store_true',
+            required = False
+        )
+        parser.add_argument(
+            '--plan',
+            help = 'like --validate, and write the totals, estimated upload ' +
+                'time and problems to this JSON file',
+            required = False
+        )
+        parser.add_argument(
+            '--planUploadMbps',
+            help = 'upload bandwidth for the --plan estimate (default ' +
+                str(DEFAULT_UPLOAD_MBPS) + ')',
+            type = float,
+            required = False
+        )
+
+    @classmethod
+    def _planner_kwargs(cls, args):
+        return {
+            'upload_mbps': args.planUploadMbps
+        }
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# Enumeration of every media of an account through the paginated /media API
+
+DEFAULT_PAGE_SIZE = 1000
+
+def media_pages(client, **kwargs):
+    """Pages (lists of media summaries) of /media, in the API's order
+
+    Each page asks for up to page_size media after the last mediaId of the
+    page before; a short page is the last one. created_after and
+    created_before (ISO 8601 dates) are passed on as the onOrAfterDate and
+    onOrBeforeDate filters.
+    """
+    page_size = int(kwargs.get('page_size') or DEFAULT_PAGE_SIZE)
+    params = { 'limit': page_size }
+    if kwargs.get('created_after'):
+        params['onOrAfterDate'] = kwargs['created_after']
+    if kwargs.get('created_before'):
+        params['onOrBeforeDate'] = kwargs['created_before']
+
+    while True:
+        page = client.get('/media', params = dict(params)).get('media') or []
+        yield page
+        if len(page) < page_size:
+            return
+        params['after'] = page[-1]['mediaId']
+
+def list_media(client, **kwargs):
+    """Every media summary of /media matching the filters, as a stream
+
+    The next page is fetched on a background thread while the current one
+    is consumed. statuses, if given, keeps only media in those statuses;
+    the date filters are applied here too, for APIs that ignore them.
+    """
+    statuses = set(kwargs.get('statuses') or [])
+    created_after = kwargs.get('created_after')
+    created_before = kwargs.get('created_before')
+
+    for page in prefetched(media_pages(client, **kwargs)):
+        for media in page:
+            created = media.get('dateCreated') or ''
+            if statuses and media.get('status') not in statuses:
+                continue
+            if created_after and created < created_after:
+                continue
+            if created_before and created[:len(created_before)] > created_before:
+                continue
+            yield media
+
+def prefetched(iterable):
+    """iterable's items, each fetched (on a thread) while the last is used"""
+    iterator = iter(iterable)
+    done = object()
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        upcoming = executor.submit(next, iterator, done)
+        while True:
+            item = upcoming.result()
+            if item is done:
+                return
+            upcoming = executor.submit(next, iterator, done)
+            yield item
@@ -0,0 +1,122 @@
+import argparse
+import glob
+import os
+import shutil
+
+from DownloadsRow import HEADER_ROW
+
+# Combine the results or downloads CSVs of a sharded run (--shard K/N) into
+# one CSV, shard after shard
+#
+# command line example
+#  python MergeShards.py --inputCsv 'results-*.csv' --outputCsv results.csv
+#  python MergeShards.py --inputCsv dl-1.csv --inputCsv dl-2.csv --outputCsv dl.csv
+
+COPY_BUFFER_SIZE = 1024 * 1024
+KNOWN_HEADERS = [ ','.join(HEADER_ROW).encode('utf-8') ]
+
+class MergeShards:
+    """Concatenates CSVs a block at a time, keeping one copy of the header
+
+    The files are copied as bytes, without parsing, so merging is as fast as
+    the disk. A header is recognized when every file starts with the same
+    known header line (downloads CSVs), or always taken from the first line
+    with header = True.
+    """
+    def __init__(self, **kwargs):
+        self.input_csvs = kwargs['input_csvs']
+        self.output_csv = kwargs['output_csv']
+        self.header = kwargs.get('header')
+
+    def merge(self):
+        """Write output_csv, returns the number of files merged"""
+        first_lines = [ self._first_line(path) for path in self.input_csvs ]
+        header = self.header
+        if header is None:
+            header = len(set(first_lines)) == 1 and \
+                first_lines[0] in KNOWN_HEADERS
+
+        with open(self.output_csv + '.tmp', 'wb') as output_file:
+            for index, path in enumerate(self.input_csvs):
+                with open(path, 'rb') as input_file:
+                    if header and index > 0:
+                        input_file.readline()
+                    self._copy(input_file, output_file)
+        os.replace(self.output_csv + '.tmp', self.output_csv)
+        return len(self.input_csvs)
+
+    def _copy(self, input_file, output_file):
+        last_block = b''
+        while True:
+            block = input_file.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            output_file.write(block)
+            last_block = block
+        if last_block and not last_block.endswith(b'\n'):
+            output_file.write(b'\r\n')
+
+    def _first_line(self, path):
+        with open(path, 'rb') as input_file:
+            return input_file.readline().rstrip(b'\r\n')
+
+    @classmethod
+    def _input_csvs(cls, patterns):
+        """Paths from patterns (globs or paths), in order, each once"""
+        paths = []
+        for pattern in patterns:
+            matches = sorted(glob.glob(pattern)) or [ pattern ]
+            for path in matches:
+                if not os.path.isfile(path):
+                    raise Exception('not a file: ' + path)
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--inputCsv',
+            help = 'A shard\'s results or downloads CSV, or a glob of them ' +
+                '(can repeat); merged in the order given',
+            action = 'append',
+            required = True
+        )
+        parser.add_argument(
+            '--outputCsv',
+            help = 'Merged CSV',
+            required = True
+        )
+        parser.add_argument(
+            '--header',
+            help = 'Treat the first line of each CSV as a header, kept once ' +
+                '(default: only for downloads CSVs)',
+            action = 'store_true',
+            default = None,
+            required = False
+        )
+
+    @classmethod
+    def main(cls):
+        parser = argparse.ArgumentParser(
+            description = "Merge the CSVs of a sharded batch run"
+        )
+        cls._add_command_line_args(parser)
+        args = parser.parse_args()
+
+        input_csvs = [
+            path for path in cls._input_csvs(args.inputCsv)
+            if os.path.abspath(path) != os.path.abspath(args.outputCsv)
+        ]
+        if not input_csvs:
+            raise Exception('no CSVs to merge')
+
+        merged = MergeShards(
+            input_csvs = input_csvs,
+            output_csv = args.outputCsv,
+            header = args.header
+        ).merge()
+        print('merged', merged, 'files into', args.outputCsv)
+
+if __name__ == '__main__':
+    MergeShards.main()
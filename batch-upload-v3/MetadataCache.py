@@ -0,0 +1,67 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from SqliteStore import SqliteStore
+
+MetadataCacheEntry = namedtuple(
+    'MetadataCacheEntry', 'media_id metadata configuration status'
+)
+
+def document_digest(document):
+    """SHA-256 of a JSON document (str or object), or None for None
+
+    The document is hashed in a canonical form (sorted keys, no
+    whitespace), so the same metadata from a reordered CSV is the same.
+    """
+    if document is None:
+        return None
+    if type(document) is str:
+        document = json.loads(document)
+    canonical = json.dumps(
+        document, sort_keys = True, separators = (',', ':'), ensure_ascii = False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class MetadataCache(SqliteStore):
+    """Durable (SQLite) record of the metadata last sent for each mediaId
+
+    Only digests of the metadata and configuration are kept, with the
+    status the update returned, so a backfill run again sends only the
+    updates (and configurations) that changed. Thread-safe.
+    """
+    def __init__(self, path, **kwargs):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS sent (' +
+            'media_id TEXT PRIMARY KEY, metadata TEXT, configuration TEXT, ' +
+            'status TEXT)'
+        ], **kwargs)
+
+    def get(self, media_id):
+        """MetadataCacheEntry (of digests) of media_id, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT * FROM sent WHERE media_id = ?', (media_id,)
+            ).fetchone()
+        return None if row is None else MetadataCacheEntry(*row)
+
+    def record(self, media_id, metadata_digest, configuration_digest,
+            status = None):
+        """Note what was sent for media_id
+
+        A None digest (the part was not sent) keeps the one recorded before.
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO sent VALUES (?, ?, ?, ?) ' +
+                'ON CONFLICT (media_id) DO UPDATE SET ' +
+                'metadata = coalesce(excluded.metadata, metadata), ' +
+                'configuration = ' +
+                'coalesce(excluded.configuration, configuration), ' +
+                'status = excluded.status',
+                (
+                    media_id, metadata_digest, configuration_digest,
+                    None if status is None else str(status)
+                )
+            )
+            self._written()
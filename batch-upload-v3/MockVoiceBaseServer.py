@@ -0,0 +1,479 @@
+import argparse
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the VoiceBase V3 /media API, for benchmarks
+#
+# command line example
+#  python MockVoiceBaseServer.py --port 8080 --latency 0.05 --throttleRate 0.01
+#  python Downloader.py ... --apiUrl http://127.0.0.1:8080/v3
+#  python CallbackTester.py ... --destinationUrl http://127.0.0.1:8080/callback
+
+API_PREFIX = '/v3'
+CALLBACK_PATH = '/callback'
+MAX_PAGE_SIZE = 1000
+
+# Share of processingTime after which media reach each status
+STATUS_PROGRESSION = [
+    (0.1, 'scheduled'),
+    (0.3, 'running'),
+    (1.0, 'finished')
+]
+
+class MockVoiceBaseServer:
+    def __init__(self, **kwargs):
+        self.host = kwargs.get('host', '127.0.0.1')
+        self.port = int(kwargs.get('port', 0))
+        self.latency = float(kwargs.get('latency') or 0)
+        self.error_rate = float(kwargs.get('error_rate') or 0)
+        self.throttle_rate = float(kwargs.get('throttle_rate') or 0)
+        self.retry_after = float(kwargs.get('retry_after') or 1)
+        self.processing_time = kwargs.get('processing_time')
+        self.transcript_words = int(kwargs.get('transcript_words') or 0)
+        # Bytes per second each request body is read at (default: unlimited)
+        self.upload_bandwidth = kwargs.get('upload_bandwidth')
+        self.random = random.Random(kwargs.get('seed'))
+        self.media = {}
+        self.created = {}
+        self.media_lock = threading.Lock()
+        # Responses by HTTP status code, and callbacks received
+        self.stats = collections.Counter()
+        self.callbacks = 0
+        # (mediaId, names of the parts posted) of each media update
+        self.updates = []
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return self.base_url + API_PREFIX
+
+    @property
+    def callback_url(self):
+        return self.base_url + CALLBACK_PATH
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://' + host + ':' + str(port)
+
+    def start(self):
+        """Serve from a background thread, returns self"""
+        self.httpd = self._create_httpd()
+        self.thread = threading.Thread(
+            target = self.httpd.serve_forever,
+            daemon = True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def serve_forever(self):
+        self.httpd = self._create_httpd()
+        print('Serving mock VoiceBase V3 API on', self.url)
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def create_media(self, metadata = None):
+        media_id = str(uuid.uuid4())
+        now = time.time()
+        media = {
+            'mediaId': media_id,
+            'status': 'accepted',
+            'dateCreated': time.strftime(
+                '%Y-%m-%dT%H:%M:%S', time.gmtime(now)
+            ) + '.%03dZ' % (now % 1 * 1000),
+            'metadata': metadata or {}
+        }
+        with self.media_lock:
+            self.media[media_id] = media
+            self.created[media_id] = time.monotonic()
+        return media
+
+    def find_media(self, media_id):
+        """The media entity, advanced along its status progression"""
+        with self.media_lock:
+            media = self.media.get(media_id)
+            if media is not None and self.processing_time is not None:
+                self._progress(media)
+            return media
+
+    def _progress(self, media):
+        if media['status'] == 'finished':
+            return
+
+        elapsed = time.monotonic() - self.created[media['mediaId']]
+        processing_time = float(self.processing_time)
+        for share, status in STATUS_PROGRESSION:
+            if elapsed >= share * processing_time:
+                media['status'] = status
+
+        if media['status'] == 'finished':
+            media['transcript'] = self._transcript()
+
+    def _transcript(self):
+        words = [
+            {
+                'p': i,
+                's': i * 400,
+                'e': i * 400 + 350,
+                'c': 0.9,
+                'w': 'word' + str(i % 100)
+            }
+            for i in range(self.transcript_words)
+        ]
+        return { 'words': words }
+
+    def list_media(self, query):
+        """A page of /media: summaries in creation order, after a mediaId
+
+        query is parsed query parameters: limit, after (a mediaId) and the
+        onOrAfterDate and onOrBeforeDate bounds on dateCreated.
+        """
+        limit = min(int(query.get('limit') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        with self.media_lock:
+            media = list(self.media.values())
+            for item in media:
+                if self.processing_time is not None:
+                    self._progress(item)
+            media = [
+                {
+                    'mediaId': item['mediaId'],
+                    'status': item['status'],
+                    'dateCreated': item['dateCreated'],
+                    'metadata': item['metadata']
+                }
+                for item in media
+            ]
+
+        after = query.get('after')
+        if after:
+            media_ids = [ item['mediaId'] for item in media ]
+            if after in media_ids:
+                media = media[media_ids.index(after) + 1:]
+            else:
+                media = []
+        if query.get('onOrAfterDate'):
+            media = [
+                item for item in media
+                if item['dateCreated'] >= query['onOrAfterDate']
+            ]
+        if query.get('onOrBeforeDate'):
+            media = [
+                item for item in media
+                if item['dateCreated'][:len(query['onOrBeforeDate'])] <=
+                    query['onOrBeforeDate']
+            ]
+        return { 'media': media[:limit] }
+
+    def injected_error(self):
+        """An injected (code, headers) for the next API request, or None"""
+        if self.throttle_rate > 0 and self.random.random() < self.throttle_rate:
+            return 429, { 'Retry-After': str(self.retry_after) }
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            return 500, {}
+        return None
+
+    def _create_httpd(self):
+        server = self
+
+        class Handler(MockVoiceBaseRequestHandler):
+            mock = server
+
+        httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        httpd.daemon_threads = True
+        return httpd
+
+    @classmethod
+    def main(cls):
+        parser = argparse.ArgumentParser(
+            description = "Mock VoiceBase V3 API server"
+        )
+        parser.add_argument(
+            '--host',
+            help = 'Interface to listen on (default 127.0.0.1)',
+            default = '127.0.0.1',
+            required = False
+        )
+        parser.add_argument(
+            '--port',
+            help = 'Port to listen on (default 8080)',
+            default = 8080,
+            required = False
+        )
+        parser.add_argument(
+            '--latency',
+            help = 'Seconds to wait before answering each request (default 0)',
+            default = 0,
+            required = False
+        )
+        parser.add_argument(
+            '--errorRate',
+            help = 'Share of API requests answered with a 500 (default 0)',
+            type = float,
+            default = 0,
+            required = False
+        )
+        parser.add_argument(
+            '--throttleRate',
+            help = 'Share of API requests answered with a 429 (default 0)',
+            type = float,
+            default = 0,
+            required = False
+        )
+        parser.add_argument(
+            '--retryAfter',
+            help = 'Retry-After seconds sent with a 429 (default 1)',
+            type = float,
+            default = 1,
+            required = False
+        )
+        parser.add_argument(
+            '--processingTime',
+            help = 'Seconds for new media to go from accepted to finished ' +
+                '(default: they stay accepted)',
+            type = float,
+            required = False
+        )
+        parser.add_argument(
+            '--transcriptWords',
+            help = 'Number of words in finished transcripts (default 0)',
+            type = int,
+            default = 0,
+            required = False
+        )
+        parser.add_argument(
+            '--uploadBandwidth',
+            help = 'Bytes per second to read each request body at, to ' +
+                'simulate upload time (default: unlimited)',
+            type = float,
+            required = False
+        )
+
+        args = parser.parse_args()
+
+        MockVoiceBaseServer(
+            host = args.host,
+            port = args.port,
+            latency = args.latency,
+            error_rate = args.errorRate,
+            throttle_rate = args.throttleRate,
+            retry_after = args.retryAfter,
+            processing_time = args.processingTime,
+            transcript_words = args.transcriptWords,
+            upload_bandwidth = args.uploadBandwidth
+        ).serve_forever()
+
+class MockVoiceBaseRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._consume_body()
+        path = self._api_path()
+        if self._send_injected_error(path):
+            return
+
+        if path == '/media':
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            self._send_json(200, self.mock.list_media({
+                name: values[-1] for name, values in query.items()
+            }))
+        elif path is not None and path.startswith('/media/'):
+            media = self._find_media(path)
+            if media is None:
+                self._send_not_found()
+            else:
+                self._send_media(media)
+        else:
+            self._send_not_found()
+
+    def _send_media(self, media):
+        """The media entity, with an ETag; 304 if If-None-Match has it"""
+        with self.mock.media_lock:
+            etag = '"' + hashlib.sha1(
+                json.dumps(media, sort_keys = True).encode('utf-8')
+            ).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            if self.mock.latency > 0:
+                time.sleep(self.mock.latency)
+            with self.mock.media_lock:
+                self.mock.stats[304] = self.mock.stats[304] + 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self._send_json(200, media, { 'ETag': etag })
+
+    def do_POST(self):
+        path = self._api_path()
+        # Media update bodies are small, and kept to see what they carry
+        body = [] if path is not None and path.startswith('/media/') \
+            else None
+        bytes_received = self._consume_body(body)
+        if self.path == CALLBACK_PATH:
+            with self.mock.media_lock:
+                self.mock.callbacks = self.mock.callbacks + 1
+            self._send_json(200, {})
+            return
+
+        if self._send_injected_error(path):
+            return
+
+        if path == '/media':
+            media = self.mock.create_media()
+            self._send_json(200, {
+                'mediaId': media['mediaId'],
+                'status': media['status'],
+                'bytesReceived': bytes_received
+            })
+        elif path is not None and path.startswith('/media/'):
+            media = self._find_media(path)
+            if media is None:
+                self._send_not_found()
+            else:
+                parts = re.findall(rb'; name="([^"]+)"', b''.join(body))
+                with self.mock.media_lock:
+                    self.mock.updates.append((
+                        media['mediaId'],
+                        sorted(part.decode('utf-8') for part in parts)
+                    ))
+                self._send_json(200, {
+                    'mediaId': media['mediaId'],
+                    'status': media['status']
+                })
+        else:
+            self._send_not_found()
+
+    def do_DELETE(self):
+        self._consume_body()
+        path = self._api_path()
+        if self._send_injected_error(path):
+            return
+
+        media = self._find_media(path) if path else None
+        if media is None:
+            self._send_not_found()
+        else:
+            with self.mock.media_lock:
+                self.mock.media.pop(media['mediaId'], None)
+            self._send_json(200, { 'mediaId': media['mediaId'] })
+
+    def _api_path(self):
+        path = self.path.split('?', 1)[0]
+        if not path.startswith(API_PREFIX):
+            return None
+        return path[len(API_PREFIX):]
+
+    def _find_media(self, path):
+        return self.mock.find_media(path[len('/media/'):])
+
+    def _send_injected_error(self, path):
+        if path is None:
+            return False
+
+        injected = self.mock.injected_error()
+        if injected is None:
+            return False
+
+        code, headers = injected
+        self._send_json(code, {
+            'status': code,
+            'errors': [ { 'error': 'Injected error' } ]
+        }, headers)
+        return True
+
+    def _consume_body(self, chunks = None):
+        """Read the request body (into chunks, if a list), returns its size"""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            return self._consume_chunked_body(chunks)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        return self._consume(length, chunks)
+
+    def _consume_chunked_body(self, chunks = None):
+        received = 0
+        while True:
+            size = int(self.rfile.readline().split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                break
+            received = received + self._consume(size, chunks)
+            self.rfile.readline()
+
+        # Trailers, up to the blank line
+        while self.rfile.readline().strip():
+            pass
+        return received
+
+    def _consume(self, length, chunks = None):
+        bandwidth = self.mock.upload_bandwidth
+        started = time.monotonic()
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining = remaining - len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+            if bandwidth:
+                behind = (length - remaining) / bandwidth - \
+                    (time.monotonic() - started)
+                if behind > 0:
+                    time.sleep(behind)
+        return length - remaining
+
+    def _send_not_found(self):
+        self._send_json(404, {
+            'status': 404,
+            'errors': [ { 'error': 'Not found: ' + self.path } ]
+        })
+
+    def _send_json(self, code, entity, headers = None):
+        if self.mock.latency > 0:
+            time.sleep(self.mock.latency)
+
+        with self.mock.media_lock:
+            body = json.dumps(entity).encode('utf-8')
+            self.mock.stats[code] = self.mock.stats[code] + 1
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.headers.get('Connection', '').lower() == 'close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+    MockVoiceBaseServer.main()
@@ -1,18 +1,19 @@
 from CallbackTester import CallbackTester
-import multiprocessing as mp
+from RateLimiter import RequestThrottle
+from ParallelPipeline import parallel_map, ORDER_COMPLETION
 
-# Parallel pattern inspired by:
-# https://stackoverflow.com/questions/43078980/python-multiprocessing-with-generator
+# Callbacks are sent from a pool of threads, each with its own keep-alive
+# session: the work is network I/O, so threads avoid process spawning and
+# pickling, and parallel_map keeps reading and sending overlapped and bounded.
+# For a load test of the receiving endpoint, see CallbackReplay.
 
 class ParallelCallbackTester(CallbackTester):
     def __init__(self, **kwargs):
-        super(ParallelCallbackTester, self).__init__(**kwargs)
-        self.parallelism = int(kwargs.get('parallelism', 4))
-        #self.max_queue_size = 5 * 1000 * 1000
-        self.max_queue_size = 100
-        self.request_queue = mp.Queue(maxsize = self.max_queue_size)
-        self.response_queue = mp.Queue(maxsize = self.max_queue_size)
-
+        parallelism = int(kwargs.get('parallelism') or 4)
+        super(ParallelCallbackTester, self).__init__(
+            **{ **kwargs, 'pool_maxsize': parallelism }
+        )
+        self.parallelism = parallelism
 
     @classmethod
     def _add_command_line_args(cls, parser):
@@ -24,43 +25,17 @@ class ParallelCallbackTester(CallbackTester):
         )
 
     def test(self, results):
-        def parallel_processor(parallel_callback_tester):
-            print('[Parallel] Initialized parallel processor')
-            while True:
-                download = parallel_callback_tester.request_queue.get()
-                if download is None:
-                    break
-
-                test = parallel_callback_tester.test_one(download)
-                self.response_queue.put(test)
-
-
-        pool = mp.Pool(
-            self.parallelism,
-            initializer = parallel_processor,
-            initargs = [self]
+        if self.use_asyncio:
+            yield from super(ParallelCallbackTester, self).test(results)
+            return
+
+        yield from parallel_map(
+            self.test_one,
+            results,
+            parallelism = self.parallelism,
+            order = ORDER_COMPLETION
         )
 
-        total_results = 0
-        for result in results:
-            # This request will block when queue exceeds maximum size
-            self.request_queue.put(result)
-            total_results = total_results + 1
-
-        # Put a None for each worker to signal stop
-        for _ in range(self.parallelism):
-            self.request_queue.put(None)
-
-        for i in range(total_results):
-            callback = self.response_queue.get()
-            print('[Parallel] consumed', i)
-            yield callback
-
-        print('[Parallel] done consuming')
-
-        pool.close()
-        pool.join()
-
     @classmethod
     def _initialize_tester(cls, args):
         print('parallelism: ', args.parallelism)
@@ -69,7 +44,12 @@ class ParallelCallbackTester(CallbackTester):
             download_directory = args.downloadDirectory,
             output_csv = args.outputCsv,
             destination_url = args.destinationUrl,
-            parallelism = args.parallelism
+            parallelism = args.parallelism,
+            use_asyncio = args.asyncio,
+            concurrency = args.concurrency,
+            shard = args.shard,
+            store_format = args.storeFormat,
+            throttle_kwargs = RequestThrottle._throttle_kwargs(args)
         )
 
 if __name__ == '__main__':
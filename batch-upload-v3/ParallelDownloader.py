@@ -1,18 +1,22 @@
 from Downloader import Downloader
-import multiprocessing as mp
+from VoiceBaseV3Client import VoiceBaseV3Client
+from ParallelPipeline import parallel_map, ORDERS, ORDER_COMPLETION
+from ParallelPipeline import ORDER_INPUT
+from ReorderBuffer import ReorderBuffer, DEFAULT_REORDER_WINDOW
+from Instrumentation import MetricsReporter
 
-# Parallel pattern inspired by:
-# https://stackoverflow.com/questions/43078980/python-multiprocessing-with-generator
+# Downloads run on a pool of threads: the work is network I/O, so threads
+# avoid process spawning and pickling, and parallel_map keeps reading the
+# input, downloading and writing the output CSV overlapped and bounded.
 
 class ParallelDownloader(Downloader):
     def __init__(self, **kwargs):
-        super(ParallelDownloader, self).__init__(**kwargs)
-        self.parallelism = int(kwargs.get('parallelism', 4))
-        #self.max_queue_size = 5 * 1000 * 1000
-        self.max_queue_size = 100
-        self.request_queue = mp.Queue(maxsize = self.max_queue_size)
-        self.response_queue = mp.Queue(maxsize = self.max_queue_size)
-
+        parallelism = int(kwargs.get('parallelism') or 4)
+        super(ParallelDownloader, self).__init__(
+            **{ **kwargs, 'parallelism': parallelism }
+        )
+        self.results_order = kwargs.get('results_order') or ORDER_COMPLETION
+        self.reorder_window = kwargs.get('reorder_window')
 
     @classmethod
     def _add_command_line_args(cls, parser):
@@ -22,44 +26,53 @@ class ParallelDownloader(Downloader):
             help = 'Level of parallelism (# concurrent, default 4)',
             required = False
         )
+        parser.add_argument(
+            '--resultsOrder',
+            help = 'Order of rows in --outputCsv: completion (default) or input',
+            choices = ORDERS,
+            default = ORDER_COMPLETION,
+            required = False
+        )
+        parser.add_argument(
+            '--reorderWindow',
+            help = 'With --resultsOrder input, rows held in memory behind a ' +
+                'slow download before the rest are spilled to a temporary ' +
+                'file (default ' + str(DEFAULT_REORDER_WINDOW) + ')',
+            type = int,
+            required = False
+        )
 
     def download(self, results):
-        def parallel_processor(parallel_downloader):
-            print('[Parallel] Initialized parallel processor')
-            while True:
-                result = parallel_downloader.request_queue.get()
-                if result is None:
-                    break
+        if self.use_asyncio or self.poll:
+            yield from super(ParallelDownloader, self).download(results)
+            return
 
-                download = parallel_downloader.download_one(result)
-                self.response_queue.put(download)
+        if self.results_order != ORDER_INPUT:
+            yield from parallel_map(
+                self.download_one,
+                results,
+                parallelism = self.parallelism,
+                order = ORDER_COMPLETION
+            )
+            return
 
-        pool = mp.Pool(
-            self.parallelism,
-            initializer = parallel_processor,
-            initargs = [self]
+        # Downloads run in completion order and are put back in input order
+        # afterwards, so a slow download does not stop the others starting
+        downloads = parallel_map(
+            self._numbered_download,
+            enumerate(results),
+            parallelism = self.parallelism,
+            order = ORDER_COMPLETION
         )
-
-        total_results = 0
-        for result in results:
-            # This request will block when queue exceeds maximum size
-            self.request_queue.put(result)
-            total_results = total_results + 1
-
-        # Put a None for each worker to signal stop
-        for _ in range(self.parallelism):
-            self.request_queue.put(None)
-
-        for i in range(total_results):
-            download = self.response_queue.get()
-            print('[Parallel] consumed', i)
+        reorder_buffer = ReorderBuffer(window = self.reorder_window)
+        for index, download in reorder_buffer.reorder(downloads):
             yield download
 
-        print('[Parallel] done consuming')
-
-        pool.close()
-        pool.join()
+    def _numbered_download(self, numbered_result):
+        index, result = numbered_result
+        return index, self.download_one(result)
 
+    @classmethod
     def _initialize_downloader(cls, args):
         print('parallelism: ', args.parallelism)
         return ParallelDownloader(
@@ -67,7 +80,22 @@ class ParallelDownloader(Downloader):
             download_directory = args.downloadDirectory,
             output_csv = args.outputCsv,
             token = args.token,
-            parallelism = args.parallelism
+            parallelism = args.parallelism,
+            results_order = args.resultsOrder,
+            reorder_window = args.reorderWindow,
+            flush_every = args.flushEvery,
+            shard = args.shard,
+            store_format = args.storeFormat,
+            download_index_path = args.downloadIndex,
+            refresh_after = args.refreshAfter,
+            use_asyncio = args.asyncio,
+            concurrency = args.concurrency,
+            raw = args.raw,
+            poll = args.poll,
+            poll_interval = args.pollInterval,
+            poll_timeout = args.pollTimeout,
+            client_kwargs = VoiceBaseV3Client._client_kwargs(args),
+            metrics_kwargs = MetricsReporter._reporter_kwargs(args)
         )
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+ORDER_INPUT = 'input'
+ORDER_COMPLETION = 'completion'
+ORDERS = [ ORDER_INPUT, ORDER_COMPLETION ]
+
+DEFAULT_ASYNCIO_CONCURRENCY = 100
+
+def parallel_map(function, iterable, **kwargs):
+    """Lazily map function over iterable on a pool of threads
+
+    At most max_in_flight items (default 2 x parallelism) are pulled from
+    iterable ahead of the consumer, so memory stays flat no matter how
+    long the input is. Results come back in input order (the default) or
+    in completion order. An exception raised by function is re-raised to
+    the consumer.
+    """
+    parallelism = int(kwargs.get('parallelism') or 1)
+    order = kwargs.get('order') or ORDER_INPUT
+    max_in_flight = int(kwargs.get('max_in_flight') or 2 * parallelism)
+
+    if order not in ORDERS:
+        raise ValueError('order must be one of: ' + ', '.join(ORDERS))
+
+    if order == ORDER_INPUT:
+        return _ordered_map(function, iterable, parallelism, max_in_flight)
+    else:
+        return _unordered_map(function, iterable, parallelism, max_in_flight)
+
+def _ordered_map(function, iterable, parallelism, max_in_flight):
+    executor = ThreadPoolExecutor(max_workers = parallelism)
+    in_flight = collections.deque()
+    try:
+        for item in iterable:
+            in_flight.append(executor.submit(function, item))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        executor.shutdown(wait = True, cancel_futures = True)
+
+def _unordered_map(function, iterable, parallelism, max_in_flight):
+    executor = ThreadPoolExecutor(max_workers = parallelism)
+    in_flight = set()
+    try:
+        for item in iterable:
+            in_flight.add(executor.submit(function, item))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when = FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when = FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait = True, cancel_futures = True)
+
+def async_map(coroutine_function, iterable, **kwargs):
+    """Lazily map a coroutine function over iterable on an event loop
+
+    The loop runs on a background thread and keeps up to concurrency
+    coroutines in flight; results are handed back to the (synchronous)
+    consumer in input or completion order, so async work can sit in the
+    middle of an ordinary generator pipeline. cleanup, if given, is a
+    coroutine function awaited on the loop once all work is done (e.g. to
+    close an aiohttp session).
+
+    Items are pulled from iterable on the loop's default executor, so a
+    slow input generator (CSV parsing, configuration building) does not
+    stall requests already in flight. Closing the consumer early cancels
+    the outstanding coroutines; an input item that is being produced at
+    that moment is still allowed to finish.
+    """
+    concurrency = int(kwargs.get('concurrency') or 1)
+    order = kwargs.get('order') or ORDER_INPUT
+    cleanup = kwargs.get('cleanup')
+
+    if order not in ORDERS:
+        raise ValueError('order must be one of: ' + ', '.join(ORDERS))
+
+    results = queue.Queue(maxsize = concurrency)
+    stopped = threading.Event()
+    running = {}
+
+    async def deliver(item):
+        # Blocks only this coroutine (not the loop) while the consumer catches up
+        await asyncio.get_running_loop().run_in_executor(
+            None, _put_unless_stopped, results, item, stopped
+        )
+
+    async def drive():
+        loop = asyncio.get_running_loop()
+        running['loop'] = loop
+        running['task'] = asyncio.current_task()
+
+        in_flight = collections.deque() if order == ORDER_INPUT else set()
+        iterator = iter(iterable)
+
+        async def deliver_some():
+            if order == ORDER_INPUT:
+                await deliver(await in_flight.popleft())
+            else:
+                done, pending = await asyncio.wait(
+                    in_flight, return_when = asyncio.FIRST_COMPLETED
+                )
+                in_flight.difference_update(done)
+                for task in done:
+                    await deliver(task.result())
+
+        try:
+            while not stopped.is_set():
+                item = await loop.run_in_executor(None, next, iterator, _DONE)
+                if item is _DONE:
+                    break
+
+                task = asyncio.ensure_future(coroutine_function(item))
+                if order == ORDER_INPUT:
+                    in_flight.append(task)
+                else:
+                    in_flight.add(task)
+
+                if len(in_flight) >= concurrency:
+                    await deliver_some()
+
+            while in_flight and not stopped.is_set():
+                await deliver_some()
+        except BaseException as exception:
+            await deliver(_Failure(exception))
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if cleanup is not None:
+                await cleanup()
+            await deliver(_DONE)
+
+    thread = threading.Thread(target = asyncio.run, args = [ drive() ])
+    thread.start()
+    finished = False
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                finished = True
+                break
+            if isinstance(item, _Failure):
+                finished = True
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        if not finished and 'loop' in running:
+            try:
+                running['loop'].call_soon_threadsafe(running['task'].cancel)
+            except RuntimeError:
+                # The loop finished on its own in the meantime
+                pass
+        thread.join()
+
+_DONE = object()
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+def _put_unless_stopped(results, item, stopped):
+    while not stopped.is_set():
+        try:
+            results.put(item, timeout = 0.1)
+            return
+        except queue.Full:
+            pass
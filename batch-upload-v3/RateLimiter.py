@@ -0,0 +1,293 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 60.0
+RETRY_STATUSES = { 429, 500, 502, 503, 504 }
+THROTTLE_STATUSES = { 429, 503 }
+# Responses saying the request was not processed: the only ones a request
+# that is not idempotent (a media POST) can be sent again after
+NOT_PROCESSED_STATUSES = { 429, 503 }
+
+# What RequestThrottle needs from a response, for clients (aiohttp) whose
+# responses don't outlive their context manager
+HttpResponse = namedtuple('HttpResponse', 'status_code headers text')
+
+class TokenBucket:
+    """Thread-safe token bucket (as a GCRA) shared by every request
+
+    rate is in requests per second and burst is how many requests may go
+    out back to back. pause() holds everyone back, e.g. for Retry-After.
+    """
+    def __init__(self, **kwargs):
+        rate = kwargs.get('rate')
+        self.interval = 1.0 / float(rate) if rate else 0.0
+        self.burst = max(1, int(kwargs.get('burst') or 1))
+        self.theoretical_arrival = 0.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returns the seconds to wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.interval > 0:
+                arrival = max(self.theoretical_arrival, now)
+                wait = max(
+                    wait,
+                    arrival - now - (self.burst - 1) * self.interval
+                )
+                self.theoretical_arrival = arrival + self.interval
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def __getstate__(self):
+        # A copy in another process gets its own lock (and its own budget)
+        state = { **self.__dict__ }
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on requests in flight
+
+    The limit grows by increase per limit's worth of successes (roughly
+    +1 per round trip) and is multiplied by decrease on a throttle or
+    error, staying within [minimum, maximum].
+    """
+    def __init__(self, **kwargs):
+        self.maximum = float(kwargs['maximum'])
+        self.minimum = float(kwargs.get('minimum') or 1)
+        self.limit = float(kwargs.get('initial') or self.maximum)
+        self.increase = float(kwargs.get('increase') or 1)
+        self.decrease = float(kwargs.get('decrease') or 0.5)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def try_acquire(self):
+        with self.condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight = self.in_flight + 1
+                return True
+            return False
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight = self.in_flight + 1
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            await asyncio.sleep(0.01)
+
+    def release(self, throttled = False):
+        with self.condition:
+            self.in_flight = self.in_flight - 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                self.limit = min(
+                    self.maximum,
+                    self.limit + self.increase / max(self.limit, 1.0)
+                )
+            self.condition.notify_all()
+
+    def __getstate__(self):
+        state = { **self.__dict__, 'in_flight': 0 }
+        del state['condition']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.condition = threading.Condition()
+
+class RequestThrottle:
+    """Rate limiting, adaptive concurrency and retries around HTTP calls
+
+    call() takes a send function returning a response (anything with
+    status_code and headers). 429 and 5xx responses (or the given
+    retry_statuses) and the given network exceptions are retried with
+    jittered exponential backoff, honoring Retry-After; the last response
+    is returned (or exception raised) once retries run out.
+    """
+    def __init__(self, **kwargs):
+        max_requests_per_second = kwargs.get('max_requests_per_second')
+        max_concurrency = kwargs.get('max_concurrency')
+        max_retries = kwargs.get('max_retries')
+
+        self.max_retries = int(
+            DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.base_delay = float(
+            kwargs.get('retry_base_delay') or DEFAULT_RETRY_BASE_DELAY
+        )
+        self.max_delay = float(
+            kwargs.get('retry_max_delay') or DEFAULT_RETRY_MAX_DELAY
+        )
+        self.bucket = TokenBucket(
+            rate = max_requests_per_second,
+            burst = kwargs.get('burst')
+        )
+        self.concurrency = None
+        if max_concurrency:
+            self.concurrency = AdaptiveConcurrencyLimiter(
+                maximum = max_concurrency
+            )
+
+    def call(self, send, **kwargs):
+        retry_exceptions = kwargs.get('retry_exceptions', ())
+        retry_statuses = kwargs.get('retry_statuses', RETRY_STATUSES)
+        rewind = kwargs.get('rewind')
+
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            if self.concurrency is not None:
+                self.concurrency.acquire()
+
+            response = None
+            try:
+                response = send()
+            except retry_exceptions:
+                self._release(None)
+                if attempt >= self.max_retries:
+                    raise
+            except BaseException:
+                self._release(None)
+                raise
+            else:
+                self._release(response)
+                if not self._should_retry(response, attempt, retry_statuses):
+                    return response
+
+            time.sleep(self._backoff(response, attempt))
+            attempt = attempt + 1
+            if rewind is not None:
+                rewind()
+
+    async def call_async(self, send, **kwargs):
+        retry_exceptions = kwargs.get('retry_exceptions', ())
+        retry_statuses = kwargs.get('retry_statuses', RETRY_STATUSES)
+        rewind = kwargs.get('rewind')
+
+        attempt = 0
+        while True:
+            await self.bucket.acquire_async()
+            if self.concurrency is not None:
+                await self.concurrency.acquire_async()
+
+            response = None
+            try:
+                response = await send()
+            except retry_exceptions:
+                self._release(None)
+                if attempt >= self.max_retries:
+                    raise
+            except BaseException:
+                self._release(None)
+                raise
+            else:
+                self._release(response)
+                if not self._should_retry(response, attempt, retry_statuses):
+                    return response
+
+            await asyncio.sleep(self._backoff(response, attempt))
+            attempt = attempt + 1
+            if rewind is not None:
+                rewind()
+
+    def _release(self, response):
+        if self.concurrency is not None:
+            self.concurrency.release(
+                throttled = response is None or
+                    response.status_code in THROTTLE_STATUSES
+            )
+
+    def _should_retry(self, response, attempt, retry_statuses):
+        return response.status_code in retry_statuses and \
+            attempt < self.max_retries
+
+    def _backoff(self, response, attempt):
+        retry_after = None
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+        if retry_after is not None:
+            delay = min(retry_after, self.max_delay)
+            # Everyone sharing this throttle waits, not just this request
+            self.bucket.pause(delay)
+            return delay
+
+        # "Full jitter" exponential backoff
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * (2 ** attempt))
+        )
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--maxRequestsPerSecond',
+            help = 'Ceiling on API requests per second (default: unlimited)',
+            type = float,
+            required = False
+        )
+        parser.add_argument(
+            '--maxConcurrency',
+            help = 'Adapt requests in flight (AIMD) up to this ceiling ' +
+                '(default: not adaptive)',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--maxRetries',
+            help = 'Retries for 429/5xx responses and network errors; ' +
+                'uploads only for 429/503 and failures to connect ' +
+                '(default ' + str(DEFAULT_MAX_RETRIES) + ')',
+            type = int,
+            required = False
+        )
+
+    @classmethod
+    def _throttle_kwargs(cls, args):
+        return {
+            'max_requests_per_second': args.maxRequestsPerSecond,
+            'max_concurrency': args.maxConcurrency,
+            'max_retries': args.maxRetries
+        }
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date)"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -1,32 +1,102 @@
 import argparse
 import csv
 import os
-from collections import namedtuple
+import time
+from collections import namedtuple, Counter
+
+from DownloadStore import DownloadStore, open_store, STORE_JSON
+from BufferedCsvWriter import BufferedCsvWriter
+from ParallelPipeline import parallel_map
+
+# Rename downloads from <mediaId> to the <id> they were uploaded as, in bulk:
+# the whole input is checked against the download directory first, and
+# nothing is renamed if any row has a problem (unless --skipProblems)
+#
+# command line example
+#  python RenameDownloads.py --inputCsv results.csv --downloadDirectory dl
+#  python RenameDownloads.py --inputCsv results.csv --downloadDirectory dl \
+#    --dryRun
+#  python RenameDownloads.py --downloadDirectory dl --undo dl/rename-undo.csv
 
 ResultsRow = namedtuple('ResultsRow', 'id media_id status')
 
+# Renames in waves: every rename in a wave is independent of the others
+RenamePlan = namedtuple('RenamePlan', 'waves problems skipped')
+
+TEMPORARY_SUFFIX = '.renaming'
+
+# Last row of an undo log whose renames were all undone
+UNDONE = 'undone'
+
 def main():
     parser = argparse.ArgumentParser(
-        description = "Batch downloader for VoiceBase V3"
+        description = "Rename VoiceBase V3 downloads from mediaId to id"
     )
     parser.add_argument(
         '--inputCsv',
-        help = 'Output CSV ("downloads": mediaId, status, filename)',
-        required = True
+        help = 'Results CSV ("results": id, mediaId, status)',
+        required = False
     )
     parser.add_argument(
         '--downloadDirectory',
-        help = 'Directory to place downloaded media',
+        help = 'Directory of downloaded media',
         required = True
     )
+    parser.add_argument(
+        '--undoLog',
+        help = 'Where to log the renames, to undo them (default ' +
+            'rename-undo-<time>.csv in --downloadDirectory)',
+        required = False
+    )
+    parser.add_argument(
+        '--undo',
+        help = 'Undo the renames in this undo log instead',
+        required = False
+    )
+    parser.add_argument(
+        '--dryRun',
+        help = 'Only check the input and report what would be renamed',
+        action = 'store_true',
+        required = False
+    )
+    parser.add_argument(
+        '--skipProblems',
+        help = 'Rename the rows without problems (missing downloads, ' +
+            'colliding ids), instead of renaming nothing',
+        action = 'store_true',
+        required = False
+    )
+    parser.add_argument(
+        '--parallelism',
+        help = 'Renames in flight (default 1; more helps on network ' +
+            'filesystems where each rename is slow)',
+        type = int,
+        required = False
+    )
+    DownloadStore._add_command_line_args(parser)
 
     args = parser.parse_args()
 
     download_directory = args.downloadDirectory
-    csv_filepath = args.inputCsv
 
-    downloads_iterator = read_from_csv_filepath(csv_filepath)
-    rename(downloads_iterator, download_directory)
+    if args.undo is not None:
+        with open_store(download_directory, args.storeFormat) as store:
+            undone = undo(args.undo, store, parallelism = args.parallelism)
+        print('undid', undone, 'renames')
+        return
+
+    if args.inputCsv is None:
+        parser.error('--inputCsv is required (unless --undo)')
+
+    downloads_iterator = read_from_csv_filepath(args.inputCsv)
+    rename(
+        downloads_iterator, download_directory,
+        store_format = args.storeFormat,
+        undo_log = args.undoLog,
+        dry_run = args.dryRun,
+        skip_problems = args.skipProblems,
+        parallelism = args.parallelism
+    )
 
 
 def read_from_csv_filepath(csv_filepath):
@@ -42,17 +112,202 @@ def read_from_csv_filepath(csv_filepath):
                 status = status
             )
 
-def rename(downloads_iterator, download_directory):
-    for download in downloads_iterator:
-        old_filename = os.path.join(
-            download_directory, download.media_id + '.json'
+def rename(downloads_iterator, download_directory, store_format = STORE_JSON,
+        **kwargs):
+    """Rename each download to its id, returns the RenamePlan
+
+    The download directory is indexed once and every row checked before
+    anything is renamed; with problems, nothing is renamed unless
+    skip_problems. Each wave of renames is logged to undo_log before it
+    runs, and if any rename fails, those already done are undone.
+    """
+    undo_log = kwargs.get('undo_log') or os.path.join(
+        download_directory,
+        time.strftime('rename-undo-%Y%m%d-%H%M%S.csv')
+    )
+
+    with open_store(download_directory, store_format) as store:
+        plan = plan_renames(downloads_iterator, store.keys())
+        renames = sum(len(wave) for wave in plan.waves)
+
+        for problem, rows in sorted(_by_problem(plan.problems).items()):
+            print('PROBLEM', problem + ':', len(rows), 'rows, e.g.', rows[:3])
+        print(
+            renames, 'to rename,', len(plan.problems), 'with problems,',
+            plan.skipped, 'not uploaded'
         )
-        new_filename = os.path.join(
-            download_directory, download.id + '.json'
+
+        if kwargs.get('dry_run'):
+            return plan
+        if plan.problems and not kwargs.get('skip_problems'):
+            raise Exception(
+                str(len(plan.problems)) + ' rows with problems, nothing ' +
+                'renamed (use --skipProblems to rename the rest)'
+            )
+
+        apply_plan(
+            plan, store, undo_log, parallelism = kwargs.get('parallelism')
+        )
+        print('renamed', renames, '(undo log ' + undo_log + ')')
+    return plan
+
+def plan_renames(downloads, keys):
+    """RenamePlan of downloads (ResultsRow) against the store's keys
+
+    problems are (row, problem) pairs: a missing download, an id shared by
+    rows, a mediaId listed twice, or an id already taken by a download that
+    is not itself being renamed. Rows that were never uploaded (no mediaId,
+    or an HTTP error status) are only counted, in skipped.
+    """
+    keys = set(keys)
+    problems = []
+    skipped = 0
+
+    rows = []
+    for row in downloads:
+        if not row.media_id or row.status.isdigit():
+            skipped = skipped + 1
+        elif row.media_id == row.id:
+            continue
+        elif not row.id or '/' in row.id or row.id.endswith(TEMPORARY_SUFFIX):
+            problems.append((row, 'invalid id'))
+        elif row.media_id not in keys:
+            problems.append((row, 'missing download'))
+        else:
+            rows.append(row)
+
+    for field, problem in [
+        ('id', 'duplicate id'), ('media_id', 'duplicate mediaId')
+    ]:
+        counts = Counter(getattr(row, field) for row in rows)
+        problems.extend(
+            (row, problem) for row in rows if counts[getattr(row, field)] > 1
+        )
+        rows = [ row for row in rows if counts[getattr(row, field)] == 1 ]
+
+    # Dropping a row can leave its download in the way of another row
+    while True:
+        sources = set(row.media_id for row in rows)
+        taken = set(
+            row for row in rows if row.id in keys and row.id not in sources
         )
+        if not taken:
+            break
+        problems.extend((row, 'id already taken') for row in taken)
+        rows = [ row for row in rows if row not in taken ]
+
+    return RenamePlan(
+        waves = _waves({ row.media_id: row.id for row in rows }),
+        problems = problems,
+        skipped = skipped
+    )
+
+def _waves(renames):
+    """renames (source: target) in waves, so no target is taken when renamed
+
+    A rename into a name another rename moves away waits for that one; a
+    cycle of renames is broken by moving one of them aside first.
+    """
+    waves = []
+    pending = dict(renames)
+    while pending:
+        wave = [
+            (source, target) for source, target in pending.items()
+            if target not in pending
+        ]
+        if not wave:
+            source, target = next(iter(pending.items()))
+            wave = [ (source, source + TEMPORARY_SUFFIX) ]
+            pending[source + TEMPORARY_SUFFIX] = target
+        for source, _ in wave:
+            del pending[source]
+        waves.append(wave)
+    return waves
+
+def apply_plan(plan, store, undo_log, **kwargs):
+    """Rename plan's waves in store, logging each wave before it starts"""
+    parallelism = int(kwargs.get('parallelism') or 1)
+    done = []
+    with BufferedCsvWriter(undo_log, flush_every = 1000000) as log:
+        for number, wave in enumerate(plan.waves):
+            for source, target in wave:
+                log.writerow([ number, source, target ])
+            log.flush()
+
+            failures = []
+            for source, target, error in _rename_all(store, wave, parallelism):
+                if error is None:
+                    done.append((number, source, target))
+                else:
+                    failures.append((source, target, error))
+
+            if failures:
+                _undo_renames(store, done, parallelism)
+                log.writerow([ UNDONE ])
+                raise Exception(
+                    'renaming failed, ' + str(len(done)) + ' renames undone: ' +
+                    '; '.join(
+                        source + ' -> ' + target + ': ' + error
+                        for source, target, error in failures[:10]
+                    )
+                )
+
+def undo(undo_log, store, **kwargs):
+    """Undo the renames in undo_log that were done, returns how many
+
+    A wave is only logged once the one before it is done, so only the last
+    logged wave can be partly done; within a wave no name is both a source
+    and a target, so its renames done are those whose target exists and
+    source does not.
+    """
+    with open(undo_log, 'r', newline = '') as log_file:
+        logged = list(csv.reader(log_file))
+    if not logged or logged[-1] == [ UNDONE ]:
+        return 0
+
+    logged = [
+        (int(number), source, target) for number, source, target in logged
+    ]
+    last = logged[-1][0]
+    keys = set(store.keys())
+    done = [
+        (number, source, target) for number, source, target in logged
+        if number < last or (target in keys and source not in keys)
+    ]
+    _undo_renames(store, done, kwargs.get('parallelism'))
+    with open(undo_log, 'a', newline = '') as log_file:
+        csv.writer(log_file).writerow([ UNDONE ])
+    return len(done)
+
+def _undo_renames(store, done, parallelism):
+    """Rename (wave, source, target)s back, last wave first"""
+    waves = {}
+    for number, source, target in done:
+        waves.setdefault(number, []).append((target, source))
+    for number in sorted(waves, reverse = True):
+        for target, source, error in _rename_all(store, waves[number], parallelism):
+            if error is not None:
+                print('UNDO FAILED', target, '->', source + ':', error)
+
+def _rename_all(store, renames, parallelism):
+    """(source, target, error or None) of each rename, on parallelism threads"""
+    def rename_one(rename):
+        source, target = rename
+        try:
+            store.rename(source, target)
+            return source, target, None
+        except Exception as error:
+            return source, target, repr(error)
+
+    return parallel_map(
+        rename_one, renames, parallelism = int(parallelism or 1)
+    )
 
-        print('Renaming '  + old_filename + ' to ' + new_filename)
-        os.rename(old_filename, new_filename)
+def _by_problem(problems):
+    by_problem = {}
+    for row, problem in problems:
+        by_problem.setdefault(problem, []).append(row.id + ' <- ' + row.media_id)
+    return by_problem
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,93 @@
+import os
+import pickle
+import tempfile
+
+DEFAULT_REORDER_WINDOW = 10000
+
+class ReorderBuffer:
+    """Puts items that complete out of order back into sequence order
+
+    sequence(item) is each item's position, counting up from start. Items
+    come out as soon as every item before them has, so one slow item holds
+    back only the items after it. At most window of those are held in
+    memory; the rest are pickled to a temporary file (in spill_directory)
+    until their turn comes, so memory stays bounded however long the wait.
+
+    Used as reorder(items), a generator. Sequence numbers that never arrive
+    (e.g. rows handled elsewhere) are skipped once the input is exhausted.
+    """
+    def __init__(self, **kwargs):
+        self.window = int(kwargs.get('window') or DEFAULT_REORDER_WINDOW)
+        self.sequence = kwargs.get('sequence') or (lambda item: item[0])
+        self.next_sequence = int(kwargs.get('start') or 0)
+        self.spill_directory = kwargs.get('spill_directory')
+        self.held = {}
+        self.spilled = {}
+        self.spill_file = None
+        # Most items held or spilled at once, for tuning window
+        self.max_held = 0
+        self.spill_count = 0
+
+    def reorder(self, items):
+        try:
+            for item in items:
+                self._add(item)
+                yield from self._ready()
+
+            while self.held or self.spilled:
+                self.next_sequence = min(
+                    _lowest(self.held), _lowest(self.spilled)
+                )
+                yield from self._ready()
+        finally:
+            self._close_spill_file()
+
+    def _add(self, item):
+        sequence = self.sequence(item)
+        if len(self.held) < self.window or sequence == self.next_sequence:
+            self.held[sequence] = item
+        else:
+            self._spill(sequence, item)
+        self.max_held = max(
+            self.max_held, len(self.held) + len(self.spilled)
+        )
+
+    def _ready(self):
+        while True:
+            sequence = self.next_sequence
+            if sequence in self.held:
+                item = self.held.pop(sequence)
+            elif sequence in self.spilled:
+                item = self._unspill(sequence)
+            else:
+                return
+            self.next_sequence = sequence + 1
+            yield item
+
+    def _spill(self, sequence, item):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(
+                prefix = 'reorder-', dir = self.spill_directory
+            )
+        data = pickle.dumps(item, protocol = pickle.HIGHEST_PROTOCOL)
+        offset = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(data)
+        self.spilled[sequence] = (offset, len(data))
+        self.spill_count = self.spill_count + 1
+
+    def _unspill(self, sequence):
+        offset, length = self.spilled.pop(sequence)
+        self.spill_file.seek(offset)
+        item = pickle.loads(self.spill_file.read(length))
+        if not self.spilled:
+            # Everything spilled has come back: reuse the file from the start
+            self.spill_file.truncate(0)
+        return item
+
+    def _close_spill_file(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+def _lowest(sequences):
+    return min(sequences, default = float('inf'))
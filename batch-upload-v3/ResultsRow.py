@@ -20,9 +20,12 @@ class ResultsRow:
         self.status_http_code = kwargs.get('status_http_code')
 
     @classmethod
-    def read_from_csv_filepath(cls, csv_filepath, headers = False):
+    def read_from_csv_filepath(cls, csv_filepath, headers = False, shard = None):
+        """Results rows, only those in shard (by id) if given"""
         with open(csv_filepath, 'r') as csv_file:
             reader = csv.reader(csv_file, delimiter = ',')
+            if shard is not None:
+                reader = shard.filter(reader, lambda row: row[0])
 
             for row in reader:
                 (id, media_id, blended_status) = row
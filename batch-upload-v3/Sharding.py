@@ -0,0 +1,47 @@
+import hashlib
+from collections import namedtuple
+
+class Shard(namedtuple('Shard', 'index count')):
+    """Shard index (1 to count) of count, for running a batch on count machines
+
+    A row is in the shard that a stable hash of its id picks, so every
+    machine can read the same input, with no coordination, and together
+    they process each row exactly once.
+    """
+    @classmethod
+    def parse(cls, text):
+        """Shard from 'K/N'"""
+        try:
+            index, count = [ int(part) for part in text.split('/') ]
+        except ValueError:
+            index, count = 0, 0
+        if not 1 <= index <= count:
+            raise ValueError('shard must be K/N, with 1 <= K <= N: ' + text)
+        return Shard(index, count)
+
+    def contains(self, id):
+        return shard_number(id, self.count) == self.index
+
+    def filter(self, items, id):
+        """items in this shard, by id(item)"""
+        return (item for item in items if self.contains(id(item)))
+
+    def __str__(self):
+        return str(self.index) + '/' + str(self.count)
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--shard',
+            help = 'K/N: only process the rows in shard K of N (by a hash ' +
+                'of each row id), to split a batch across N machines',
+            type = Shard.parse,
+            required = False
+        )
+
+def shard_number(id, count):
+    """Shard (1 to count) of id; the same on every machine and Python run"""
+    digest = hashlib.blake2b(
+        (id or '').encode('utf-8'), digest_size = 8
+    ).digest()
+    return int.from_bytes(digest, 'big') % count + 1
@@ -0,0 +1,50 @@
+import sqlite3
+import threading
+
+DEFAULT_SYNC_EVERY = 100
+
+class SqliteStore:
+    """Base of the durable (SQLite) records kept across runs
+
+    Opens path in WAL mode and runs the CREATE statements of schema.
+    Subclasses run their statements holding self.lock and call _written()
+    after each write; writes are committed every sync_every writes and on
+    close. synchronous, if given, sets PRAGMA synchronous (e.g. FULL).
+    """
+    def __init__(self, path, schema, **kwargs):
+        self.path = path
+        self.sync_every = int(kwargs.get('sync_every') or DEFAULT_SYNC_EVERY)
+        self.unsynced = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        if kwargs.get('synchronous'):
+            self.connection.execute(
+                'PRAGMA synchronous = ' + kwargs['synchronous']
+            )
+        for statement in schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def _written(self):
+        """Count a write (holding self.lock), committing every sync_every"""
+        self.unsynced = self.unsynced + 1
+        if self.unsynced >= self.sync_every:
+            self.connection.commit()
+            self.unsynced = 0
+
+    def sync(self):
+        with self.lock:
+            self.connection.commit()
+            self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
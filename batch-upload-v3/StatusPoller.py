@@ -0,0 +1,126 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from ResultsRow import STATUS_ACCEPTED, STATUS_SCHEDULED, STATUS_RUNNING
+
+# Media in these states are checked again later
+PENDING_STATUSES = { STATUS_ACCEPTED, STATUS_SCHEDULED, STATUS_RUNNING }
+
+DEFAULT_POLL_INTERVAL = 10.0
+DEFAULT_MAX_POLL_INTERVAL = 300.0
+POLL_BACKOFF = 1.5
+
+# Queued media take longer to change than running media
+POLL_INTERVAL_FACTORS = {
+    STATUS_ACCEPTED: 3.0,
+    STATUS_SCHEDULED: 3.0,
+    STATUS_RUNNING: 1.0
+}
+
+class StatusPoller:
+    """Checks items on a pool of threads until they leave a pending status
+
+    check(item, last_check) returns (status, output). Items whose status is
+    pending are checked again later, the next-check times kept in a heap;
+    the wait grows by POLL_BACKOFF per check and depends on the status.
+    Otherwise output is yielded (in completion order). Once timeout seconds
+    have passed since an item was first checked, its last check is made
+    with last_check True and its output yielded whatever the status.
+
+    Only pending items are held in memory, and input is read as workers
+    free up, so hundreds of thousands of pending items are fine; the rate
+    of checks is left to the caller's client (e.g. --maxRequestsPerSecond).
+    """
+    def __init__(self, check, **kwargs):
+        self.check = check
+        self.parallelism = int(kwargs.get('parallelism') or 1)
+        self.interval = float(kwargs.get('interval') or DEFAULT_POLL_INTERVAL)
+        self.max_interval = float(
+            kwargs.get('max_interval') or DEFAULT_MAX_POLL_INTERVAL
+        )
+        self.timeout = kwargs.get('timeout')
+        self.clock = kwargs.get('clock', time.monotonic)
+        self.sleep = kwargs.get('sleep', time.sleep)
+
+    def poll(self, items):
+        executor = ThreadPoolExecutor(max_workers = self.parallelism)
+        pending = []
+        sequence = itertools.count()
+        in_flight = {}
+        items = iter(items)
+        exhausted = False
+        try:
+            while True:
+                now = self.clock()
+                while len(in_flight) < self.parallelism:
+                    if pending and pending[0][0] <= now:
+                        entry = heapq.heappop(pending)[2]
+                    elif not exhausted:
+                        item = next(items, _DONE)
+                        if item is _DONE:
+                            exhausted = True
+                            continue
+                        entry = _PollEntry(item, now, self.timeout)
+                    else:
+                        break
+
+                    future = executor.submit(
+                        self.check, entry.item, entry.last_check
+                    )
+                    in_flight[future] = entry
+
+                if not in_flight:
+                    if not pending:
+                        return
+                    self.sleep(max(0.0, pending[0][0] - now))
+                    continue
+
+                timeout = None
+                if pending:
+                    timeout = max(0.0, pending[0][0] - now)
+                done, not_done = wait(
+                    in_flight, timeout = timeout, return_when = FIRST_COMPLETED
+                )
+
+                for future in done:
+                    entry = in_flight.pop(future)
+                    status, output = future.result()
+                    if status in PENDING_STATUSES and not entry.last_check:
+                        due = entry.reschedule(status, self.clock(), self)
+                        heapq.heappush(pending, (due, next(sequence), entry))
+                    else:
+                        yield output
+        finally:
+            executor.shutdown(wait = True, cancel_futures = True)
+
+    def next_interval(self, status, checks):
+        interval = self.interval * POLL_INTERVAL_FACTORS.get(status, 1.0)
+        return min(self.max_interval, interval * (POLL_BACKOFF ** (checks - 1)))
+
+class _PollEntry:
+    __slots__ = [ 'item', 'deadline', 'checks', 'status', 'last_check' ]
+
+    def __init__(self, item, now, timeout):
+        self.item = item
+        self.deadline = None if timeout is None else now + float(timeout)
+        self.checks = 0
+        self.status = None
+        self.last_check = self.deadline is not None and self.deadline <= now
+
+    def reschedule(self, status, now, poller):
+        """Record a pending check, returns when to check next"""
+        if status == self.status:
+            self.checks = self.checks + 1
+        else:
+            self.status = status
+            self.checks = 1
+
+        due = now + poller.next_interval(status, self.checks)
+        if self.deadline is not None and due >= self.deadline:
+            due = self.deadline
+            self.last_check = True
+        return due
+
+_DONE = object()
@@ -0,0 +1,140 @@
+import json
+import re
+
+# Incremental scanning of JSON documents that are streamed rather than parsed
+
+_SPACE = re.compile(rb'\s+')
+_STRING_BODY = re.compile(rb'(?:[^"\\]|\\.)*', re.DOTALL)
+_SCALAR = re.compile(rb'[^\s"{}\[\],:]+')
+_NESTED = re.compile(rb'[^"{}\[\]]+')
+
+class JsonKeyScanner:
+    """Finds the value of a top-level key in a JSON object fed in chunks
+
+    Only what is needed to follow the document's structure is kept between
+    chunks (an unfinished key or scalar), and scanning stops as soon as the
+    key's value is found; a string or scalar value is decoded, an object or
+    array value is reported as not found.
+    """
+    def __init__(self, key = 'status'):
+        self.key = key
+        self.reset()
+
+    def reset(self):
+        self.found = False
+        self.value = None
+        self.buffer = b''
+        self.depth = 0
+        self.expect_key = False
+        self.is_key_value = False
+        self.string = None
+        self.capture = False
+
+    def feed(self, chunk):
+        """Scan the next chunk (bytes), returns True once the value is found"""
+        if not self.found:
+            self.buffer = self._scan(self.buffer + chunk)
+        return self.found
+
+    def _scan(self, buffer):
+        position = 0
+        length = len(buffer)
+        while position < length and not self.found:
+            if self.string is not None:
+                end = _STRING_BODY.match(buffer, position).end()
+                if self.capture:
+                    self.string = self.string + buffer[position:end]
+                if end >= length or buffer[end:end + 1] == b'\\':
+                    # Wait for the rest of the string (or escape)
+                    return buffer[end:]
+                self._end_string(self.string)
+                position = end + 1
+                continue
+
+            if self.depth > 1:
+                nested = _NESTED.match(buffer, position)
+                if nested is not None:
+                    position = nested.end()
+                    continue
+
+            character = buffer[position:position + 1]
+            if character == b'"':
+                self.string = b''
+                self.capture = self.depth == 1 and \
+                    (self.expect_key or self.is_key_value)
+                position = position + 1
+            elif character in (b'{', b'['):
+                self.depth = self.depth + 1
+                if self.depth == 1:
+                    self.expect_key = character == b'{'
+                else:
+                    self.is_key_value = False
+                position = position + 1
+            elif character in (b'}', b']'):
+                self.depth = self.depth - 1
+                position = position + 1
+            elif character == b',':
+                if self.depth == 1:
+                    self.expect_key = True
+                    self.is_key_value = False
+                position = position + 1
+            elif character == b':':
+                position = position + 1
+            else:
+                space = _SPACE.match(buffer, position)
+                if space is not None:
+                    position = space.end()
+                    continue
+
+                end = _SCALAR.match(buffer, position).end()
+                if self.depth == 1 and self.is_key_value:
+                    if end >= length:
+                        # The scalar may continue in the next chunk
+                        return buffer[position:]
+                    self._found(buffer[position:end])
+                position = end
+        return b''
+
+    def _end_string(self, string):
+        self.string = None
+        if self.depth != 1:
+            return
+
+        if self.expect_key:
+            self.expect_key = False
+            self.is_key_value = json.loads(b'"' + string + b'"') == self.key
+        elif self.is_key_value:
+            self._found(b'"' + string + b'"')
+
+    def _found(self, raw_value):
+        try:
+            self.value = json.loads(raw_value)
+        except ValueError:
+            self.value = None
+        self.found = True
+        self.buffer = b''
+
+class ScanningWriter:
+    """Binary file wrapper feeding everything written to a JsonKeyScanner"""
+    def __init__(self, file, scanner = None):
+        self.file = file
+        self.scanner = scanner or JsonKeyScanner()
+
+    @property
+    def value(self):
+        return self.scanner.value
+
+    def write(self, chunk):
+        self.scanner.feed(chunk)
+        return self.file.write(chunk)
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, position):
+        return self.file.seek(position)
+
+    def truncate(self):
+        # Only ever truncated to start over (a retried download)
+        self.scanner.reset()
+        return self.file.truncate()
@@ -0,0 +1,147 @@
+import io
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+class UploadProgress(namedtuple(
+    'UploadProgress', 'filename bytes_sent total_bytes elapsed'
+)):
+    @property
+    def bytes_per_second(self):
+        return self.bytes_sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def done(self):
+        return self.bytes_sent >= self.total_bytes
+
+class MultipartEncoder:
+    """A multipart/form-data body that is read, not built, as it is sent
+
+    fields are { name: (filename, value, content_type) } as for requests'
+    files. File values are read a block at a time while the request goes
+    out, so memory use does not depend on their size, and the total length
+    is known up front for Content-Length. progress, if given, is called with
+    an UploadProgress after each block of each file.
+    """
+    def __init__(self, fields, **kwargs):
+        self.boundary = kwargs.get('boundary') or uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + self.boundary
+        progress = kwargs.get('progress')
+
+        self.parts = []
+        for name, (filename, value, content_type) in fields.items():
+            self.parts.append(io.BytesIO(
+                self._part_header(name, filename, content_type)
+            ))
+            if hasattr(value, 'read'):
+                self.parts.append(_FilePart(value, filename, progress))
+            else:
+                if type(value) is str:
+                    value = value.encode('utf-8')
+                self.parts.append(io.BytesIO(value))
+            self.parts.append(io.BytesIO(b'\r\n'))
+        self.parts.append(io.BytesIO(
+            ('--' + self.boundary + '--\r\n').encode('ascii')
+        ))
+
+        # requests reads the length from here for Content-Length
+        self.len = sum(_length(part) for part in self.parts)
+        self.current = 0
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            size = self.len
+
+        chunks = []
+        remaining = size
+        while remaining > 0 and self.current < len(self.parts):
+            chunk = self.parts[self.current].read(remaining)
+            if not chunk:
+                self.current = self.current + 1
+                continue
+            chunks.append(chunk)
+            remaining = remaining - len(chunk)
+        return b''.join(chunks)
+
+    def _part_header(self, name, filename, content_type):
+        disposition = 'form-data; name="' + _quote(name) + '"'
+        if filename is not None:
+            disposition = disposition + '; filename="' + _quote(filename) + '"'
+
+        header = '--' + self.boundary + '\r\n' + \
+            'Content-Disposition: ' + disposition + '\r\n'
+        if content_type is not None:
+            header = header + 'Content-Type: ' + content_type + '\r\n'
+        return (header + '\r\n').encode('utf-8')
+
+class _FilePart:
+    """The rest of an open file, with progress reporting"""
+    def __init__(self, file, filename, progress):
+        self.file = file
+        self.filename = filename
+        self.progress = progress
+        self.len = _remaining_length(file)
+        self.bytes_sent = 0
+        self.started = None
+
+    def read(self, size):
+        if self.started is None:
+            self.started = time.monotonic()
+
+        chunk = self.file.read(min(size, self.len - self.bytes_sent))
+        self.bytes_sent = self.bytes_sent + len(chunk)
+
+        if self.progress is not None and chunk:
+            self.progress(UploadProgress(
+                self.filename,
+                self.bytes_sent,
+                self.len,
+                time.monotonic() - self.started
+            ))
+        return chunk
+
+def _length(part):
+    if isinstance(part, io.BytesIO):
+        return len(part.getbuffer())
+    return part.len
+
+def _remaining_length(file):
+    position = file.tell()
+    try:
+        return os.fstat(file.fileno()).st_size - position
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        end = file.seek(0, os.SEEK_END)
+        file.seek(position)
+        return end - position
+
+def _quote(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def progress_printer(**kwargs):
+    """A progress callback printing each file's rate every interval seconds"""
+    interval = float(kwargs.get('interval') or 5.0)
+    stream = kwargs.get('stream') or sys.stderr
+    last_printed = {}
+    lock = threading.Lock()
+
+    def progress(update):
+        now = time.monotonic()
+        with lock:
+            if not update.done and \
+                    now - last_printed.get(update.filename, 0) < interval:
+                return
+            last_printed[update.filename] = now
+            if update.done:
+                del last_printed[update.filename]
+
+        print(
+            'UPLOAD', update.filename,
+            '%.1f/%.1f MB' % (update.bytes_sent / 1e6, update.total_bytes / 1e6),
+            '%.1f MB/s' % (update.bytes_per_second / 1e6),
+            file = stream
+        )
+
+    return progress
@@ -0,0 +1,216 @@
+import argparse
+import os
+
+from ResultsRow import ResultsRow
+from ParallelDownloader import ParallelDownloader
+from VoiceBaseV3Client import VoiceBaseV3Client
+from MediaListing import list_media, DEFAULT_PAGE_SIZE
+from DownloadStore import DownloadStore, STORE_JSON
+from Instrumentation import MetricsReporter
+
+# Bring a download store up to date with everything in the account: /media
+# is listed page by page and only media missing locally (or, with
+# --downloadIndex, whose status changed) are downloaded, in parallel
+#
+# command line example
+#  python Sync.py --downloadDirectory dl --outputCsv synced.csv --parallelism 16
+#  python Sync.py --downloadDirectory dl --outputCsv synced.csv \
+#    --downloadIndex dl-index.sqlite --status finished --createdAfter 2024-01-01
+
+class Sync:
+    """Downloads the media listed by /media that the store does not have
+
+    A listed media is downloaded if it is not in the store, or, with a
+    download index, if its status differs from the one it was downloaded
+    with. The listing is streamed, so downloads start with the first page.
+    """
+    def __init__(self, **kwargs):
+        self.download_directory = kwargs['download_directory']
+        self.output_csv = kwargs['output_csv']
+        self.statuses = kwargs.get('statuses')
+        self.created_after = kwargs.get('created_after')
+        self.created_before = kwargs.get('created_before')
+        self.page_size = kwargs.get('page_size')
+        self.dry_run = kwargs.get('dry_run', False)
+
+        self.downloader = ParallelDownloader(
+            input_csv = None,
+            download_directory = self.download_directory,
+            output_csv = self.output_csv,
+            token = kwargs['token'],
+            parallelism = kwargs.get('parallelism'),
+            store_format = kwargs.get('store_format') or STORE_JSON,
+            download_index_path = kwargs.get('download_index_path'),
+            # What to download is decided here, from the listing
+            refresh_after = 0,
+            raw = kwargs.get('raw', False),
+            flush_every = kwargs.get('flush_every'),
+            client_kwargs = kwargs.get('client_kwargs', {}),
+            metrics_kwargs = kwargs.get('metrics_kwargs', {})
+        )
+        self.voicebase = self.downloader.voicebase
+
+        self.listed = 0
+        self.up_to_date = 0
+        self.to_download = 0
+
+    def process(self):
+        downloader = self.downloader
+        local = downloader.indexed_downloads if downloader.index is not None \
+            else set(downloader.store.keys())
+        differences = self.differences(self.listing(), local)
+
+        try:
+            if self.dry_run:
+                with downloader.store:
+                    for result in differences:
+                        print(
+                            'DIFF media_id:', result.media_id,
+                            ' status: ', result.status
+                        )
+            else:
+                downloads = downloader.output(downloader.download(differences))
+                with downloader.metrics_reporter, downloader.store:
+                    for download in downloads:
+                        print(
+                            'ROW media_id:', download.media_id,
+                            ' status: ', download.status,
+                            ' filename: ', download.filename
+                        )
+        finally:
+            if downloader.index is not None:
+                downloader.index.close()
+
+        print(
+            self.listed, 'listed,', self.up_to_date, 'up to date,',
+            self.to_download, 'to download'
+        )
+
+    def listing(self):
+        return list_media(
+            self.voicebase,
+            statuses = self.statuses,
+            created_after = self.created_after,
+            created_before = self.created_before,
+            page_size = self.page_size
+        )
+
+    def differences(self, listing, local):
+        """ResultsRow of each listed media to download"""
+        index = self.downloader.index
+        for media in listing:
+            self.listed = self.listed + 1
+            media_id = media['mediaId']
+            status = media.get('status')
+
+            if media_id in local:
+                entry = index.get(media_id) if index is not None else None
+                if index is None or \
+                        (entry is not None and entry.status == status):
+                    self.up_to_date = self.up_to_date + 1
+                    continue
+
+            self.to_download = self.to_download + 1
+            yield ResultsRow(id = media_id, media_id = media_id, status = status)
+
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--downloadDirectory',
+            help = 'Directory of downloaded media, brought up to date',
+            required = True
+        )
+        parser.add_argument(
+            '--outputCsv',
+            help = 'Output CSV ("downloads": mediaId, status, filename) of ' +
+                'the media downloaded',
+            required = True
+        )
+        parser.add_argument(
+            '--token',
+            help = 'Bearer token for /v3 API (defaults to $TOKEN)',
+            default = os.environ.get('TOKEN'),
+            required = False
+        )
+        parser.add_argument(
+            '--parallelism',
+            help = 'Level of parallelism (# concurrent, default 4)',
+            required = False
+        )
+        parser.add_argument(
+            '--status',
+            help = 'Only sync media in this status (can repeat)',
+            action = 'append',
+            required = False
+        )
+        parser.add_argument(
+            '--createdAfter',
+            help = 'Only sync media created on or after this ISO 8601 date',
+            required = False
+        )
+        parser.add_argument(
+            '--createdBefore',
+            help = 'Only sync media created on or before this ISO 8601 date',
+            required = False
+        )
+        parser.add_argument(
+            '--pageSize',
+            help = 'Media per /media page (default ' +
+                str(DEFAULT_PAGE_SIZE) + ')',
+            type = int,
+            required = False
+        )
+        parser.add_argument(
+            '--downloadIndex',
+            help = 'path to the download index (see Downloader); media ' +
+                'whose status changed are downloaded again',
+            required = False
+        )
+        parser.add_argument(
+            '--raw',
+            help = 'Stream each media JSON to the store as is',
+            action = 'store_true',
+            required = False
+        )
+        parser.add_argument(
+            '--dryRun',
+            help = 'Only list the media that would be downloaded',
+            action = 'store_true',
+            required = False
+        )
+        DownloadStore._add_command_line_args(parser)
+        VoiceBaseV3Client._add_command_line_args(parser)
+        MetricsReporter._add_command_line_args(parser)
+
+    @classmethod
+    def _initialize_sync(cls, args):
+        return Sync(
+            download_directory = args.downloadDirectory,
+            output_csv = args.outputCsv,
+            token = args.token,
+            parallelism = args.parallelism,
+            statuses = args.status,
+            created_after = args.createdAfter,
+            created_before = args.createdBefore,
+            page_size = args.pageSize,
+            download_index_path = args.downloadIndex,
+            raw = args.raw,
+            dry_run = args.dryRun,
+            store_format = args.storeFormat,
+            client_kwargs = VoiceBaseV3Client._client_kwargs(args),
+            metrics_kwargs = MetricsReporter._reporter_kwargs(args)
+        )
+
+    @classmethod
+    def main(cls):
+        parser = argparse.ArgumentParser(
+            description = "Sync a download directory with VoiceBase V3 /media"
+        )
+        cls._add_command_line_args(parser)
+        args = parser.parse_args()
+
+        sync = cls._initialize_sync(args)
+        sync.process()
+
+if __name__ == '__main__':
+    Sync.main()
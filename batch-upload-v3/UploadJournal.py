@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+from ResultsRow import STATUS_ACCEPTED, STATUS_FINISHED
+from ResultsRow import STATUS_SCHEDULED, STATUS_RUNNING
+from SqliteStore import SqliteStore
+
+# Rows in these states are not uploaded again on --resume
+COMPLETED_STATUSES = {
+    STATUS_ACCEPTED, STATUS_FINISHED, STATUS_SCHEDULED, STATUS_RUNNING
+}
+
+JournalEntry = namedtuple('JournalEntry', 'row_number id media_id status')
+
+class UploadJournal(SqliteStore):
+    """Durable (SQLite) record of upload results, for resuming a batch
+
+    Entries are keyed by input row number, with the input id alongside,
+    since the same file or URL may legitimately appear twice in an input.
+    Writes are committed (and fsynced) every sync_every records and on
+    close, so a crash costs at most sync_every re-uploads on --resume.
+    """
+    def __init__(self, path, **kwargs):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS uploads (' +
+            'row_number INTEGER PRIMARY KEY, id TEXT NOT NULL, ' +
+            'media_id TEXT, status TEXT)'
+        ], synchronous = 'FULL', **kwargs)
+        self.completed = {}
+
+        if kwargs.get('resume', False):
+            self._load_completed()
+        else:
+            self.connection.execute('DELETE FROM uploads')
+            self.connection.commit()
+
+    def _load_completed(self):
+        entries = self.connection.execute(
+            'SELECT row_number, id, media_id, status FROM uploads'
+        )
+        for entry in map(JournalEntry._make, entries):
+            if entry.status in COMPLETED_STATUSES:
+                self.completed[entry.row_number] = entry
+
+    def resume_row(self):
+        """First row number not completed (every row before it is)"""
+        row_number = 0
+        while row_number in self.completed:
+            row_number = row_number + 1
+        return row_number
+
+    def completed_entry(self, row_number, id):
+        """The completed entry for a row, or None to upload it (again)"""
+        entry = self.completed.get(row_number)
+        if entry is not None and entry.id == id:
+            return entry
+        return None
+
+    def completed_entries(self, stop_row_number):
+        for row_number in range(stop_row_number):
+            yield self.completed[row_number]
+
+    def record(self, row_number, id, media_id, status):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)',
+                (
+                    row_number,
+                    id,
+                    media_id,
+                    None if status is None else str(status)
+                )
+            )
+            self._written()
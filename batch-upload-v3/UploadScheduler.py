@@ -0,0 +1,39 @@
+import os
+
+from ParallelPipeline import parallel_map
+
+SCHEDULE_INPUT = 'input'
+SCHEDULE_LARGEST_FIRST = 'lpt'
+SCHEDULES = [ SCHEDULE_INPUT, SCHEDULE_LARGEST_FIRST ]
+
+def input_size(input):
+    """Bytes to upload for input (0 for URLs, media updates, missing files)"""
+    if not input.is_file:
+        return 0
+    try:
+        return os.stat(input.media_filepath).st_size
+    except OSError:
+        return 0
+
+def largest_first(inputs, **kwargs):
+    """inputs in longest-processing-time-first order, largest files first
+
+    Every input is read and its file stat'ed up front (on parallelism
+    threads). Handed to a pool of workers in this order, the largest files
+    start first and on different workers, and the small ones fill in around
+    them, so no multi-GB file is left to start after everything else is done.
+    Equal sizes keep their input order.
+    """
+    parallelism = int(kwargs.get('parallelism') or 1)
+    sized = parallel_map(
+        lambda input: (input_size(input), input),
+        inputs,
+        parallelism = parallelism,
+        max_in_flight = 64 * parallelism
+    )
+    sized = [
+        (-size, index, input)
+        for index, (size, input) in enumerate(sized)
+    ]
+    sized.sort(key = lambda item: item[:2])
+    return [ input for _, _, input in sized ]
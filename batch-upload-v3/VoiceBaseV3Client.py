@@ -1,36 +1,186 @@
+import os
+import threading
 import requests
 import json
+from requests.adapters import HTTPAdapter
+
+from RateLimiter import RequestThrottle, RETRY_STATUSES
+from RateLimiter import NOT_PROCESSED_STATUSES
+from StreamingMultipart import MultipartEncoder
+from Instrumentation import NULL_METRICS
+from Instrumentation import STAGE_HTTP_REQUEST, STAGE_RESPONSE_PARSE
+
+DEFAULT_API_URL = 'https://apis.voicebase.com/v3'
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 256 * 1024
+STATUS_NOT_MODIFIED = 304
+
+def conditional_headers(**kwargs):
+    """If-None-Match / If-Modified-Since headers for etag / last_modified"""
+    headers = {}
+    if kwargs.get('etag'):
+        headers['If-None-Match'] = kwargs['etag']
+    if kwargs.get('last_modified'):
+        headers['If-Modified-Since'] = kwargs['last_modified']
+    return headers
 
 class VoiceBaseV3Client:
-    """Client for the VoiceBase V3 API"""
+    """Client for the VoiceBase V3 API
 
-    def __init__(self, token):
-        self.url = 'https://apis.voicebase.com/v3'
+    Requests go through pooled, keep-alive requests.Sessions. requests
+    does not promise that a Session is thread-safe, so each thread (in
+    each process) lazily builds its own; a forked or unpickled copy of the
+    client starts with none. The client itself can be handed to worker
+    threads and processes alike.
+
+    Every request passes through a RequestThrottle (rate limit, adaptive
+    concurrency, retries with backoff); pass throttle to share one between
+    clients. Requests are timed and counted in metrics, if given.
+    """
+
+    def __init__(self, token, **kwargs):
+        self.url = (kwargs.get('api_url') or DEFAULT_API_URL).rstrip('/')
         self.default_headers = {
             'Authorization' : 'Bearer ' + token
         }
-        self.media = VoiceBaseV3Client.VoiceBaseMedia(self)
 
-    def get(self, relative_url, **kwargs):
-        url = self._url(relative_url)
+        self.pool_connections = int(
+            kwargs.get('pool_connections') or DEFAULT_POOL_CONNECTIONS
+        )
+        self.pool_maxsize = int(
+            kwargs.get('pool_maxsize') or DEFAULT_POOL_MAXSIZE
+        )
+        self.pool_block = bool(kwargs.get('pool_block', False))
+        self.keep_alive = bool(kwargs.get('keep_alive', True))
+        self.timeout = (
+            float(kwargs.get('connect_timeout') or DEFAULT_CONNECT_TIMEOUT),
+            float(kwargs.get('read_timeout') or DEFAULT_READ_TIMEOUT)
+        )
+
+        if not self.keep_alive:
+            self.default_headers['Connection'] = 'close'
+
+        self.throttle = kwargs.get('throttle') or RequestThrottle(**kwargs)
+        self.metrics = kwargs.get('metrics') or NULL_METRICS
+
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
 
-        response = requests.get(url, **self._prepare_kwargs(kwargs))
+        self.media = VoiceBaseV3Client.VoiceBaseMedia(self)
 
-        return json.loads(response.text)
+    def get(self, relative_url, **kwargs):
+        return self._request('GET', relative_url, **kwargs)
 
     def post(self, relative_url, **kwargs):
-        url = self._url(relative_url)
+        return self._request('POST', relative_url, **kwargs)
 
-        response = requests.post(url, **self._prepare_kwargs(kwargs))
+    def delete(self, relative_url, **kwargs):
+        return self._request('DELETE', relative_url, **kwargs)
 
-        return json.loads(response.text)
+    def get_conditional(self, relative_url, **kwargs):
+        """GET unless unchanged since etag / last_modified (from an earlier GET)
 
-    def delete(self, relative_url, **kwargs):
+        Returns (status code, response headers, entity), the entity None
+        on 304 Not Modified.
+        """
         url = self._url(relative_url)
+        request_kwargs = self._prepare_kwargs({
+            'headers': conditional_headers(**kwargs)
+        })
+
+        def send():
+            with self.metrics.stage(STAGE_HTTP_REQUEST):
+                response = self.session.request('GET', url, **request_kwargs)
+            self.metrics.record_response(response.status_code)
+            self.metrics.add_bytes_received(len(response.content))
+            return response
+
+        response = self.throttle.call(
+            send,
+            retry_exceptions = (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout
+            )
+        )
+        if response.status_code == STATUS_NOT_MODIFIED:
+            return response.status_code, response.headers, None
+
+        with self.metrics.stage(STAGE_RESPONSE_PARSE):
+            entity = json.loads(response.text)
+        return response.status_code, response.headers, entity
+
+    def download(self, relative_url, destination, **kwargs):
+        """GET into a binary file in chunks, returns the HTTP status code
+
+        The body is written as it arrives, without being decoded; a
+        retried request truncates destination back to where it started.
+        The response headers are copied into response_headers, if given.
+        """
+        chunk_size = kwargs.pop('chunk_size', DEFAULT_DOWNLOAD_CHUNK_SIZE)
+        response_headers = kwargs.pop('response_headers', None)
+        url = self._url(relative_url)
+        request_kwargs = self._prepare_kwargs(kwargs)
 
-        response = requests.delete(url, **self._prepare_kwargs(kwargs))
-
-        return json.loads(response.text)
+        def send():
+            with self.metrics.stage(STAGE_HTTP_REQUEST):
+                response = self.session.request(
+                    'GET', url, stream = True, **request_kwargs
+                )
+                with response:
+                    if response.status_code not in RETRY_STATUSES:
+                        for chunk in response.iter_content(chunk_size):
+                            destination.write(chunk)
+                            self.metrics.add_bytes_received(len(chunk))
+            self.metrics.record_response(response.status_code)
+            return response
+
+        response = self.throttle.call(
+            send,
+            retry_exceptions = (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout
+            ),
+            rewind = self._truncater(destination)
+        )
+
+        if response_headers is not None:
+            response_headers.update(response.headers)
+        return response.status_code
+
+    @property
+    def session(self):
+        """The pooled session for the current thread and process"""
+        local = self._local
+        if getattr(local, 'session', None) is None or local.pid != os.getpid():
+            local.session = self._create_session()
+            local.pid = os.getpid()
+            with self._sessions_lock:
+                self._sessions.append(local.session)
+        return local.session
+
+    def close(self):
+        """Close pooled connections (new pools are built on next use)"""
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._local = threading.local()
+
+    def __getstate__(self):
+        state = { **self.__dict__ }
+        for name in [ '_local', '_sessions', '_sessions_lock' ]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
 
 
     class VoiceBaseMedia:
@@ -48,54 +198,15 @@ class VoiceBaseV3Client:
             return VoiceBaseV3Client.VoiceBaseMediaItem(self.client, media_id)
 
         def post(self, **kwargs):
+            """Upload new media; progress is called as the media is sent"""
+            attachments = self.client._new_media_attachments(kwargs)
 
-            def _get_required_kwarg(kwarg_name):
-                return self.client._get_required_kwarg(
-                    kwargs,
-                    kwarg_name,
-                    kwarg_name + ' required in post()'
-                )
-
-            self.client._require_exactly_one_of(
-                kwargs,
-                'exactly one of media_url, media required in post()',
-                'media_url',
-                'media'
+            return self.client.post(
+                '/media',
+                files = attachments,
+                progress = kwargs.get('progress')
             )
 
-            media_url = self.client._get_optional_kwarg(kwargs, 'media_url')
-
-            if media_url is not None:
-                attachments = {
-                    'mediaUrl': (
-                        'url', media_url, 'text/url'
-                    )
-                }
-
-            else:
-                media = _get_required_kwarg('media')
-                filename = _get_required_kwarg('filename')
-                mime_type = _get_required_kwarg('mime_type')
-                attachments = {
-                    'media': (
-                        filename, media, mime_type
-                    )
-                }
-
-            configuration = self.client._get_optional_kwarg(kwargs, 'configuration')
-            if configuration is not None:
-                attachments['configuration'] = (
-                    'configuration.json', configuration, 'application/json'
-                )
-
-            metadata = self.client._get_optional_kwarg(kwargs, 'metadata')
-            if metadata is not None:
-                attachments['metadata'] = (
-                    'metadata.json', metadata, 'application/json'
-                )
-
-            return self.client.post('/media', files = attachments)
-
     class VoiceBaseMediaItem:
         """Media item class for the VoiceBase V3 API Client"""
         def __init__(self, client, media_id):
@@ -107,24 +218,27 @@ class VoiceBaseV3Client:
 
             return self.client.get('/media/' + self.media_id)
 
+        def get_conditional(self, **kwargs):
+            """Get a media item unless unchanged (etag, last_modified)"""
+
+            return self.client.get_conditional(
+                '/media/' + self.media_id, **kwargs
+            )
+
+        def download(self, destination, **kwargs):
+            """Stream a media item's JSON into a binary file"""
+
+            return self.client.download(
+                '/media/' + self.media_id, destination, **kwargs
+            )
+
         def delete(self, mediaId):
             """Get a media item"""
 
             return self.client.delete('/media/' + self.media_id)
 
         def post(self, **kwargs):
-            attachments = {}
-            configuration = self.client._get_optional_kwarg(kwargs, 'configuration')
-            if configuration is not None:
-                attachments['configuration'] = (
-                    'configuration.json', configuration, 'application/json'
-                )
-
-            metadata = self.client._get_optional_kwarg(kwargs, 'metadata')
-            if metadata is not None:
-                attachments['metadata'] = (
-                    'metadata.json', metadata, 'application/json'
-                )
+            attachments = self.client._media_update_attachments(kwargs)
 
             return self.client.post('/media/' + self.media_id, files = attachments)
 
@@ -144,8 +258,165 @@ class VoiceBaseV3Client:
         if len(found_kwargs) != 1:
             raise VoiceBaseV3Client.MalformedRequestException(message_on_error)
 
+    def _request(self, method, relative_url, **kwargs):
+        url = self._url(relative_url)
+
+        progress = kwargs.pop('progress', None)
+        request_kwargs = self._prepare_kwargs(kwargs)
+        files = request_kwargs.pop('files', None)
+
+        def send():
+            attempt_kwargs = request_kwargs
+            if files is not None:
+                # The encoder reads the files as it goes, so one per attempt
+                attempt_kwargs = self._multipart_kwargs(
+                    request_kwargs, files, progress
+                )
+                # Overrides may send the files some other way (files=)
+                if 'data' in attempt_kwargs:
+                    self.metrics.add_bytes_sent(attempt_kwargs['data'].len)
+
+            with self.metrics.stage(STAGE_HTTP_REQUEST):
+                response = self.session.request(method, url, **attempt_kwargs)
+            self.metrics.record_response(response.status_code)
+            self.metrics.add_bytes_received(len(response.content))
+            return response
+
+        response = self.throttle.call(
+            send, rewind = self._rewinder(files), **self._retry_kwargs(method)
+        )
+
+        with self.metrics.stage(STAGE_RESPONSE_PARSE):
+            return json.loads(response.text)
+
+    def _retry_kwargs(self, method):
+        """What throttle.call retries for a request of method
+
+        A POST the server may have processed is not sent again: it could
+        create (and bill) the media twice. Only a failure to connect, 429
+        and 503 are retried for it; read timeouts and other 5xx are not.
+        """
+        if method == 'POST':
+            return {
+                'retry_exceptions': (requests.exceptions.ConnectionError,),
+                'retry_statuses': NOT_PROCESSED_STATUSES
+            }
+        return {
+            'retry_exceptions': (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout
+            )
+        }
+
+    def _multipart_kwargs(self, request_kwargs, files, progress):
+        """Request kwargs sending files as a streamed multipart body"""
+        encoder = MultipartEncoder(files, progress = progress)
+
+        return {
+            **request_kwargs,
+            'data': encoder,
+            'headers': {
+                **request_kwargs['headers'],
+                'Content-Type': encoder.content_type
+            }
+        }
+
+    def _rewinder(self, attachments):
+        """Function seeking attached files back to where they started"""
+        positions = [
+            (value, value.tell())
+            for (filename, value, content_type) in (attachments or {}).values()
+            if hasattr(value, 'seek')
+        ]
+        if len(positions) == 0:
+            return None
+
+        def rewind():
+            for value, position in positions:
+                value.seek(position)
+
+        return rewind
+
+    def _truncater(self, destination):
+        """Function truncating destination back to where it is now"""
+        position = destination.tell()
+
+        def truncate():
+            destination.seek(position)
+            destination.truncate()
+
+        return truncate
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections = self.pool_connections,
+            pool_maxsize = self.pool_maxsize,
+            pool_block = self.pool_block
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _new_media_attachments(self, kwargs_dict):
+        def _get_required_kwarg(kwarg_name):
+            return self._get_required_kwarg(
+                kwargs_dict,
+                kwarg_name,
+                kwarg_name + ' required in post()'
+            )
+
+        self._require_exactly_one_of(
+            kwargs_dict,
+            'exactly one of media_url, media required in post()',
+            'media_url',
+            'media'
+        )
+
+        media_url = self._get_optional_kwarg(kwargs_dict, 'media_url')
+
+        if media_url is not None:
+            attachments = {
+                'mediaUrl': (
+                    'url', media_url, 'text/url'
+                )
+            }
+
+        else:
+            media = _get_required_kwarg('media')
+            filename = _get_required_kwarg('filename')
+            mime_type = _get_required_kwarg('mime_type')
+            attachments = {
+                'media': (
+                    filename, media, mime_type
+                )
+            }
+
+        return {
+            **attachments,
+            **self._media_update_attachments(kwargs_dict)
+        }
+
+    def _media_update_attachments(self, kwargs_dict):
+        attachments = {}
+        configuration = self._get_optional_kwarg(kwargs_dict, 'configuration')
+        if configuration is not None:
+            attachments['configuration'] = (
+                'configuration.json', configuration, 'application/json'
+            )
+
+        metadata = self._get_optional_kwarg(kwargs_dict, 'metadata')
+        if metadata is not None:
+            attachments['metadata'] = (
+                'metadata.json', metadata, 'application/json'
+            )
+
+        return attachments
+
     def _prepare_kwargs(self, kwargs_dict):
         request_kwargs = self._fill_headers({ **kwargs_dict })
+        if 'timeout' not in request_kwargs:
+            request_kwargs['timeout'] = self.timeout
         return request_kwargs
 
     def _fill_headers(self, kwargs_dict):
@@ -162,6 +433,66 @@ class VoiceBaseV3Client:
     def _url(self, relative):
         return self.url + relative
 
+    @classmethod
+    def _add_command_line_args(cls, parser):
+        parser.add_argument(
+            '--apiUrl',
+            help = 'Base URL of the V3 API, e.g. a MockVoiceBaseServer ' +
+                '(default ' + DEFAULT_API_URL + ')',
+            required = False
+        )
+        parser.add_argument(
+            '--poolConnections',
+            help = 'Number of host connection pools to cache (default ' +
+                str(DEFAULT_POOL_CONNECTIONS) + ')',
+            required = False
+        )
+        parser.add_argument(
+            '--poolMaxsize',
+            help = 'Maximum connections kept alive per host (default ' +
+                str(DEFAULT_POOL_MAXSIZE) + ')',
+            required = False
+        )
+        parser.add_argument(
+            '--connectTimeout',
+            help = 'Connect timeout in seconds (default ' +
+                str(DEFAULT_CONNECT_TIMEOUT) + ')',
+            required = False
+        )
+        parser.add_argument(
+            '--readTimeout',
+            help = 'Read timeout in seconds (default ' +
+                str(DEFAULT_READ_TIMEOUT) + ')',
+            required = False
+        )
+        parser.add_argument(
+            '--noKeepAlive',
+            help = 'Open a new connection for every request',
+            action = 'store_true',
+            required = False
+        )
+        RequestThrottle._add_command_line_args(parser)
+
+    @classmethod
+    def _sized_client_kwargs(cls, client_kwargs, pool_maxsize):
+        """Copy of client_kwargs with pool_maxsize filled in unless set"""
+        sized_kwargs = { **(client_kwargs or {}) }
+        if not sized_kwargs.get('pool_maxsize'):
+            sized_kwargs['pool_maxsize'] = pool_maxsize
+        return sized_kwargs
+
+    @classmethod
+    def _client_kwargs(cls, args):
+        return {
+            'pool_connections': args.poolConnections,
+            'pool_maxsize': args.poolMaxsize,
+            'connect_timeout': args.connectTimeout,
+            'read_timeout': args.readTimeout,
+            'api_url': args.apiUrl,
+            'keep_alive': not args.noKeepAlive,
+            **RequestThrottle._throttle_kwargs(args)
+        }
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The batch tools are flat scripts, imported by module name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,75 @@
+import json
+
+from CallbackReplay import CallbackReplay, percentiles
+from DownloadStore import open_store
+from MockVoiceBaseServer import MockVoiceBaseServer
+from ParallelCallbackTester import ParallelCallbackTester
+
+def write_downloads(directory, count):
+    with open_store(str(directory)) as store, \
+            open(directory / 'downloads.csv', 'w') as downloads_file:
+        downloads_file.write('mediaId,status,filename\n')
+        for i in range(count):
+            media_id = 'm' + str(i)
+            store.put(media_id, json.dumps({ 'mediaId': media_id }).encode())
+            status = 'finished' if i % 5 else 'failed'
+            downloads_file.write(media_id + ',' + status + ',' + media_id + '.json\n')
+
+def replay(directory, destination_url, **kwargs):
+    replay = CallbackReplay(
+        input_csv = str(directory / 'downloads.csv'),
+        download_directory = str(directory),
+        output_csv = str(directory / 'replay.csv'),
+        destination_url = destination_url,
+        **kwargs
+    )
+    replay.process()
+    return replay.report()
+
+def test_open_loop_replay_at_a_rate(tmp_path):
+    write_downloads(tmp_path, 10)
+    with MockVoiceBaseServer() as server:
+        report = replay(tmp_path, server.callback_url, rate = 200, requests = 40)
+        assert server.callbacks == 40
+
+    assert report['requests'] == 40
+    assert report['outcomes'] == { '200': 40 }
+    # 40 requests due over 0.195s
+    assert report['seconds'] >= 0.19
+    assert set(report['latency']) == { 'p50', 'p90', 'p99', 'p99.9', 'max' }
+
+def test_closed_loop_replay_counts_error_codes(tmp_path):
+    write_downloads(tmp_path, 10)
+    with MockVoiceBaseServer() as server:
+        report = replay(tmp_path, server.url + '/nowhere', concurrency = 4)
+
+    # Only the 8 finished media are replayed
+    assert report['outcomes'] == { '404': 8 }
+    with open(tmp_path / 'replay.csv') as replay_file:
+        assert len(replay_file.readlines()) == 9
+
+def test_connection_errors_are_counted(tmp_path):
+    write_downloads(tmp_path, 5)
+    report = replay(tmp_path, 'http://127.0.0.1:1/callback', concurrency = 2)
+    assert report['outcomes'] == { 'ClientConnectorError': 4 }
+
+def test_parallel_callback_tester_sends_downloads_as_is(tmp_path):
+    write_downloads(tmp_path, 20)
+    with MockVoiceBaseServer() as server:
+        tester = ParallelCallbackTester(
+            input_csv = str(tmp_path / 'downloads.csv'),
+            download_directory = str(tmp_path),
+            output_csv = str(tmp_path / 'callbacks.csv'),
+            destination_url = server.callback_url,
+            parallelism = 4
+        )
+        tests = list(tester.output(tester.test(tester.input())))
+        assert server.callbacks == 16
+
+    assert sorted(test.status for test in tests).count('skipped') == 4
+
+def test_percentiles():
+    summary = percentiles([ i / 1000 for i in range(1, 1001) ])
+    assert summary['p50'] == 501
+    assert summary['p99.9'] == 1000
+    assert summary['max'] == 1000
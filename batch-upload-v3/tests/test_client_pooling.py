@@ -0,0 +1,117 @@
+import pytest
+
+from BatchUpload import BatchUpload
+from Downloader import Downloader
+from MockVoiceBaseServer import MockVoiceBaseServer
+from ParallelDownloader import ParallelDownloader
+from VoiceBaseV3Client import VoiceBaseV3Client
+
+# What VoiceBaseV3Client._client_kwargs builds when no pool flags are given
+CLI_CLIENT_KWARGS = {
+    'pool_connections': None,
+    'pool_maxsize': None,
+    'connect_timeout': None,
+    'read_timeout': None,
+    'api_url': None,
+    'keep_alive': True
+}
+
+def downloader_kwargs(**kwargs):
+    return {
+        'input_csv': 'results.csv',
+        'download_directory': '.',
+        'output_csv': 'downloads.csv',
+        'token': 'test',
+        'client_kwargs': CLI_CLIENT_KWARGS,
+        **kwargs
+    }
+
+def test_sized_client_kwargs_only_fills_unset_pool_size():
+    assert VoiceBaseV3Client._sized_client_kwargs(
+        CLI_CLIENT_KWARGS, 40
+    )['pool_maxsize'] == 40
+    assert VoiceBaseV3Client._sized_client_kwargs(
+        { 'pool_maxsize': 7 }, 40
+    )['pool_maxsize'] == 7
+
+def test_parallel_downloader_pool_matches_parallelism():
+    downloader = ParallelDownloader(**downloader_kwargs(parallelism = 12))
+
+    assert downloader.voicebase.pool_maxsize == 12
+
+def test_asyncio_pool_matches_concurrency():
+    pytest.importorskip('aiohttp')
+
+    downloader = Downloader(**downloader_kwargs(
+        use_asyncio = True, concurrency = 100
+    ))
+    parallel_downloader = ParallelDownloader(**downloader_kwargs(
+        use_asyncio = True, concurrency = 100
+    ))
+    batch_upload = BatchUpload(
+        token = 'test',
+        use_asyncio = True,
+        client_kwargs = CLI_CLIENT_KWARGS
+    )
+
+    assert downloader.async_voicebase.pool_maxsize == 100
+    assert parallel_downloader.async_voicebase.pool_maxsize == 100
+    assert batch_upload.async_voicebase.pool_maxsize == 100
+
+def test_async_client_against_mock_server():
+    pytest.importorskip('aiohttp')
+    import asyncio
+    from AsyncVoiceBaseV3Client import AsyncVoiceBaseV3Client
+
+    async def round_trip(url):
+        async with AsyncVoiceBaseV3Client('test') as client:
+            client.url = url
+            created = await client.media.post(
+                media_url = 'https://example.com/a.mp3'
+            )
+            return await client.media[created['mediaId']].get()
+
+    with MockVoiceBaseServer() as server:
+        media = asyncio.run(round_trip(server.url))
+
+    assert media['status'] == 'accepted'
+
+def test_each_thread_gets_its_own_session():
+    import threading
+
+    client = VoiceBaseV3Client('test')
+    sessions = []
+
+    def grab_session():
+        sessions.append(client.session)
+        sessions.append(client.session)
+
+    threads = [ threading.Thread(target = grab_session) for _ in range(3) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, sessions))) == 3
+    client.close()
+
+def test_pickled_client_builds_a_new_session():
+    import pickle
+
+    client = VoiceBaseV3Client('test', pool_maxsize = 3)
+    session = client.session
+
+    copy = pickle.loads(pickle.dumps(client))
+
+    assert copy.pool_maxsize == 3
+    assert copy.session is not session
+    assert copy.media.client is copy
+
+def test_pooled_client_against_mock_server():
+    with MockVoiceBaseServer() as server:
+        client = VoiceBaseV3Client('test')
+        client.url = server.url
+        created = client.media.post(media_url = 'https://example.com/a.mp3')
+
+        assert client.media[created['mediaId']].get()['status'] == 'accepted'
+        client.close()
@@ -0,0 +1,70 @@
+import json
+
+from BatchUploadInput import BatchUploadListReader
+from Instrumentation import Metrics
+
+def write_csv(path, rows):
+    path.write_text(
+        'mediaUrl,term\n' +
+        ''.join('http://a/' + str(i) + '.wav,' + term + '\n'
+            for i, term in enumerate(rows))
+    )
+
+def test_configurations_are_cached_per_vocabulary(tmp_path):
+    write_csv(tmp_path / 'rows.csv', [ 'a', 'b', 'a', '', 'a' ])
+    reader = BatchUploadListReader(
+        media_url_column = 'mediaUrl',
+        default_configuration = json.dumps({
+            'vocabularies': [ { 'terms': [ { 'term': 'base' } ] } ]
+        }),
+        custom_vocab_columns = [ 'term' ]
+    )
+
+    configurations = [
+        json.loads(upload_input.configuration)
+        for upload_input in reader.CsvNewUploads(str(tmp_path / 'rows.csv'))
+    ]
+
+    assert [
+        configuration['vocabularies'][1]['terms']
+        for configuration in configurations
+    ] == [
+        [ { 'term': 'a', 'weight': 2 } ],
+        [ { 'term': 'b', 'weight': 2 } ],
+        [ { 'term': 'a', 'weight': 2 } ],
+        [],
+        [ { 'term': 'a', 'weight': 2 } ]
+    ]
+    assert all(
+        len(configuration['vocabularies']) == 2
+        for configuration in configurations
+    )
+    cache_info = reader.configuration_cache_info()
+    assert (cache_info.hits, cache_info.misses) == (2, 3)
+
+def test_dict_default_is_not_mutated(tmp_path):
+    write_csv(tmp_path / 'rows.csv', [ 'a', 'b' ])
+    default_configuration = { 'vocabularies': [] }
+    reader = BatchUploadListReader(
+        media_url_column = 'mediaUrl',
+        default_configuration = default_configuration,
+        custom_vocab_columns = [ 'term' ],
+        configuration_cache_size = 1
+    )
+
+    configurations = [
+        json.loads(upload_input.configuration)
+        for upload_input in reader.CsvNewUploads(str(tmp_path / 'rows.csv'))
+    ]
+
+    assert default_configuration == { 'vocabularies': [] }
+    assert [ len(c['vocabularies']) for c in configurations ] == [ 1, 1 ]
+    assert reader.configuration_cache_info().maxsize == 1
+
+def test_metrics_counters():
+    metrics = Metrics()
+    metrics.count('configuration_cache_hits', 3)
+
+    assert metrics.snapshot()['counters'] == { 'configuration_cache_hits': 3 }
+    assert 'voicebase_batch_configuration_cache_hits_total 3\n' in \
+        metrics.to_prometheus()
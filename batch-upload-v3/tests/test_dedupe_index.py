@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+from BatchUpload import BatchUpload
+from DedupeIndex import DedupeIndex, DEDUPE_METADATA
+from DedupeIndex import content_hash, normalize_url
+from MockVoiceBaseServer import MockVoiceBaseServer
+
+def test_content_hash(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    (tmp_path / 'a.wav').write_bytes(data)
+
+    assert content_hash(str(tmp_path / 'a.wav'), chunk_size = 1000) == \
+        hashlib.sha256(data).hexdigest()
+
+def test_normalize_url():
+    assert normalize_url('HTTPS://Example.COM:443/a.mp3#t=1') == \
+        'https://example.com/a.mp3'
+    assert normalize_url('http://example.com:8080') == 'http://example.com:8080/'
+    assert normalize_url('http://u:p@example.com/a?x=1') == \
+        'http://u:p@example.com/a?x=1'
+
+def test_index_persists_and_rehashes_changed_files(tmp_path):
+    path = str(tmp_path / 'index.db')
+    media = tmp_path / 'a.wav'
+    media.write_bytes(b'one')
+
+    with DedupeIndex(path) as index:
+        key = index.file_key(str(media))
+        assert index.claim(key) is None
+        index.release(key, 'm1', 'accepted')
+
+    with DedupeIndex(path) as index:
+        assert index.claim(index.file_key(str(media))) == ('m1', 'accepted')
+        media.write_bytes(b'two')
+        os.utime(media, ns = (1, 1))
+        assert index.file_key(str(media)) != key
+
+def test_claim_waits_for_an_upload_in_flight(tmp_path):
+    with DedupeIndex(str(tmp_path / 'index.db')) as index:
+        assert index.claim('url:a') is None
+        claimed = []
+        waiter = threading.Thread(
+            target = lambda: claimed.append(index.claim('url:a'))
+        )
+        waiter.start()
+        time.sleep(0.05)
+        assert claimed == []
+
+        index.release('url:a', 'm1', 'accepted')
+        waiter.join()
+
+        assert claimed == [ ('m1', 'accepted') ]
+
+def test_failed_upload_lets_the_next_claim_upload(tmp_path):
+    with DedupeIndex(str(tmp_path / 'index.db')) as index:
+        assert index.claim('url:a') is None
+        index.release('url:a')
+
+        assert index.claim('url:a') is None
+
+def upload(server, tmp_path, **kwargs):
+    batch_upload = BatchUpload(
+        token = 'test',
+        media_directory = str(tmp_path),
+        parallelism = 4,
+        client_kwargs = { 'api_url': server.url }
+    )
+    batch_upload.process(
+        input_media_filename_list = str(tmp_path / 'media.txt'),
+        results_path = str(tmp_path / 'results.csv'),
+        dedupe_index_path = str(tmp_path / 'index.db'),
+        **kwargs
+    )
+    with open(tmp_path / 'results.csv') as results_file:
+        return [ row.split(',') for row in results_file.read().splitlines() ]
+
+def test_batch_upload_skips_duplicates_across_runs(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(b'x' * 1000)
+    (tmp_path / 'b.wav').write_bytes(b'x' * 1000)
+    (tmp_path / 'c.wav').write_bytes(b'y' * 1000)
+    (tmp_path / 'media.txt').write_text('a.wav\na.wav\nb.wav\nc.wav\n')
+
+    with MockVoiceBaseServer() as server:
+        first = upload(server, tmp_path)
+        uploaded = len(server.media)
+        second = upload(server, tmp_path, dedupe_mode = DEDUPE_METADATA)
+        posts = server.stats[200]
+
+    assert uploaded == 2
+    assert len(server.media) == 2
+    assert first[0][1] == first[1][1] == first[2][1] != first[3][1]
+    assert [ row[1] for row in second ] == [ row[1] for row in first ]
+    # 2 uploads, then 4 metadata updates
+    assert posts == 6
+
+def test_async_claim_waits_on_the_loop(tmp_path):
+    async def claims(index):
+        assert await index.claim_async('url:a') is None
+        waiting = [
+            asyncio.ensure_future(index.claim_async('url:a'))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        assert not any(claim.done() for claim in waiting)
+
+        # Released from another thread, as an upload on the executor would
+        await asyncio.to_thread(index.release, 'url:a', 'm1', 'accepted')
+        return await asyncio.gather(*waiting)
+
+    with DedupeIndex(str(tmp_path / 'index.db')) as index:
+        assert asyncio.run(claims(index)) == [ ('m1', 'accepted') ] * 3
+
+def test_async_batch_upload_of_many_duplicate_files(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(b'x' * 100000)
+    (tmp_path / 'media.txt').write_text('a.wav\n' * 80)
+
+    with MockVoiceBaseServer() as server:
+        batch_upload = BatchUpload(
+            token = 'test',
+            media_directory = str(tmp_path),
+            use_asyncio = True,
+            concurrency = 100,
+            client_kwargs = { 'api_url': server.url }
+        )
+        batch_upload.process(
+            input_media_filename_list = str(tmp_path / 'media.txt'),
+            results_path = str(tmp_path / 'results.csv'),
+            dedupe_index_path = str(tmp_path / 'index.db')
+        )
+
+    assert len(server.media) == 1
+    with open(tmp_path / 'results.csv') as results_file:
+        media_ids = { row.split(',')[1] for row in results_file }
+    assert media_ids == set(server.media)
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from DownloadIndex import DownloadIndex, DownloadIndexEntry, is_fresh
+from MockVoiceBaseServer import MockVoiceBaseServer
+from ParallelDownloader import ParallelDownloader
+
+from test_parallel_downloader import write_results_csv
+
+def test_only_terminal_entries_are_fresh():
+    entry = DownloadIndexEntry('m', 'finished', 1000.0, 10, None, None)
+    assert is_fresh(entry)
+    assert is_fresh(entry, max_age = 60, now = 1059.0)
+    assert not is_fresh(entry, max_age = 60, now = 1061.0)
+    assert not is_fresh(entry._replace(status = 'running'))
+    assert not is_fresh(None)
+
+def test_index_round_trip(tmp_path):
+    with DownloadIndex(str(tmp_path / 'index.sqlite')) as index:
+        index.record('m', 'running', 10, etag = '"a"')
+    with DownloadIndex(str(tmp_path / 'index.sqlite')) as index:
+        entry = index.get('m')
+        assert (entry.status, entry.size, entry.etag) == ('running', 10, '"a"')
+        assert index.get('other') is None
+
+def run_incremental(server, directory, **kwargs):
+    downloader = ParallelDownloader(
+        input_csv = str(directory / 'results.csv'),
+        download_directory = str(directory),
+        output_csv = str(directory / 'downloads.csv'),
+        token = 'test',
+        download_index_path = str(directory / 'index.sqlite'),
+        **kwargs
+    )
+    downloader.voicebase.url = server.url
+    with downloader.index:
+        downloads = downloader.output(downloader.download(downloader.input()))
+        return { download.media_id: download.status for download in downloads }
+
+@pytest.mark.parametrize('raw', [ False, True ])
+def test_second_run_skips_terminal_and_unchanged_media(tmp_path, raw):
+    with MockVoiceBaseServer() as server:
+        media_ids = write_results_csv(server, tmp_path / 'results.csv', 10)
+        for media_id in media_ids[:6]:
+            server.media[media_id]['status'] = 'finished'
+
+        first = run_incremental(server, tmp_path, raw = raw, parallelism = 4)
+        assert server.stats[200] == 10
+
+        # 6 finished: no request; 4 accepted: asked, and unchanged (304)
+        second = run_incremental(server, tmp_path, raw = raw, parallelism = 4)
+        assert second == first
+        assert server.stats[200] == 10
+        assert server.stats[304] == 4
+
+        # A media that changed, and a download deleted, are downloaded again
+        server.media[media_ids[9]]['status'] = 'finished'
+        os.remove(tmp_path / (media_ids[0] + '.json'))
+        third = run_incremental(server, tmp_path, raw = raw, parallelism = 4)
+        assert third[media_ids[9]] == 'finished'
+        assert server.stats[200] == 12
+        assert (tmp_path / (media_ids[0] + '.json')).exists()
+
+        # With refresh_after, finished media are checked again
+        run_incremental(server, tmp_path, raw = raw, refresh_after = 1e-9)
+        assert server.stats[304] == 4 + 3 + 10
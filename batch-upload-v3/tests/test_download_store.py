@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+from CallbackTester import CallbackTester
+from DownloadStore import open_store, STORE_FORMATS, STORE_ZSTD, zstandard
+from DownloadStore import SegmentStore
+from MockVoiceBaseServer import MockVoiceBaseServer
+import RenameDownloads
+
+from test_parallel_downloader import write_results_csv
+from test_parallel_downloader import run_downloader as run_parallel_downloader
+
+FORMATS = [
+    format for format in STORE_FORMATS
+    if format != STORE_ZSTD or zstandard is not None
+]
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_put_get_scan_rename(tmp_path, format):
+    with open_store(str(tmp_path), format) as store:
+        for i in range(20):
+            store.put('media-' + str(i), b'{"i": ' + str(i).encode() + b'}')
+        store.put('media-3', b'{"i": "replaced"}')
+        store.rename('media-4', 'row-4')
+
+        assert json.loads(store.get('media-3')) == { 'i': 'replaced' }
+        assert json.loads(store.get('row-4')) == { 'i': 4 }
+        scanned = dict(store.scan())
+
+    assert len(scanned) == 20
+    assert 'media-4' not in scanned
+    assert json.loads(scanned['media-7']) == { 'i': 7 }
+
+    with open_store(str(tmp_path), format) as store:
+        assert json.loads(store.get('media-19')) == { 'i': 19 }
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_failed_rename_keeps_the_target(tmp_path, format):
+    with open_store(str(tmp_path), format) as store:
+        store.put('a', b'{}')
+        store.put('b', b'{"b": 1}')
+        with pytest.raises((KeyError, OSError)):
+            store.rename('missing', 'b')
+
+    with open_store(str(tmp_path), format) as store:
+        assert sorted(store.keys()) == [ 'a', 'b' ]
+        assert json.loads(store.get('b')) == { 'b': 1 }
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_put_file(tmp_path, format):
+    with open_store(str(tmp_path), format) as store:
+        part_filepath = store.part_filepath('media')
+        with open(part_filepath, 'wb') as part_file:
+            part_file.write(b'{"status": "finished"}')
+        store.put_file('media', part_filepath)
+
+        assert json.loads(store.get('media')) == { 'status': 'finished' }
+    assert not (tmp_path / 'media.json.part').exists()
+
+def test_segments_roll_over(tmp_path):
+    with SegmentStore(str(tmp_path), max_segment_bytes = 200) as store:
+        for i in range(10):
+            store.put(str(i), os.urandom(150))
+        assert store.filename('9') != store.filename('0')
+        assert [ key for key, _ in store.scan() ] == [ str(i) for i in range(10) ]
+
+def run_downloader(server, directory, **kwargs):
+    store = open_store(str(directory), kwargs['store_format'])
+    try:
+        return run_parallel_downloader(server, directory, store = store, **kwargs)
+    finally:
+        store.close()
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_download_rename_and_replay_from_store(tmp_path, format):
+    with MockVoiceBaseServer() as server:
+        media_ids = write_results_csv(server, tmp_path / 'results.csv', 10)
+        downloads = run_downloader(
+            server, tmp_path, parallelism = 4, store_format = format, raw = True
+        )
+        run_downloader(server, tmp_path, store_format = format)
+
+    assert sorted(download.media_id for download in downloads) == sorted(media_ids)
+
+    tester = CallbackTester(
+        input_csv = str(tmp_path / 'downloads.csv'),
+        download_directory = str(tmp_path),
+        output_csv = str(tmp_path / 'callbacks.csv'),
+        destination_url = 'http://localhost:1/',
+        store_format = format
+    )
+    with tester.store:
+        assert json.loads(tester._read_callback_body(media_ids[0]))['mediaId'] == \
+            media_ids[0]
+
+    RenameDownloads.rename(
+        RenameDownloads.read_from_csv_filepath(str(tmp_path / 'results.csv')),
+        str(tmp_path),
+        store_format = format
+    )
+    with open_store(str(tmp_path), format) as store:
+        assert json.loads(store.get('0'))['mediaId'] == media_ids[0]
@@ -0,0 +1,88 @@
+import csv
+import json
+
+import pytest
+
+from DownloadStore import open_store
+from Extract import Extract, extract_fields
+
+DOCUMENT = {
+    'mediaId': 'm1',
+    'status': 'finished',
+    'length': { 'milliseconds': 4200 },
+    'metadata': { 'externalId': 'x-1' },
+    'transcript': {
+        'words': [
+            { 'p': 0, 'w': 'Speaker 1', 'm': 'turn' },
+            { 'p': 1, 's': 0, 'e': 300, 'w': 'Hello' },
+            { 'p': 2, 's': 300, 'e': 300, 'w': ',', 'm': 'punc' },
+            { 'p': 3, 's': 400, 'e': 900, 'w': 'world' },
+            { 'p': 4, 's': 900, 'e': 900, 'w': '.', 'm': 'punc' }
+        ]
+    },
+    'knowledge': {
+        'keywords': [ { 'keyword': 'greeting' }, { 'keyword': 'world' } ],
+        'topics': [ { 'topicName': 'Small talk' } ]
+    }
+}
+
+def test_extract_fields():
+    values = extract_fields(
+        json.dumps(DOCUMENT).encode(),
+        [ 'mediaId', 'durationMs', 'wordCount', 'keywords', 'topics',
+            'transcript', 'metadata.externalId', 'metadata.missing' ]
+    )
+    assert values == [
+        'm1', 4200, 2, [ 'greeting', 'world' ], [ 'Small talk' ],
+        'Hello, world.', 'x-1', None
+    ]
+
+def test_duration_falls_back_to_the_last_word():
+    document = { **DOCUMENT, 'length': None }
+    assert extract_fields(json.dumps(document), [ 'durationMs' ]) == [ 900 ]
+
+def write_documents(directory, format, count):
+    with open_store(str(directory), format) as store:
+        for i in range(count):
+            document = { **DOCUMENT, 'mediaId': 'm' + str(i) }
+            store.put('m' + str(i), json.dumps(document).encode())
+        store.put('broken', b'{"mediaId": ')
+
+@pytest.mark.parametrize('parallelism', [ 1, 3 ])
+def test_extract_csv_in_input_order(tmp_path, parallelism):
+    write_documents(tmp_path, 'segment', 50)
+    extract = Extract(
+        download_directory = str(tmp_path),
+        output = str(tmp_path / 'out.csv'),
+        store_format = 'segment',
+        fields = [ 'mediaId', 'keywords', 'transcript' ],
+        parallelism = parallelism,
+        chunk_size = 4
+    )
+    extract.process()
+
+    with open(tmp_path / 'out.csv', newline = '') as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert rows[0] == [ 'mediaId', 'keywords', 'transcript' ]
+    assert [ row[0] for row in rows[1:] ] == [ 'm' + str(i) for i in range(50) ]
+    assert rows[1][1:] == [ 'greeting;world', 'Hello, world.' ]
+    assert extract.documents == 50
+    assert extract.errors == 1
+
+def test_extract_jsonl_from_downloads_csv(tmp_path):
+    write_documents(tmp_path, 'json', 5)
+    with open(tmp_path / 'downloads.csv', 'w') as downloads_file:
+        downloads_file.write('mediaId,status,filename\nm3,finished,m3.json\n')
+
+    Extract(
+        download_directory = str(tmp_path),
+        output = str(tmp_path / 'out.jsonl'),
+        input_csv = str(tmp_path / 'downloads.csv'),
+        fields = [ 'mediaId', 'topics' ],
+        format = 'jsonl',
+        parallelism = 2
+    ).process()
+
+    with open(tmp_path / 'out.jsonl') as jsonl_file:
+        lines = [ json.loads(line) for line in jsonl_file ]
+    assert lines == [ { 'mediaId': 'm3', 'topics': [ 'Small talk' ] } ]
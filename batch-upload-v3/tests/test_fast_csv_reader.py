@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from BatchUpload import BatchUpload
+from BatchUploadInput import BatchUploadListReader
+from MockVoiceBaseServer import MockVoiceBaseServer
+
+FIELDS = [
+    'id', 'is_url', 'is_file', 'is_media_update', 'media_url', 'media_id',
+    'media_filename', 'media_filepath', 'mime_type', 'configuration', 'metadata'
+]
+
+def readers(**kwargs):
+    return [
+        BatchUploadListReader(fast = fast, **kwargs)
+        for fast in [ False, True ]
+    ]
+
+def inputs(reader, method, path, start_row = 0):
+    return [
+        { field: getattr(upload_input, field, None) for field in FIELDS }
+        for upload_input in getattr(reader, method)(str(path), start_row)
+    ]
+
+@pytest.mark.parametrize('header, column', [
+    ('mediaUrl', 'media_url_column'),
+    ('media', 'media_filename_column')
+])
+def test_new_uploads_match_the_dict_reader(tmp_path, header, column):
+    path = tmp_path / 'rows.csv'
+    path.write_text(
+        header + ',term,team\n' +
+        'a.wav,x,"one, two"\n' +
+        '\n' +
+        'b.wav,,\x1fthree\n' +
+        'c.wav,x\n'
+    )
+    dict_reader, fast_reader = readers(
+        media_directory = str(tmp_path),
+        default_metadata = { 'extended': { 'source': 'batch' } },
+        default_configuration = json.dumps({ 'language': 'en-US' }),
+        custom_vocab_columns = [ 'term', 'missing' ],
+        **{ column: header }
+    )
+
+    expected = inputs(dict_reader, 'CsvNewUploads', path)
+
+    assert len(expected) == 3
+    assert inputs(fast_reader, 'CsvNewUploads', path) == expected
+    assert inputs(fast_reader, 'CsvNewUploads', path, 2) == expected[2:]
+
+def test_media_updates_match_the_dict_reader(tmp_path):
+    path = tmp_path / 'rows.csv'
+    path.write_text('mediaId,team\nm1,a\nm2,b\n')
+    only_ids = tmp_path / 'ids.csv'
+    only_ids.write_text('mediaId\nm1\n')
+    dict_reader, fast_reader = readers(default_configuration = '{}')
+
+    for csv_path in [ path, only_ids ]:
+        assert inputs(fast_reader, 'CsvMediaUpdates', csv_path) == \
+            inputs(dict_reader, 'CsvMediaUpdates', csv_path)
+
+def test_records_need_an_id(tmp_path):
+    path = tmp_path / 'rows.csv'
+    path.write_text('mediaUrl,team\n,a\n')
+    fast_reader = BatchUploadListReader(fast = True)
+
+    with pytest.raises(Exception):
+        list(fast_reader.CsvNewUploads(str(path)))
+
+def test_batch_upload_with_the_fast_reader(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(b'x' * 100)
+    (tmp_path / 'rows.csv').write_text('media,team\na.wav,x\na.wav,y\n')
+
+    with MockVoiceBaseServer() as server:
+        batch_upload = BatchUpload(
+            token = 'test',
+            media_directory = str(tmp_path),
+            fast_csv_reader = True,
+            client_kwargs = { 'api_url': server.url }
+        )
+        batch_upload.process(
+            input_csv = str(tmp_path / 'rows.csv'),
+            results_path = str(tmp_path / 'results.csv')
+        )
+
+    with open(tmp_path / 'results.csv') as results_file:
+        rows = results_file.read().splitlines()
+
+    assert len(rows) == 2
+    assert all(row.startswith('a.wav,') for row in rows)
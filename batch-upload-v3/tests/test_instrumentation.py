@@ -0,0 +1,106 @@
+import json
+import time
+
+import pytest
+
+from BatchUpload import BatchUpload
+from Instrumentation import Histogram, Metrics, MetricsReporter, NULL_METRICS
+from Instrumentation import FORMAT_PROMETHEUS
+from MockVoiceBaseServer import MockVoiceBaseServer
+
+def test_histogram_percentiles_are_close():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.observe(i / 1000)
+
+    assert histogram.count == 1000
+    assert histogram.percentile(0.5) == pytest.approx(0.5, rel = 0.2)
+    assert histogram.percentile(0.99) == pytest.approx(0.99, rel = 0.2)
+    assert histogram.percentile(1.0) == 1.0
+    assert Histogram().percentile(0.5) == 0.0
+
+def test_stage_tracks_in_flight_and_errors():
+    metrics = Metrics()
+    with metrics.stage('a'):
+        with metrics.stage('a'):
+            assert metrics.in_flight['a'] == 2
+    with pytest.raises(ValueError):
+        with metrics.stage('b'):
+            raise ValueError()
+
+    snapshot = metrics.snapshot()
+
+    assert snapshot['stages']['a']['count'] == 2
+    assert snapshot['stages']['a']['max_in_flight'] == 2
+    assert snapshot['stages']['a']['in_flight'] == 0
+    assert snapshot['errors'] == { 'ValueError': 1 }
+
+def test_timed_iterates_and_times_each_step():
+    metrics = Metrics()
+
+    assert list(metrics.timed('read', iter([ 1, 2, 3 ]))) == [ 1, 2, 3 ]
+    assert metrics.snapshot()['stages']['read']['count'] == 4
+
+def test_null_metrics_pass_through():
+    with NULL_METRICS.stage('a'):
+        pass
+    assert list(NULL_METRICS.timed('a', [ 1 ])) == [ 1 ]
+
+def test_prometheus_text():
+    metrics = Metrics()
+    with metrics.stage('http_request'):
+        pass
+    metrics.record_response(200)
+    metrics.record_response(429)
+    metrics.add_bytes_sent(10)
+
+    text = metrics.to_prometheus()
+
+    assert 'voicebase_batch_stage_seconds_count{stage="http_request"} 1\n' in text
+    assert 'voicebase_batch_stage_seconds_bucket{stage="http_request",le="+Inf"} 1\n' in text
+    assert 'voicebase_batch_responses_total{code="429"} 1\n' in text
+    assert 'voicebase_batch_errors_total{kind="429"} 1\n' in text
+    assert 'voicebase_batch_bytes_sent_total 10\n' in text
+
+def test_reporter_writes_periodically_and_at_the_end(tmp_path):
+    path = str(tmp_path / 'metrics.prom')
+    reporter = MetricsReporter(
+        path = path, format = FORMAT_PROMETHEUS, interval = 0.01
+    )
+    with reporter:
+        time.sleep(0.05)
+        with open(path) as metrics_file:
+            assert 'bytes_sent_total 0' in metrics_file.read()
+        reporter.metrics.add_bytes_sent(5)
+
+    with open(path) as metrics_file:
+        assert 'bytes_sent_total 5' in metrics_file.read()
+
+def test_batch_upload_records_every_stage(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(b'x' * 1000)
+    (tmp_path / 'media.txt').write_text('a.wav\na.wav\n')
+    metrics_path = str(tmp_path / 'metrics.json')
+
+    with MockVoiceBaseServer(throttle_rate = 0.5, retry_after = 0.01, seed = 3) as server:
+        batch_upload = BatchUpload(
+            token = 'test',
+            media_directory = str(tmp_path),
+            client_kwargs = { 'api_url': server.url, 'max_retries': 10 },
+            metrics_kwargs = { 'path': metrics_path }
+        )
+        batch_upload.process(
+            input_media_filename_list = str(tmp_path / 'media.txt'),
+            results_path = str(tmp_path / 'results.csv')
+        )
+
+    with open(metrics_path) as metrics_file:
+        metrics = json.load(metrics_file)
+
+    assert metrics['stages']['csv_read']['count'] == 3
+    assert metrics['stages']['response_parse']['count'] == 2
+    assert metrics['stages']['result_write']['count'] == 2
+    assert metrics['stages']['http_request']['count'] == \
+        sum(metrics['responses'].values())
+    assert metrics['responses']['200'] == 2
+    assert metrics['bytes_sent'] > 2000
+    assert metrics['bytes_received'] > 0
@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+
+from BatchUpload import BatchUpload
+from BatchUploadInput import BatchUploadListReader
+from ManifestPlanner import ManifestPlanner, MediaDirectoryIndex
+from ManifestPlanner import sniff_mime_type, is_valid_url
+
+WAV = b'RIFF\x24\x00\x00\x00WAVEfmt ' + b'\x00' * 100
+
+def test_sniff_mime_type():
+    assert sniff_mime_type(WAV) == 'audio/wav'
+    assert sniff_mime_type(b'ID3\x04' + b'\x00' * 12) == 'audio/mpeg'
+    assert sniff_mime_type(b'\xff\xfb\x90\x00') == 'audio/mpeg'
+    assert sniff_mime_type(b'\x00\x00\x00\x20ftypisom') == 'video/mp4'
+    assert sniff_mime_type(b'hello, world') is None
+    assert sniff_mime_type(b'') is None
+
+def test_is_valid_url():
+    assert is_valid_url('https://example.com/a.wav')
+    assert not is_valid_url('example.com/a.wav')
+    assert not is_valid_url('ftp://example.com/a.wav')
+    assert not is_valid_url('http://[bad/a.wav')
+
+def test_directory_index(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(WAV)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.wav').write_bytes(WAV)
+    index = MediaDirectoryIndex(str(tmp_path))
+
+    assert index.exists(str(tmp_path / 'a.wav'))
+    assert index.exists(str(tmp_path / 'sub' / 'b.wav'))
+    assert not index.exists(str(tmp_path / 'sub'))
+    assert not index.exists(str(tmp_path / 'missing' / 'c.wav'))
+
+def test_plan_finds_every_problem(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(WAV)
+    (tmp_path / 'empty.wav').write_bytes(b'')
+    (tmp_path / 'notes.txt').write_bytes(b'not media at all')
+    (tmp_path / 'media.txt').write_text(
+        'a.wav\nmissing.wav\nempty.wav\nnotes.txt\na.wav\n' + 'a.wav\n' * 600
+    )
+    reader = BatchUploadListReader(media_directory = str(tmp_path))
+
+    plan = ManifestPlanner(
+        media_directory = str(tmp_path), upload_mbps = 8
+    ).plan(reader.MediaFilenames(str(tmp_path / 'media.txt')))
+
+    assert plan['rows'] == 605
+    assert plan['files'] == 605
+    assert plan['total_bytes'] == 602 * len(WAV) + len(b'not media at all')
+    assert plan['mime_types'] == { 'audio/wav': 602 }
+    assert plan['problem_counts'] == {
+        'duplicate id': 601,
+        'empty file': 1,
+        'missing file': 1,
+        'unrecognized media type': 1
+    }
+    assert [ problem['row'] for problem in plan['problems'][:4] ] == \
+        [ 1, 2, 3, 4 ]
+    assert plan['problems'][3]['detail'] == 'first at row 0'
+    assert plan['estimated_upload_seconds'] == 605 * 0.5
+
+def test_plan_stops_at_an_invalid_row(tmp_path):
+    (tmp_path / 'rows.csv').write_text(
+        'mediaUrl\nhttps://example.com/a.wav\nexample.com/b.wav\n\nx\n'
+    )
+    (tmp_path / 'bad.csv').write_text('other\n1\n')
+    reader = BatchUploadListReader(fast = True)
+    planner = ManifestPlanner()
+
+    plan = planner.plan(reader.CsvNewUploads(str(tmp_path / 'rows.csv')))
+    bad_plan = planner.plan(reader.CsvNewUploads(str(tmp_path / 'bad.csv')))
+
+    assert plan['urls'] == 3
+    assert plan['problem_counts'] == { 'malformed url': 2 }
+    assert bad_plan['rows'] == 0
+    assert bad_plan['problems'][0]['problem'] == 'invalid row'
+
+def test_batch_upload_plan_writes_a_plan_file(tmp_path):
+    (tmp_path / 'a.wav').write_bytes(WAV)
+    (tmp_path / 'media.txt').write_text('a.wav\n')
+    plan_path = str(tmp_path / 'plan.json')
+
+    BatchUpload(token = 'test', media_directory = str(tmp_path)).plan(
+        input_media_filename_list = str(tmp_path / 'media.txt'),
+        plan_path = plan_path
+    )
+
+    with open(plan_path) as plan_file:
+        assert json.load(plan_file)['total_bytes'] == len(WAV)
+
+def test_validate_exits_1_on_problems(tmp_path):
+    (tmp_path / 'media.txt').write_text('missing.wav\n')
+
+    completed = subprocess.run(
+        [
+            sys.executable, 'BatchUpload.py', '--validate', '--token', 'test',
+            '--inputMediaFilenameList', str(tmp_path / 'media.txt'),
+            '--inputMediaDirectory', str(tmp_path)
+        ],
+        cwd = os.path.join(os.path.dirname(__file__), '..'),
+        capture_output = True,
+        text = True
+    )
+
+    assert completed.returncode == 1
+    assert 'missing file: 1' in completed.stdout
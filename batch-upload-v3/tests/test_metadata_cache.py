@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from BatchUpload import BatchUpload
+from MetadataCache import MetadataCache, document_digest
+from MockVoiceBaseServer import MockVoiceBaseServer
+
+def test_digest_ignores_key_order_and_whitespace():
+    assert document_digest('{"a": 1, "b": [2]}') == \
+        document_digest({ 'b': [ 2 ], 'a': 1 })
+    assert document_digest('{"a": 1}') != document_digest('{"a": 2}')
+    assert document_digest(None) is None
+
+def test_cache_keeps_digests_of_parts_not_sent(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    with MetadataCache(path) as cache:
+        cache.record('m', 'meta1', 'conf1', 'accepted')
+        cache.record('m', 'meta2', None, 'finished')
+
+    with MetadataCache(path) as cache:
+        entry = cache.get('m')
+        assert (entry.metadata, entry.configuration, entry.status) == \
+            ('meta2', 'conf1', 'finished')
+        assert cache.get('other') is None
+
+def write_updates_csv(path, media_ids, label):
+    with open(path, 'w') as csv_file:
+        csv_file.write('mediaId,label\n')
+        for media_id in media_ids:
+            csv_file.write(media_id + ',' + label(media_id) + '\n')
+
+def update(server, tmp_path, **kwargs):
+    batch_upload = BatchUpload(
+        token = 'test',
+        input_media_id_column = 'mediaId',
+        parallelism = 4,
+        use_asyncio = kwargs.pop('use_asyncio', False),
+        metadata_only = kwargs.pop('metadata_only', False),
+        default_configuration = json.dumps({ 'speakers': [] }),
+        client_kwargs = { 'api_url': server.url }
+    )
+    batch_upload.process(
+        input_csv = str(tmp_path / 'updates.csv'),
+        update_existing_media = True,
+        results_path = str(tmp_path / 'results.csv'),
+        metadata_cache_path = str(tmp_path / 'cache.db'),
+        **kwargs
+    )
+    with open(tmp_path / 'results.csv') as results_file:
+        return [ row.split(',') for row in results_file.read().splitlines() ]
+
+@pytest.mark.parametrize('use_asyncio', [ False, True ])
+def test_updates_send_only_what_changed(tmp_path, use_asyncio):
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(6) ]
+        write_updates_csv(tmp_path / 'updates.csv', media_ids, lambda _: 'a')
+
+        first = update(server, tmp_path, use_asyncio = use_asyncio)
+        assert sorted(parts for _, parts in server.updates) == \
+            [ [ 'configuration', 'metadata' ] ] * 6
+
+        # Nothing changed: no request, same results
+        second = update(server, tmp_path, use_asyncio = use_asyncio)
+        assert len(server.updates) == 6
+        assert second == first
+
+        write_updates_csv(
+            tmp_path / 'updates.csv', media_ids,
+            lambda media_id: 'b' if media_id == media_ids[3] else 'a'
+        )
+        third = update(server, tmp_path, use_asyncio = use_asyncio)
+        assert server.updates[6:] == [ (media_ids[3], [ 'metadata' ]) ]
+        assert [ row[1] for row in third ] == media_ids
+
+def test_metadata_only_never_sends_the_configuration(tmp_path):
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(3) ]
+        write_updates_csv(tmp_path / 'updates.csv', media_ids, lambda _: 'a')
+
+        update(server, tmp_path, metadata_only = True)
+
+    assert [ parts for _, parts in server.updates ] == [ [ 'metadata' ] ] * 3
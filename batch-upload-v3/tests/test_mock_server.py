@@ -0,0 +1,79 @@
+import time
+
+import requests
+
+from Benchmark import percentiles
+from MockVoiceBaseServer import MockVoiceBaseServer
+from VoiceBaseV3Client import VoiceBaseV3Client, DEFAULT_API_URL
+
+def test_api_url_is_configurable():
+    assert VoiceBaseV3Client('test').url == DEFAULT_API_URL
+    assert VoiceBaseV3Client(
+        'test', api_url = 'http://localhost:8080/v3/'
+    ).url == 'http://localhost:8080/v3'
+
+def test_client_retries_through_injected_errors():
+    with MockVoiceBaseServer(
+        throttle_rate = 0.3, error_rate = 0.1, retry_after = 0.01, seed = 1
+    ) as server:
+        client = VoiceBaseV3Client(
+            'test', api_url = server.url, max_retries = 20
+        )
+        client.throttle.base_delay = 0.001
+        media_ids = [ server.create_media()['mediaId'] for _ in range(30) ]
+        for media_id in media_ids:
+            assert client.media[media_id].get()['mediaId'] == media_id
+
+        assert server.stats[429] > 0 and server.stats[500] > 0
+        assert server.stats[200] == 30
+
+def test_posts_are_only_retried_when_not_processed():
+    with MockVoiceBaseServer(
+        throttle_rate = 0.3, retry_after = 0.01, seed = 1
+    ) as server:
+        client = VoiceBaseV3Client(
+            'test', api_url = server.url, max_retries = 20
+        )
+        media_ids = [
+            client.media.post(media_url = 'http://a/b.mp3')['mediaId']
+            for _ in range(30)
+        ]
+        assert all(media_ids)
+        assert server.stats[429] > 0
+
+        # A 500 may come after the media was created: not sent again
+        server.throttle_rate = 0
+        server.error_rate = 1
+        response = client.media.post(media_url = 'http://a/b.mp3')
+        assert response['status'] == 500
+        assert server.stats[500] == 1
+
+def test_status_progression():
+    with MockVoiceBaseServer(processing_time = 0.2, transcript_words = 3) as server:
+        client = VoiceBaseV3Client('test', api_url = server.url)
+        media_id = client.media.post(media_url = 'http://a/b.mp3')['mediaId']
+
+        statuses = []
+        while not statuses or statuses[-1] != 'finished':
+            statuses.append(client.media[media_id].get()['status'])
+            time.sleep(0.01)
+        media = client.media[media_id].get()
+
+    assert statuses[0] in [ 'accepted', 'scheduled' ]
+    assert 'running' in statuses
+    assert len(media['transcript']['words']) == 3
+
+def test_chunked_uploads_and_callbacks():
+    with MockVoiceBaseServer() as server:
+        response = requests.post(
+            server.url + '/media',
+            data = (chunk for chunk in [ b'a' * 1000, b'b' * 500 ])
+        )
+        requests.post(server.callback_url, json = { 'mediaId': 'x' })
+
+        assert response.json()['bytesReceived'] == 1500
+        assert server.callbacks == 1
+
+def test_percentiles():
+    assert percentiles([]) == [ 0.0 ] * 4
+    assert percentiles([ i / 100 for i in range(100) ]) == [ 0.5, 0.9, 0.99, 0.99 ]
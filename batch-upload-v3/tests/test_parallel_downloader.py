@@ -0,0 +1,44 @@
+import csv
+import os
+
+from DownloadsRow import DownloadsRow
+from MockVoiceBaseServer import MockVoiceBaseServer
+from ParallelDownloader import ParallelDownloader
+
+def write_results_csv(server, path, rows):
+    media_ids = []
+    with open(path, 'w') as results_file:
+        results_writer = csv.writer(results_file)
+        for i in range(rows):
+            media_id = server.create_media()['mediaId']
+            media_ids.append(media_id)
+            results_writer.writerow([ str(i), media_id, 'accepted' ])
+    return media_ids
+
+def run_downloader(server, directory, **kwargs):
+    downloader = ParallelDownloader(
+        input_csv = os.path.join(directory, 'results.csv'),
+        download_directory = str(directory),
+        output_csv = os.path.join(directory, 'downloads.csv'),
+        token = 'test',
+        **kwargs
+    )
+    downloader.voicebase.url = server.url
+    return list(downloader.output(downloader.download(downloader.input())))
+
+def test_more_rows_than_the_old_queue_capacity(tmp_path):
+    with MockVoiceBaseServer() as server:
+        media_ids = write_results_csv(server, tmp_path / 'results.csv', 350)
+        downloads = run_downloader(server, tmp_path, parallelism = 8)
+
+    assert sorted(download.media_id for download in downloads) == sorted(media_ids)
+    for media_id in media_ids:
+        assert (tmp_path / (media_id + '.json')).exists()
+
+def test_input_order(tmp_path):
+    with MockVoiceBaseServer() as server:
+        media_ids = write_results_csv(server, tmp_path / 'results.csv', 50)
+        run_downloader(server, tmp_path, parallelism = 8, results_order = 'input')
+
+    rows = list(DownloadsRow.read_from_csv_filepath(tmp_path / 'downloads.csv'))
+    assert [ row.media_id for row in rows ] == media_ids
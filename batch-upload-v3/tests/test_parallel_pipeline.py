@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ParallelPipeline import async_map, parallel_map
+
+def test_parallel_map_keeps_input_order():
+    def slow_for_small(item):
+        time.sleep(0.01 * (10 - item))
+        return item * 2
+
+    results = list(parallel_map(slow_for_small, range(10), parallelism = 10))
+
+    assert results == [ item * 2 for item in range(10) ]
+
+def test_parallel_map_completion_order_returns_everything():
+    def slow_for_small(item):
+        time.sleep(0.02 * (10 - item))
+        return item
+
+    results = list(parallel_map(
+        slow_for_small, range(10), parallelism = 10, order = 'completion'
+    ))
+
+    assert sorted(results) == list(range(10))
+    assert results[0] == 9
+
+def test_parallel_map_bounds_items_pulled_ahead():
+    pulled = []
+
+    def source():
+        for item in range(100):
+            pulled.append(item)
+            yield item
+
+    results = parallel_map(
+        lambda item: item, source(), parallelism = 2, max_in_flight = 4
+    )
+    assert next(results) == 0
+    assert len(pulled) <= 4
+
+    assert list(results) == list(range(1, 100))
+
+def test_parallel_map_reraises_exceptions():
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError('three')
+        return item
+
+    with pytest.raises(ValueError):
+        list(parallel_map(fail_on_three, range(10), parallelism = 2))
+
+def test_parallel_map_rejects_unknown_order():
+    with pytest.raises(ValueError):
+        parallel_map(lambda item: item, [], order = 'random')
+
+def test_async_map_keeps_input_order():
+    async def slow_for_small(item):
+        await asyncio.sleep(0.01 * (10 - item))
+        return item * 2
+
+    results = list(async_map(slow_for_small, range(10), concurrency = 10))
+
+    assert results == [ item * 2 for item in range(10) ]
+
+def test_async_map_completion_order_returns_everything():
+    async def slow_for_small(item):
+        await asyncio.sleep(0.01 * (10 - item))
+        return item
+
+    results = list(async_map(
+        slow_for_small, range(10), concurrency = 10, order = 'completion'
+    ))
+
+    assert sorted(results) == list(range(10))
+    assert results[0] == 9
+
+def test_async_map_bounds_in_flight():
+    state = { 'in_flight': 0, 'peak': 0 }
+
+    async def track(item):
+        state['in_flight'] += 1
+        state['peak'] = max(state['peak'], state['in_flight'])
+        await asyncio.sleep(0.001)
+        state['in_flight'] -= 1
+        return item
+
+    assert list(async_map(track, range(100), concurrency = 5)) == list(range(100))
+    assert state['peak'] <= 5
+
+def test_async_map_reraises_exceptions():
+    async def fail_on_three(item):
+        if item == 3:
+            raise ValueError('three')
+        return item
+
+    with pytest.raises(ValueError):
+        list(async_map(fail_on_three, range(10), concurrency = 2))
+
+def test_async_map_runs_cleanup_and_stops_early():
+    cleaned_up = threading.Event()
+
+    async def cleanup():
+        cleaned_up.set()
+
+    async def hang(item):
+        if item > 0:
+            await asyncio.sleep(60)
+        return item
+
+    start = time.monotonic()
+    results = async_map(hang, range(10), concurrency = 4, cleanup = cleanup)
+    assert next(results) == 0
+    results.close()
+
+    assert cleaned_up.is_set()
+    assert time.monotonic() - start < 10
@@ -0,0 +1,157 @@
+import asyncio
+import io
+import time
+
+import pytest
+
+from RateLimiter import AdaptiveConcurrencyLimiter, HttpResponse
+from RateLimiter import RequestThrottle, TokenBucket, parse_retry_after
+from VoiceBaseV3Client import VoiceBaseV3Client
+
+def responses(*status_codes, **headers):
+    """A send function answering with status_codes in turn"""
+    remaining = list(status_codes)
+    calls = []
+
+    def send():
+        calls.append(len(calls))
+        return HttpResponse(remaining.pop(0), headers, '{}')
+
+    send.calls = calls
+    return send
+
+def fast_throttle(**kwargs):
+    return RequestThrottle(
+        retry_base_delay = 0.001, retry_max_delay = 0.01, **kwargs
+    )
+
+def test_token_bucket_spaces_requests_after_burst():
+    bucket = TokenBucket(rate = 100, burst = 2)
+
+    waits = [ bucket.reserve() for _ in range(4) ]
+
+    assert waits[0] == 0 and waits[1] == 0
+    assert waits[2] == pytest.approx(0.01, abs = 0.005)
+    assert waits[3] == pytest.approx(0.02, abs = 0.005)
+
+def test_token_bucket_unlimited_by_default():
+    bucket = TokenBucket()
+
+    assert [ bucket.reserve() for _ in range(100) ] == [ 0.0 ] * 100
+
+def test_token_bucket_pause_holds_everyone_back():
+    bucket = TokenBucket()
+    bucket.pause(0.5)
+
+    assert bucket.reserve() == pytest.approx(0.5, abs = 0.05)
+
+def test_concurrency_limiter_is_aimd():
+    limiter = AdaptiveConcurrencyLimiter(maximum = 8)
+    for _ in range(8):
+        assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+    limiter.release(throttled = True)
+    assert limiter.limit == 4
+
+    for _ in range(7):
+        limiter.release()
+    assert 4 < limiter.limit < 8
+    assert limiter.in_flight == 0
+
+def test_retries_throttled_and_server_errors():
+    throttle = fast_throttle()
+    send = responses(429, 503, 200)
+
+    assert throttle.call(send).status_code == 200
+    assert len(send.calls) == 3
+
+def test_retry_statuses_can_be_narrowed():
+    throttle = fast_throttle()
+    send = responses(429, 500, 200)
+
+    assert throttle.call(send, retry_statuses = { 429 }).status_code == 500
+    assert len(send.calls) == 2
+
+def test_gives_up_after_max_retries():
+    throttle = fast_throttle(max_retries = 2)
+    send = responses(500, 500, 500, 200)
+
+    assert throttle.call(send).status_code == 500
+    assert len(send.calls) == 3
+
+def test_client_errors_are_not_retried():
+    throttle = fast_throttle()
+    send = responses(404, 200)
+
+    assert throttle.call(send).status_code == 404
+    assert len(send.calls) == 1
+
+def test_retries_network_errors_and_rewinds():
+    throttle = fast_throttle()
+    attachment = io.BytesIO(b'media')
+    attempts = []
+
+    def send():
+        attempts.append(attachment.read())
+        if len(attempts) < 3:
+            raise ConnectionError('reset')
+        return HttpResponse(200, {}, '{}')
+
+    response = throttle.call(
+        send,
+        retry_exceptions = (ConnectionError,),
+        rewind = lambda: attachment.seek(0)
+    )
+
+    assert response.status_code == 200
+    assert attempts == [ b'media' ] * 3
+
+def test_network_errors_raise_once_retries_run_out():
+    throttle = fast_throttle(max_retries = 1, max_concurrency = 4)
+
+    def send():
+        raise ConnectionError('reset')
+
+    with pytest.raises(ConnectionError):
+        throttle.call(send, retry_exceptions = (ConnectionError,))
+    assert throttle.concurrency.in_flight == 0
+
+def test_retry_after_is_honored():
+    throttle = RequestThrottle(retry_base_delay = 0.001)
+    send = responses(429, 200, **{ 'Retry-After': '0.2' })
+
+    start = time.monotonic()
+    throttle.call(send)
+
+    assert time.monotonic() - start >= 0.2
+
+def test_call_async_retries():
+    throttle = fast_throttle(max_concurrency = 2)
+    send = responses(502, 200)
+
+    async def send_async():
+        return send()
+
+    response = asyncio.run(throttle.call_async(send_async))
+
+    assert response.status_code == 200
+    assert throttle.concurrency.in_flight == 0
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+
+def test_client_rewinds_attachments():
+    client = VoiceBaseV3Client('test')
+    media = io.BytesIO(b'media')
+    media.seek(2)
+    rewind = client._rewinder({ 'media': ('a.mp3', media, 'audio/mpeg') })
+
+    media.read()
+    rewind()
+
+    assert media.tell() == 2
+    assert client._rewinder({ 'configuration': (None, '{}', None) }) is None
@@ -0,0 +1,136 @@
+import pytest
+
+import RenameDownloads
+from DownloadStore import open_store
+from RenameDownloads import ResultsRow, plan_renames
+
+def write_downloads(directory, keys, format = 'json'):
+    with open_store(str(directory), format) as store:
+        for key in keys:
+            store.put(key, key.encode())
+
+def stored(directory, format = 'json'):
+    with open_store(str(directory), format) as store:
+        return { key: data.decode() for key, data in store.scan() }
+
+def row(id, media_id, status = 'finished'):
+    return ResultsRow(id = id, media_id = media_id, status = status)
+
+def test_collisions_and_missing_downloads_are_found_up_front():
+    plan = plan_renames(
+        [
+            row('mpthreetest.mp3', 'm1'),
+            row('mpthreetest.mp3', 'm2'),
+            row('recording.mp3', 'm3'),
+            row('gone.mp3', 'm4'),
+            row('taken.mp3', 'm5'),
+            row('rejected.mp3', '', '400'),
+            row('a/b.mp3', 'm6')
+        ],
+        [ 'm1', 'm2', 'm3', 'm5', 'm6', 'taken.mp3' ]
+    )
+    problems = sorted((row.media_id, problem) for row, problem in plan.problems)
+    assert problems == [
+        ('m1', 'duplicate id'),
+        ('m2', 'duplicate id'),
+        ('m4', 'missing download'),
+        ('m5', 'id already taken'),
+        ('m6', 'invalid id')
+    ]
+    assert plan.waves == [ [ ('m3', 'recording.mp3') ] ]
+    assert plan.skipped == 1
+
+def test_chains_and_cycles_are_ordered():
+    plan = plan_renames(
+        [ row('b', 'a'), row('c', 'b'), row('y', 'x'), row('x', 'y') ],
+        [ 'a', 'b', 'x', 'y' ]
+    )
+    renamed = { 'a': 'a', 'b': 'b', 'x': 'x', 'y': 'y' }
+    for wave in plan.waves:
+        targets = [ target for _, target in wave ]
+        assert not set(targets) & set(renamed)
+        for source, target in wave:
+            renamed[target] = renamed.pop(source)
+    assert renamed == { 'b': 'a', 'c': 'b', 'y': 'x', 'x': 'y' }
+
+def test_nothing_is_renamed_when_there_are_problems(tmp_path):
+    write_downloads(tmp_path, [ 'm1', 'm2' ])
+    with pytest.raises(Exception):
+        RenameDownloads.rename(
+            [ row('same', 'm1'), row('same', 'm2') ], str(tmp_path)
+        )
+    assert stored(tmp_path) == { 'm1': 'm1', 'm2': 'm2' }
+
+@pytest.mark.parametrize('format', [ 'json', 'segment' ])
+def test_rename_and_undo(tmp_path, format):
+    downloads = tmp_path / 'downloads'
+    downloads.mkdir()
+    write_downloads(
+        downloads, [ 'm' + str(i) for i in range(30) ] + [ 'a', 'b' ], format
+    )
+    undo_log = str(tmp_path / 'undo.csv')
+
+    rows = [
+        row('id' + str(i), 'm' + str(i)) for i in [ 0 ] + list(range(4, 30))
+    ]
+    # m0 has a problem; a chain, a -> b -> c, and a cycle, m1 -> m2 -> m3 -> m1
+    rows = rows + [ row('same', 'm0') ] + [ row('b', 'a'), row('c', 'b') ] + \
+        [ row('m2', 'm1'), row('m3', 'm2'), row('m1', 'm3') ]
+
+    RenameDownloads.rename(
+        rows,
+        str(downloads),
+        store_format = format,
+        undo_log = undo_log,
+        skip_problems = True,
+        parallelism = 4
+    )
+    renamed = stored(downloads, format)
+    assert renamed['id5'] == 'm5'
+    assert renamed['m0'] == 'm0'
+    assert (renamed['b'], renamed['c']) == ('a', 'b')
+    assert (renamed['m2'], renamed['m3'], renamed['m1']) == ('m1', 'm2', 'm3')
+    assert len(renamed) == 32
+
+    with open_store(str(downloads), format) as store:
+        # 26 renames, 2 for the chain and 4 for the cycle (one aside first)
+        assert RenameDownloads.undo(undo_log, store, parallelism = 4) == 32
+        assert RenameDownloads.undo(undo_log, store) == 0
+    assert stored(downloads, format) == {
+        key: key for key in [ 'm' + str(i) for i in range(30) ] + [ 'a', 'b' ]
+    }
+
+def test_undo_of_an_interrupted_rename(tmp_path):
+    write_downloads(tmp_path, [ 'a', 'b', 'c' ])
+    undo_log = str(tmp_path / 'undo.csv')
+    # Wave 0 done, wave 1 logged but only half done
+    with open(undo_log, 'w') as log_file:
+        log_file.write('0,c,d\n1,a,c\n1,b,e\n')
+    with open_store(str(tmp_path)) as store:
+        store.rename('c', 'd')
+        store.rename('a', 'c')
+        assert RenameDownloads.undo(undo_log, store) == 2
+    assert stored(tmp_path) == { 'a': 'a', 'b': 'b', 'c': 'c' }
+
+def test_failed_renames_are_rolled_back(tmp_path):
+    write_downloads(tmp_path, [ 'm1', 'm2', 'm3' ])
+
+    class FailingStore:
+        def __init__(self, store):
+            self.store = store
+
+        def rename(self, key, new_key):
+            if key == 'm2':
+                raise OSError('simulated')
+            self.store.rename(key, new_key)
+
+    plan = plan_renames(
+        [ row('id1', 'm1'), row('id2', 'm2'), row('id3', 'm3') ],
+        [ 'm1', 'm2', 'm3' ]
+    )
+    with open_store(str(tmp_path)) as store:
+        with pytest.raises(Exception):
+            RenameDownloads.apply_plan(
+                plan, FailingStore(store), str(tmp_path / 'undo.csv')
+            )
+    assert stored(tmp_path) == { 'm1': 'm1', 'm2': 'm2', 'm3': 'm3' }
@@ -0,0 +1,55 @@
+import random
+
+from BufferedCsvWriter import BufferedCsvWriter
+from ReorderBuffer import ReorderBuffer
+
+def shuffled(items, seed = 1):
+    items = list(items)
+    random.Random(seed).shuffle(items)
+    return items
+
+def test_restores_sequence_order():
+    items = [ (i, 'item' + str(i)) for i in range(200) ]
+    reorder_buffer = ReorderBuffer()
+
+    assert list(reorder_buffer.reorder(shuffled(items))) == items
+    assert reorder_buffer.spill_count == 0
+
+def test_items_come_out_as_soon_as_they_can():
+    out = []
+    reorder_buffer = ReorderBuffer(start = 5)
+
+    for item in reorder_buffer.reorder([ (6, 'b'), (5, 'a'), (8, 'd'), (7, 'c') ]):
+        out.append(item)
+        if item[0] == 6:
+            # (8, 'd') has not even been read yet
+            assert reorder_buffer.held == {}
+
+    assert [ sequence for sequence, _ in out ] == [ 5, 6, 7, 8 ]
+
+def test_spills_beyond_the_window(tmp_path):
+    # One slow item, 0, arrives last of 1000
+    items = [ (i, { 'value': 'x' * 100, 'i': i }) for i in range(1000) ]
+    reorder_buffer = ReorderBuffer(window = 10, spill_directory = str(tmp_path))
+
+    out = list(reorder_buffer.reorder(items[1:] + items[:1]))
+
+    assert out == items
+    assert reorder_buffer.spill_count == 989
+    assert len(reorder_buffer.held) == 0
+    assert reorder_buffer.spill_file is None
+
+def test_gaps_are_skipped_at_the_end():
+    items = [ (1, 'b'), (4, 'e'), (3, 'd') ]
+
+    assert list(ReorderBuffer(window = 1).reorder(items)) == \
+        [ (1, 'b'), (3, 'd'), (4, 'e') ]
+
+def test_csv_writer_flushes_every_n_rows(tmp_path):
+    path = tmp_path / 'out.csv'
+    with BufferedCsvWriter(str(path), flush_every = 3) as writer:
+        for i in range(4):
+            writer.writerow([ i, 'a,b' ])
+        assert path.read_bytes() == b'0,"a,b"\r\n1,"a,b"\r\n2,"a,b"\r\n'
+
+    assert path.read_bytes().count(b'\r\n') == 4
@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from BatchUploadInput import BatchUploadListReader
+from DownloadsRow import DownloadsRow
+from MergeShards import MergeShards
+from ResultsRow import ResultsRow
+from Sharding import Shard, shard_number
+
+def test_parse():
+    assert Shard.parse('2/5') == Shard(2, 5)
+    assert str(Shard(2, 5)) == '2/5'
+    for text in [ '0/5', '6/5', '1', 'a/b' ]:
+        with pytest.raises(ValueError):
+            Shard.parse(text)
+
+def test_shard_numbers_are_stable_and_spread():
+    ids = [ 'file' + str(i) + '.wav' for i in range(4000) ]
+    counts = [ 0 ] * 4
+    for id in ids:
+        counts[shard_number(id, 4) - 1] += 1
+
+    assert shard_number('file1.wav', 4) == shard_number('file1.wav', 4)
+    assert all(900 < count < 1100 for count in counts)
+
+@pytest.mark.parametrize('fast', [ False, True ])
+def test_shards_partition_the_input(tmp_path, fast):
+    (tmp_path / 'rows.csv').write_text(
+        'mediaUrl,team\n' +
+        ''.join('http://a/' + str(i) + '.wav,x\n' for i in range(100))
+    )
+    (tmp_path / 'media.txt').write_text(
+        ''.join(str(i) + '.wav\n' for i in range(100))
+    )
+
+    def ids(shard, method, path, start_row = 0):
+        reader = BatchUploadListReader(fast = fast, shard = shard)
+        return [
+            input.id
+            for input in getattr(reader, method)(str(tmp_path / path), start_row)
+        ]
+
+    for method, path in [
+        ('CsvNewUploads', 'rows.csv'), ('MediaFilenames', 'media.txt')
+    ]:
+        shards = [ ids(Shard(k, 3), method, path) for k in [ 1, 2, 3 ] ]
+
+        assert sorted(sum(shards, [])) == sorted(ids(None, method, path))
+        assert all(len(shard) > 10 for shard in shards)
+        # Row numbers, e.g. for --resume, count the shard's rows only
+        assert ids(Shard(2, 3), method, path, 5) == shards[1][5:]
+
+def test_results_and_downloads_rows(tmp_path):
+    (tmp_path / 'results.csv').write_text(
+        ''.join('f' + str(i) + ',m' + str(i) + ',accepted\n' for i in range(50))
+    )
+    list(DownloadsRow.write_to_csv_filepath(
+        [ DownloadsRow(media_id = 'm' + str(i), status = 'finished')
+            for i in range(50) ],
+        str(tmp_path / 'downloads.csv')
+    ))
+
+    results = [
+        row.id
+        for row in ResultsRow.read_from_csv_filepath(
+            str(tmp_path / 'results.csv'), shard = Shard(1, 2)
+        )
+    ]
+    downloads = [
+        row.media_id
+        for row in DownloadsRow.read_from_csv_filepath(
+            str(tmp_path / 'downloads.csv'), shard = Shard(1, 2)
+        )
+    ]
+
+    assert results == [ 'f' + str(i) for i in range(50)
+        if shard_number('f' + str(i), 2) == 1 ]
+    assert downloads == [ 'm' + str(i) for i in range(50)
+        if shard_number('m' + str(i), 2) == 1 ]
+
+def test_merge_downloads_keeps_one_header(tmp_path):
+    (tmp_path / 'd1.csv').write_bytes(b'mediaId,status,filename\r\na,finished,a.json\r\n')
+    (tmp_path / 'd2.csv').write_bytes(b'mediaId,status,filename\r\nb,finished,b.json')
+
+    MergeShards(
+        input_csvs = [ str(tmp_path / 'd1.csv'), str(tmp_path / 'd2.csv') ],
+        output_csv = str(tmp_path / 'd.csv')
+    ).merge()
+
+    assert (tmp_path / 'd.csv').read_bytes() == \
+        b'mediaId,status,filename\r\na,finished,a.json\r\nb,finished,b.json\r\n'
+
+def test_merge_results_from_the_command_line(tmp_path):
+    for k in [ 1, 2 ]:
+        (tmp_path / ('results-' + str(k) + '.csv')).write_text(
+            'f' + str(k) + ',m' + str(k) + ',accepted\n'
+        )
+
+    # The second time, the glob also matches the merged CSV, which is skipped
+    for _ in range(2):
+        subprocess.run(
+            [
+                sys.executable, 'MergeShards.py',
+                '--inputCsv', str(tmp_path / 'results-*.csv'),
+                '--outputCsv', str(tmp_path / 'results-all.csv')
+            ],
+            cwd = os.path.join(os.path.dirname(__file__), '..'),
+            check = True,
+            capture_output = True
+        )
+
+    assert (tmp_path / 'results-all.csv').read_text() == \
+        'f1,m1,accepted\nf2,m2,accepted\n'
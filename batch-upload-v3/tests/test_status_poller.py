@@ -0,0 +1,93 @@
+import os
+import threading
+
+from Downloader import Downloader
+from MockVoiceBaseServer import MockVoiceBaseServer
+from StatusPoller import StatusPoller
+
+def scripted_check(statuses):
+    """A check answering each item's statuses in turn"""
+    remaining = { item: list(item_statuses) for item, item_statuses in statuses.items() }
+    checks = []
+    lock = threading.Lock()
+
+    def check(item, last_check):
+        with lock:
+            checks.append(item)
+            status = remaining[item].pop(0)
+        return status, (item, status, last_check)
+
+    check.checks = checks
+    return check
+
+def test_yields_items_once_they_are_done():
+    check = scripted_check({
+        'a': [ 'finished' ],
+        'b': [ 'accepted', 'running', 'running', 'finished' ],
+        'c': [ 'scheduled', 'failed' ]
+    })
+    poller = StatusPoller(check, parallelism = 2, interval = 0.001)
+
+    outputs = list(poller.poll([ 'a', 'b', 'c' ]))
+
+    assert sorted(outputs) == [
+        ('a', 'finished', False),
+        ('b', 'finished', False),
+        ('c', 'failed', False)
+    ]
+    assert check.checks.count('b') == 4
+    assert check.checks.count('c') == 2
+
+def test_timeout_yields_pending_items_as_they_are():
+    check = scripted_check({ 'a': [ 'running' ] * 100 })
+    poller = StatusPoller(check, interval = 0.01, timeout = 0.05)
+
+    outputs = list(poller.poll([ 'a' ]))
+
+    assert outputs == [ ('a', 'running', True) ]
+    assert 2 <= len(check.checks) < 10
+
+def test_interval_backs_off_by_status():
+    poller = StatusPoller(None, interval = 10, max_interval = 60)
+
+    assert poller.next_interval('running', 1) == 10
+    assert poller.next_interval('running', 2) == 15
+    assert poller.next_interval('accepted', 1) == 30
+    assert poller.next_interval('running', 20) == 60
+
+def test_many_pending_items():
+    items = [ str(i) for i in range(2000) ]
+    check = scripted_check({ item: [ 'running', 'finished' ] for item in items })
+    poller = StatusPoller(check, parallelism = 8, interval = 0.001)
+
+    outputs = list(poller.poll(items))
+
+    assert len(outputs) == 2000
+    assert len(check.checks) == 4000
+
+def test_downloader_waits_for_media_to_finish(tmp_path):
+    with MockVoiceBaseServer() as server:
+        media = server.create_media()
+        media['status'] = 'running'
+        media_id = media['mediaId']
+
+        results_csv = tmp_path / 'results.csv'
+        results_csv.write_text('a.mp3,' + media_id + ',accepted\n')
+
+        downloader = Downloader(
+            input_csv = str(results_csv),
+            download_directory = str(tmp_path),
+            output_csv = str(tmp_path / 'downloads.csv'),
+            token = 'test',
+            poll = True,
+            poll_interval = 0.01
+        )
+        downloader.voicebase.url = server.url
+
+        finish = threading.Timer(0.1, media.update, [ { 'status': 'finished' } ])
+        finish.start()
+        downloads = list(downloader.download(downloader.input()))
+        finish.join()
+
+    assert [ download.status for download in downloads ] == [ 'finished' ]
+    assert os.path.exists(tmp_path / (media_id + '.json'))
@@ -0,0 +1,146 @@
+import io
+import json
+import os
+
+import pytest
+
+from Downloader import Downloader
+from MockVoiceBaseServer import MockVoiceBaseServer
+from StreamingJson import JsonKeyScanner, ScanningWriter
+
+DOCUMENT = json.dumps({
+    '_links': { 'self': { 'href': '/v3/media/x', 'status': 'nested' } },
+    'note': 'a "quoted" \\ status: "running", {not json}',
+    'words': [ { 'w': 'status', 's': 1 }, [ 'status', 2 ] ],
+    'mediaId': 'x',
+    'status': 'finished',
+    'after': 1
+}, indent = 1).encode()
+
+def scan(chunks, key = 'status'):
+    scanner = JsonKeyScanner(key)
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner
+
+@pytest.mark.parametrize('chunk_size', [ 1, 2, 3, 7, 64, len(DOCUMENT) ])
+def test_finds_top_level_key_across_chunks(chunk_size):
+    chunks = [
+        DOCUMENT[i:i + chunk_size] for i in range(0, len(DOCUMENT), chunk_size)
+    ]
+
+    scanner = scan(chunks)
+
+    assert scanner.found
+    assert scanner.value == 'finished'
+
+def test_scalar_values_split_across_chunks():
+    scanner = scan([ b'{"status": 4', b'04, "x": 1}' ])
+
+    assert scanner.value == 404
+
+def test_escaped_values_and_keys():
+    assert scan([ b'{"st\\u0061tus": "a\\"b"}' ]).value == 'a"b'
+
+def test_missing_or_nested_key_is_not_found():
+    assert not scan([ b'{"media": {"status": "finished"}}' ]).found
+    assert not scan([ b'[{"status": "finished"}]' ]).found
+    assert not scan([ b'{"status": {"code": 1}}' ]).found
+
+def test_only_unfinished_tokens_are_buffered():
+    scanner = JsonKeyScanner()
+    scanner.feed(b'{"text": "' + b'word ' * 100000)
+
+    assert len(scanner.buffer) == 0
+
+def test_scanning_writer_starts_over_when_truncated():
+    file = io.BytesIO()
+    writer = ScanningWriter(file)
+    writer.write(b'{"status": "run')
+    writer.seek(0)
+    writer.truncate()
+    writer.write(b'{"status": "finished"}')
+
+    assert writer.value == 'finished'
+    assert file.getvalue() == b'{"status": "finished"}'
+
+def test_raw_download_copies_the_body_as_is(tmp_path):
+    with MockVoiceBaseServer() as server:
+        media_id = server.create_media({ 'words': [ 'hello' ] * 1000 })['mediaId']
+        results_csv = tmp_path / 'results.csv'
+        results_csv.write_text('a.mp3,' + media_id + ',accepted\n')
+
+        downloader = Downloader(
+            input_csv = str(results_csv),
+            download_directory = str(tmp_path),
+            output_csv = str(tmp_path / 'downloads.csv'),
+            token = 'test',
+            raw = True
+        )
+        downloader.voicebase.url = server.url
+        downloads = list(downloader.download(downloader.input()))
+        expected = server.media[media_id]
+
+    assert [ download.status for download in downloads ] == [ 'accepted' ]
+    with open(tmp_path / (media_id + '.json')) as download_file:
+        assert json.load(download_file) == expected
+    assert not os.path.exists(tmp_path / (media_id + '.json.part'))
+
+def test_raw_download_with_asyncio(tmp_path):
+    pytest.importorskip('aiohttp')
+
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(20) ]
+        results_csv = tmp_path / 'results.csv'
+        results_csv.write_text(''.join(
+            'a.mp3,' + media_id + ',accepted\n' for media_id in media_ids
+        ))
+
+        downloader = Downloader(
+            input_csv = str(results_csv),
+            download_directory = str(tmp_path),
+            output_csv = str(tmp_path / 'downloads.csv'),
+            token = 'test',
+            raw = True,
+            use_asyncio = True,
+            concurrency = 5
+        )
+        downloader.async_voicebase.url = server.url
+        downloads = list(downloader.download(downloader.input()))
+
+    assert sorted(download.media_id for download in downloads) == sorted(media_ids)
+    for media_id in media_ids:
+        with open(tmp_path / (media_id + '.json')) as download_file:
+            assert json.load(download_file)['mediaId'] == media_id
+
+@pytest.mark.parametrize('use_asyncio', [ False, True ])
+def test_failed_raw_download_is_not_stored(tmp_path, use_asyncio):
+    if use_asyncio:
+        pytest.importorskip('aiohttp')
+
+    with MockVoiceBaseServer() as server:
+        media_id = server.create_media()['mediaId']
+        results_csv = tmp_path / 'results.csv'
+        results_csv.write_text('a.mp3,' + media_id + ',accepted\n')
+
+        downloader = Downloader(
+            input_csv = str(results_csv),
+            download_directory = str(tmp_path),
+            output_csv = str(tmp_path / 'downloads.csv'),
+            token = 'test',
+            raw = True,
+            use_asyncio = use_asyncio,
+            download_index_path = str(tmp_path / 'index.sqlite'),
+            client_kwargs = { 'max_retries': 0 }
+        )
+        downloader.voicebase.url = server.url
+        if use_asyncio:
+            downloader.async_voicebase.url = server.url
+        server.error_rate = 1
+        with downloader.index:
+            downloads = list(downloader.download(downloader.input()))
+            assert downloader.index.get(media_id) is None
+
+    assert [ download.status for download in downloads ] == [ 500 ]
+    assert not any(name.startswith(media_id) for name in os.listdir(tmp_path))
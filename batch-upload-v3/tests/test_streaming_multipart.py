@@ -0,0 +1,99 @@
+import email.parser
+import io
+
+from MockVoiceBaseServer import MockVoiceBaseServer
+from StreamingMultipart import MultipartEncoder
+from VoiceBaseV3Client import VoiceBaseV3Client
+
+def read_all(encoder, block_size):
+    chunks = []
+    while True:
+        chunk = encoder.read(block_size)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+def parse(content_type, body):
+    message = email.parser.BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+    )
+    return {
+        part.get_param('name', header = 'content-disposition'): part
+        for part in message.get_payload()
+    }
+
+def test_body_is_valid_multipart():
+    media = io.BytesIO(b'header' + bytes(range(256)) * 100)
+    media.seek(6)
+    encoder = MultipartEncoder({
+        'media': ('a "b".wav', media, 'audio/wav'),
+        'configuration': ('configuration.json', '{"x": "é"}', 'application/json')
+    })
+
+    body = read_all(encoder, 1000)
+    parts = parse(encoder.content_type, body)
+
+    assert len(body) == encoder.len
+    assert parts['media'].get_payload(decode = True) == bytes(range(256)) * 100
+    assert parts['media'].get_filename() == 'a "b".wav'
+    assert parts['media'].get_content_type() == 'audio/wav'
+    assert parts['configuration'].get_payload(decode = True) == \
+        '{"x": "é"}'.encode('utf-8')
+
+def test_reads_are_bounded():
+    encoder = MultipartEncoder({
+        'media': ('big.wav', io.BytesIO(b'x' * 1000000), 'audio/wav')
+    })
+
+    assert len(encoder.read(8192)) == 8192
+    assert len(read_all(encoder, 8192)) == encoder.len - 8192
+
+def test_progress_is_reported_per_block():
+    updates = []
+    encoder = MultipartEncoder(
+        { 'media': ('a.wav', io.BytesIO(b'x' * 10000), 'audio/wav') },
+        progress = updates.append
+    )
+
+    read_all(encoder, 4096)
+
+    assert updates[-1].filename == 'a.wav'
+    assert updates[-1].done
+    assert [ update.bytes_sent for update in updates ][-1] == 10000
+    assert len(updates) >= 3
+
+def test_upload_streams_the_whole_file(tmp_path):
+    media_path = tmp_path / 'a.wav'
+    media_path.write_bytes(b'\0' * 3000000)
+    updates = []
+
+    with MockVoiceBaseServer() as server:
+        client = VoiceBaseV3Client('test')
+        client.url = server.url
+        with open(media_path, 'rb') as media_file:
+            response = client.media.post(
+                media = media_file,
+                filename = 'a.wav',
+                mime_type = 'audio/wav',
+                configuration = '{}',
+                progress = updates.append
+            )
+
+    assert response['status'] == 'accepted'
+    assert response['bytesReceived'] > 3000000
+    assert updates[-1].bytes_sent == 3000000
+
+def test_clients_sending_files_another_way_still_upload():
+    class FilesClient(VoiceBaseV3Client):
+        def _multipart_kwargs(self, request_kwargs, files, progress):
+            return { **request_kwargs, 'files': files }
+
+    with MockVoiceBaseServer() as server:
+        client = FilesClient('test', api_url = server.url)
+        response = client.media.post(
+            media = io.BytesIO(b'x' * 1000),
+            filename = 'a.wav',
+            mime_type = 'audio/wav'
+        )
+
+    assert response['bytesReceived'] > 1000
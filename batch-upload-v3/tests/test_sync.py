@@ -0,0 +1,86 @@
+import contextlib
+import io
+
+from DownloadStore import open_store
+from MediaListing import list_media, media_pages, prefetched
+from MockVoiceBaseServer import MockVoiceBaseServer
+from Sync import Sync
+from VoiceBaseV3Client import VoiceBaseV3Client
+
+def client(server):
+    return VoiceBaseV3Client('test', api_url = server.url)
+
+def test_listing_pages_through_every_media():
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(25) ]
+        pages = list(media_pages(client(server), page_size = 10))
+        listed = list(list_media(client(server), page_size = 7))
+
+    assert [ len(page) for page in pages ] == [ 10, 10, 5 ]
+    assert [ media['mediaId'] for media in listed ] == media_ids
+
+def test_listing_filters_by_status_and_date():
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(6) ]
+        for media_id in media_ids[::2]:
+            server.media[media_id]['status'] = 'finished'
+        server.media[media_ids[0]]['dateCreated'] = '2020-01-01T00:00:00.000Z'
+
+        finished = list(list_media(
+            client(server), statuses = [ 'finished' ], page_size = 2
+        ))
+        recent = list(list_media(
+            client(server), created_after = '2021-01-01', page_size = 2
+        ))
+        old = list(list_media(client(server), created_before = '2020-01-01'))
+
+    assert [ media['mediaId'] for media in finished ] == media_ids[::2]
+    assert [ media['mediaId'] for media in recent ] == media_ids[1:]
+    assert [ media['mediaId'] for media in old ] == media_ids[:1]
+
+def test_prefetched_keeps_order():
+    assert list(prefetched(iter(range(5)))) == [ 0, 1, 2, 3, 4 ]
+    assert list(prefetched([])) == []
+
+def run_sync(server, directory, **kwargs):
+    sync = Sync(
+        download_directory = str(directory),
+        output_csv = str(directory / 'synced.csv'),
+        token = 'test',
+        parallelism = 4,
+        page_size = 4,
+        **kwargs
+    )
+    sync.voicebase.url = server.url
+    with contextlib.redirect_stdout(io.StringIO()):
+        sync.process()
+    return sync
+
+def test_sync_downloads_only_the_differences(tmp_path):
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(10) ]
+        with open_store(str(tmp_path)) as store:
+            for media_id in media_ids[:3]:
+                store.put(media_id, b'{}')
+
+        sync = run_sync(server, tmp_path)
+        assert (sync.listed, sync.up_to_date, sync.to_download) == (10, 3, 7)
+        assert server.stats[200] == 3 + 7
+
+        sync = run_sync(server, tmp_path, dry_run = True)
+        assert sync.to_download == 0
+
+def test_sync_with_an_index_downloads_changed_statuses(tmp_path):
+    index_path = str(tmp_path / 'index.sqlite')
+    with MockVoiceBaseServer() as server:
+        media_ids = [ server.create_media()['mediaId'] for _ in range(6) ]
+
+        sync = run_sync(server, tmp_path, download_index_path = index_path)
+        assert sync.to_download == 6
+
+        server.media[media_ids[2]]['status'] = 'finished'
+        sync = run_sync(server, tmp_path, download_index_path = index_path)
+        assert (sync.up_to_date, sync.to_download) == (5, 1)
+
+    with open_store(str(tmp_path)) as store:
+        assert b'finished' in store.get(media_ids[2])
@@ -0,0 +1,80 @@
+import csv
+import os
+
+from BatchUpload import BatchUpload
+from MockVoiceBaseServer import MockVoiceBaseServer
+from UploadJournal import UploadJournal
+
+def write_media(directory, filenames):
+    for filename in filenames:
+        (directory / filename).write_bytes(b'media ' + filename.encode())
+    list_path = directory / 'media.txt'
+    list_path.write_text('\n'.join(filenames) + '\n')
+    return str(list_path)
+
+def run_batch_upload(server, directory, list_path, resume = False, **kwargs):
+    batch_upload = BatchUpload(
+        token = 'test',
+        media_directory = str(directory),
+        **kwargs
+    )
+    batch_upload.voicebase.url = server.url
+    batch_upload.process(
+        input_media_filename_list = list_path,
+        results_path = str(directory / 'results.csv'),
+        journal_path = str(directory / 'results.csv.journal'),
+        resume = resume
+    )
+    with open(directory / 'results.csv') as results_file:
+        return list(csv.reader(results_file))
+
+def test_journal_survives_reopening(tmp_path):
+    path = str(tmp_path / 'journal')
+    with UploadJournal(path) as journal:
+        journal.record(0, 'a.mp3', 'm0', 'accepted')
+        journal.record(1, 'a.mp3', None, 400)
+        journal.record(2, 'b.mp3', 'm2', 'accepted')
+
+    journal = UploadJournal(path, resume = True)
+
+    assert journal.resume_row() == 1
+    assert journal.completed_entry(2, 'b.mp3').media_id == 'm2'
+    assert journal.completed_entry(1, 'a.mp3') is None
+    # A different input at the same row is uploaded again
+    assert journal.completed_entry(2, 'c.mp3') is None
+    journal.close()
+
+def test_journal_starts_over_without_resume(tmp_path):
+    path = str(tmp_path / 'journal')
+    with UploadJournal(path) as journal:
+        journal.record(0, 'a.mp3', 'm0', 'accepted')
+
+    with UploadJournal(path) as journal:
+        assert journal.resume_row() == 0
+
+    with UploadJournal(path, resume = True) as journal:
+        assert journal.resume_row() == 0
+
+def test_resume_uploads_only_incomplete_rows(tmp_path):
+    filenames = [ 'a.mp3', 'b.mp3', 'a.mp3', 'c.mp3', 'd.mp3' ]
+    list_path = write_media(tmp_path, filenames)
+
+    with MockVoiceBaseServer() as server:
+        first_results = run_batch_upload(server, tmp_path, list_path)
+        assert len(server.media) == 5
+
+        # As if the run had died after rows 0, 1 and 3
+        with UploadJournal(str(tmp_path / 'results.csv.journal')) as journal:
+            for row_number in [ 0, 1, 3 ]:
+                journal.record(row_number, *first_results[row_number])
+
+        resumed_results = run_batch_upload(
+            server, tmp_path, list_path, resume = True, parallelism = 2
+        )
+
+    assert len(server.media) == 7
+    assert [ row[0] for row in resumed_results ] == filenames
+    for row_number in [ 0, 1, 3 ]:
+        assert resumed_results[row_number] == first_results[row_number]
+    for row_number in [ 2, 4 ]:
+        assert resumed_results[row_number][1] != first_results[row_number][1]
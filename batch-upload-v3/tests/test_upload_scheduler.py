@@ -0,0 +1,43 @@
+from BatchUpload import BatchUpload
+from BatchUploadInput import BatchUploadListReader
+from MockVoiceBaseServer import MockVoiceBaseServer
+from UploadScheduler import largest_first, input_size
+
+def test_largest_first(tmp_path):
+    for name, size in [ ('a', 10), ('b', 30), ('c', 20), ('d', 30) ]:
+        (tmp_path / name).write_bytes(b'x' * size)
+    (tmp_path / 'media.txt').write_text('a\nmissing\nb\nc\nd\n')
+    reader = BatchUploadListReader(media_directory = str(tmp_path))
+
+    inputs = largest_first(
+        reader.MediaFilenames(str(tmp_path / 'media.txt')), parallelism = 3
+    )
+
+    assert [ input.id for input in inputs ] == [ 'b', 'd', 'c', 'a', 'missing' ]
+    assert [ input_size(input) for input in inputs ] == [ 30, 30, 20, 10, 0 ]
+
+def test_batch_upload_largest_first_keeps_results_in_input_order(tmp_path):
+    names = []
+    for i in range(12):
+        name = str(i) + '.wav'
+        (tmp_path / name).write_bytes(b'x' * (1000 * (i % 4 + 1)))
+        names.append(name)
+    (tmp_path / 'media.txt').write_text('\n'.join(names) + '\n')
+
+    with MockVoiceBaseServer(upload_bandwidth = 1e6) as server:
+        BatchUpload(
+            token = 'test',
+            media_directory = str(tmp_path),
+            parallelism = 3,
+            schedule = 'lpt',
+            client_kwargs = { 'api_url': server.url }
+        ).process(
+            input_media_filename_list = str(tmp_path / 'media.txt'),
+            results_path = str(tmp_path / 'results.csv'),
+            journal_path = str(tmp_path / 'results.csv.journal')
+        )
+
+    with open(tmp_path / 'results.csv') as results_file:
+        ids = [ row.split(',')[0] for row in results_file.read().splitlines() ]
+
+    assert ids == names